@@ -0,0 +1,103 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+import datetime
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Application logging: callers only enqueue records, a background listener formats
+# them as JSON lines into a size-rotated cmail_app.log.
+
+LOG_FILE = os.getenv("CMAIL_LOG_FILE", "cmail_app.log")
+LOG_MAX_BYTES = int(os.getenv("CMAIL_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("CMAIL_LOG_BACKUP_COUNT", "5"))
+LOG_SAMPLE_EVERY = int(os.getenv("CMAIL_LOG_SAMPLE_EVERY", "100"))  # Keep 1 in N per-recipient lines per campaign
+LOG_QUEUE_SIZE = 100000
+
+# Logger for per-recipient lines of the send loops; its INFO records are sampled per campaign
+recipient_log = logging.getLogger("cmail.recipient")
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # Structured fields passed through `extra=`
+        for name, value in vars(record).items():
+            if name not in _RECORD_FIELDS:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Enqueues records without formatting them; the listener thread does the formatting
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Drop rather than block the caller when the writer falls behind
+            pass
+
+# Passes 1 in every LOG_SAMPLE_EVERY per-recipient INFO lines of each campaign.
+# Warnings and errors, and records without a campaign_id, always pass.
+class CampaignSampler(logging.Filter):
+    MAX_CAMPAIGNS = 1000
+
+    def __init__(self, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(every, 1)
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.name != recipient_log.name or record.levelno > logging.INFO:
+            return True
+        campaign_id = getattr(record, "campaign_id", None)
+        if campaign_id is None:
+            return True
+        with self._lock:
+            count = self._counts.pop(campaign_id, 0)
+            self._counts[campaign_id] = count + 1
+            if len(self._counts) > self.MAX_CAMPAIGNS:
+                self._counts.popitem(last=False)
+        return count % self.every == 0
+
+_listener = None
+_setup_lock = threading.Lock()
+
+# Function to route all logging through the queue; safe to call from every module
+def setup_logging(level=logging.INFO):
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+        file_handler.setFormatter(JsonLinesFormatter())
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = LazyQueueHandler(log_queue)
+        queue_handler.addFilter(CampaignSampler())
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(queue_handler)
+
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
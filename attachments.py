@@ -0,0 +1,143 @@
+import os
+import uuid
+import hashlib
+import base64
+import shutil
+import mimetypes
+import logging
+from email.policy import compat32
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+from campaigns import DATA_DIR
+
+# Load environment variables
+load_dotenv()
+
+# Attachments of a campaign are copied to ATTACHMENTS_DIR/<campaign id>/ (so a resumed
+# campaign still has them), base64-encoded once, and the encoded MIME parts are shared by
+# every recipient's message. Messages are generated with CRLF line endings, as SMTP sends
+# bytes unchanged.
+
+ATTACHMENTS_DIR = os.path.join(DATA_DIR, "attachments")
+MAX_ATTACHMENTS_BYTES = int(float(os.getenv("CMAIL_MAX_ATTACHMENTS_MB", "20")) * 1024 * 1024)  # Total per message
+COPY_CHUNK_SIZE = 1024 * 1024
+ENCODE_CHUNK_SIZE = 57 * 1024  # Multiple of 57 bytes, so every chunk encodes to whole 76-character lines
+MESSAGE_POLICY = compat32.clone(linesep="\r\n")  # Default header handling, with SMTP line endings
+
+class AttachmentError(ValueError):
+    pass
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+# Function to reject attachments over the size limit before anything is read or sent
+def check_attachment_sizes(sizes):
+    total = sum(sizes)
+    if total > MAX_ATTACHMENTS_BYTES:
+        raise AttachmentError(
+            f"Attachments total {format_size(total)}, over the {format_size(MAX_ATTACHMENTS_BYTES)} limit per message.")
+    return total
+
+# Function to digest the names and contents of files [(filename, file object, size)] for the
+# campaign ID; None when there are no files
+def attachments_digest(files):
+    if not files:
+        return None
+    entries = []
+    for filename, source, _ in files:
+        digest = hashlib.sha256()
+        position = source.tell()
+        for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        source.seek(position)
+        entries.append(f"{os.path.basename(filename)}:{digest.hexdigest()}")
+    return hashlib.sha256("\n".join(sorted(entries)).encode("utf-8")).hexdigest()
+
+def campaign_attachments_dir(campaign_id):
+    return os.path.join(ATTACHMENTS_DIR, campaign_id)
+
+# Function to stream files [(filename, file object, size)] into the campaign's attachment directory;
+# with no files the directory is left alone, so resuming a campaign keeps its saved attachments
+def save_campaign_attachments(campaign_id, files):
+    if not files:
+        return []
+    check_attachment_sizes(size for _, _, size in files)
+    directory = campaign_attachments_dir(campaign_id)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for filename, source, _ in files:
+        path = os.path.join(directory, os.path.basename(filename))
+        with open(path, "wb") as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        paths.append(path)
+    logging.info("Saved %d attachment(s) for campaign %s", len(paths), campaign_id)
+    return paths
+
+# Function to load the shared attachments of a campaign, or None when it has none
+def load_campaign_attachments(campaign_id):
+    directory = campaign_attachments_dir(campaign_id)
+    if not os.path.isdir(directory):
+        return None
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    return SharedAttachments(paths) if paths else None
+
+# Function to base64-encode a file from disk in chunks, as 76-character MIME lines
+def encode_file(path):
+    lines = []
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(ENCODE_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines.append(base64.encodebytes(chunk).decode("ascii"))
+    return "".join(lines)
+
+# Attachment parts encoded once and spliced after the per-recipient headers and body
+class SharedAttachments:
+    def __init__(self, paths):
+        check_attachment_sizes(os.path.getsize(path) for path in paths)
+        self.boundary = f"===============cmail{uuid.uuid4().hex}=="
+        self.filenames = [os.path.basename(path) for path in paths]
+        self.size = sum(os.path.getsize(path) for path in paths)
+
+        tail = []
+        for path in paths:
+            content_type, encoding = mimetypes.guess_type(path)
+            if content_type is None or encoding is not None:
+                content_type = "application/octet-stream"
+            maintype, subtype = content_type.split("/", 1)
+            part = MIMEBase(maintype, subtype)
+            part.set_payload(encode_file(path))
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header("Content-Disposition", "attachment", filename=os.path.basename(path))
+            tail.append(b"--" + self.boundary.encode("ascii") + b"\r\n" + part.as_bytes(policy=MESSAGE_POLICY) + b"\r\n")
+        self._closing = b"--" + self.boundary.encode("ascii") + b"--\r\n"
+        self._tail = b"".join(tail) + self._closing
+        self._encoded_tails = {}  # Leading tail bytes folded into the head -> urlsafe base64 of the rest
+
+    # Function to wrap one recipient's body part and headers into a multipart/mixed head
+    def _head(self, body_part, headers):
+        message = MIMEMultipart("mixed", boundary=self.boundary)
+        for name, value in headers:
+            message[name] = value
+        message.attach(body_part)
+        head = message.as_bytes(policy=MESSAGE_POLICY)
+        # The generator closes the multipart after the body; the shared parts go there instead
+        return head[:-len(self._closing)]
+
+    # Function to build the full message bytes for one recipient
+    def message_bytes(self, body_part, headers):
+        return self._head(body_part, headers) + self._tail
+
+    # Function to build the Gmail API raw value for one recipient. base64 of a concatenation
+    # equals the concatenated encodings when the first piece is a multiple of 3 bytes, so
+    # only the short head is encoded per recipient; the tail is encoded once per alignment.
+    def urlsafe_b64(self, body_part, headers):
+        head = self._head(body_part, headers)
+        borrowed = (3 - len(head) % 3) % 3
+        encoded_tail = self._encoded_tails.get(borrowed)
+        if encoded_tail is None:
+            encoded_tail = self._encoded_tails[borrowed] = base64.urlsafe_b64encode(self._tail[borrowed:])
+        return (base64.urlsafe_b64encode(head + self._tail[:borrowed]) + encoded_tail).decode()
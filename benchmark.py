@@ -0,0 +1,443 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import shutil
+import tempfile
+import itertools
+import threading
+import resource
+import socketserver
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Delivery benchmarks for the send path.
+#
+# Starts a local SMTP sink and a fake Gmail REST endpoint (both with configurable
+# latency and error injection), swaps Firebase for an in-memory stand-in and runs
+# synthetic campaigns through the real send functions, reporting throughput,
+# p50/p99 per-message latency and peak RSS.
+#
+#     python benchmark.py --scenario all --recipients 10000 --latency-ms 2 --error-rate 0.01
+
+SCENARIOS = ["mime", "log", "gmail", "smtp"]
+BENCH_HTML_BODY = (
+    "<html><head><style>p { color: #333333; margin: 0 0 12px } .cta { font-weight: bold }</style></head><body>"
+    "<h2>Benchmark</h2>" + "<p>Benchmark body</p>" * 20 +
+    "<p class=\"cta\"><a href=\"https://example.com/offer\">Read more</a></p></body></html>"
+)
+
+# Fault injection shared by the fake servers
+class FaultInjector:
+    def __init__(self, latency_ms=0.0, error_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+# Minimal SMTP server that accepts and discards every message
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        faults = self.server.faults
+        self.reply("220 cmail-benchmark ESMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250-cmail-benchmark")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 SIZE 36700160")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                faults.delay()
+                if faults.should_fail():
+                    self.reply("550 5.1.1 Injected failure: mailbox unavailable")
+                else:
+                    self.server.accepted += 1
+                    self.reply("250 OK queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, faults):
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+        self.faults = faults
+        self.accepted = 0
+
+# Fake Gmail REST endpoint answering users.messages.send
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        faults = self.server.faults
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        faults.delay()
+        if faults.should_fail():
+            status, body = 400, {"error": {"code": 400, "message": "Address not found (injected)"}}
+        else:
+            self.server.accepted += 1
+            status, body = 200, {"id": f"bench{self.server.accepted:x}", "labelIds": ["SENT"]}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeGmailServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, faults):
+        super().__init__(("127.0.0.1", 0), FakeGmailHandler)
+        self.faults = faults
+        self.accepted = 0
+
+def serve_in_background(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# In-memory stand-in for the subset of the pyrebase database API the app uses
+class MemoryResponse:
+    def __init__(self, key, value):
+        self._key = key
+        self._value = value
+
+    def key(self):
+        return self._key
+
+    def val(self):
+        return self._value
+
+    def each(self):
+        if not isinstance(self._value, dict):
+            return []
+        return [MemoryResponse(key, value) for key, value in self._value.items()]
+
+class MemoryDatabase:
+    def __init__(self, root=None, path=()):
+        self._root = root if root is not None else {}
+        self._path = path
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._query = None  # Key-ordered query set up by order_by_key()
+
+    def child(self, *args):
+        path = self._path + tuple(str(arg) for arg in args)
+        ref = MemoryDatabase(self._root, path)
+        ref._counter = self._counter
+        ref._lock = self._lock
+        return ref
+
+    def _node(self, create=False):
+        node = self._root
+        for part in self._path:
+            if part not in node:
+                if not create:
+                    return None
+                node[part] = {}
+            node = node[part]
+        return node
+
+    # Keys start with the same time prefix as push keys, so time-bounded key queries work
+    def generate_key(self):
+        from storage import push_key_prefix
+        return f"{push_key_prefix(int(time.time() * 1000))}{next(self._counter):012d}"
+
+    def push(self, data):
+        key = self.generate_key()
+        with self._lock:
+            self._node(create=True)[key] = data
+        return {"name": key}
+
+    def set(self, data):
+        with self._lock:
+            self._parent_node()[self._path[-1]] = data
+        return data
+
+    def update(self, data):
+        with self._lock:
+            node = self._node(create=True)
+            for key, value in data.items():
+                # Multi-location updates address nested children as "a/b"
+                *parents, leaf = key.split("/")
+                target = node
+                for part in parents:
+                    target = target.setdefault(part, {})
+                if value is None:
+                    target.pop(leaf, None)
+                else:
+                    target[leaf] = value
+        return data
+
+    def remove(self):
+        with self._lock:
+            parent = self._parent_node()
+            parent.pop(self._path[-1], None)
+
+    def order_by_key(self):
+        query = self.child()
+        query._query = {}
+        return query
+
+    def start_at(self, key):
+        self._query["start"] = key
+        return self
+
+    def end_at(self, key):
+        self._query["end"] = key
+        return self
+
+    def limit_to_first(self, count):
+        self._query["limit"] = count
+        return self
+
+    def get(self):
+        with self._lock:
+            node = self._node()
+            query = self._query
+            if query is not None and isinstance(node, dict):
+                keys = [key for key in sorted(node)
+                        if key >= query.get("start", key) and key <= query.get("end", key)][:query.get("limit")]
+                node = {key: node[key] for key in keys}
+            return MemoryResponse(self._path[-1] if self._path else None, node)
+
+    def _parent_node(self):
+        node = self._root
+        for part in self._path[:-1]:
+            node = node.setdefault(part, {})
+        return node
+
+# Per-message latency samples taken from successive campaign outcomes
+class LatencySampler:
+    def __init__(self):
+        self.samples = array("d")
+        self._last = time.perf_counter()
+
+    def tick(self):
+        now = time.perf_counter()
+        self.samples.append(now - self._last)
+        self._last = now
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def synthetic_recipients(count):
+    return (f"user{i}@bench.example" for i in range(count))
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Function to write a synthetic attachment and load it as the shared parts of a campaign
+def synthetic_attachments(campaign_id, attachment_kb):
+    from attachments import save_campaign_attachments, load_campaign_attachments
+    if not attachment_kb:
+        return None
+    payload = io.BytesIO(random.Random(attachment_kb).randbytes(attachment_kb * 1024))
+    save_campaign_attachments(campaign_id, [("report.pdf", payload, attachment_kb * 1024)])
+    return load_campaign_attachments(campaign_id)
+
+def bench_mime(count, sampler, attachment_kb=0, html=False):
+    import gmail
+    attachments = synthetic_attachments(f"bench-mime-{time.time_ns()}", attachment_kb)
+    body = BENCH_HTML_BODY if html else "Benchmark body\n" * 20
+    for recipient in synthetic_recipients(count):
+        gmail.create_message("me", recipient, "Benchmark subject", body, attachments=attachments)
+        sampler.tick()
+
+def bench_log(count, sampler):
+    import email_logs
+    import datetime
+    for recipient in synthetic_recipients(count):
+        email_logs.save_email_log("bench@example.com", recipient, "Sent", "Gmail", datetime.datetime.now(), "Benchmark")
+        sampler.tick()
+
+def run_campaign(run_function, service_name, count, sampler, *args, attachment_kb=0, html=False):
+    from campaigns import get_campaign_store, CampaignProgress
+
+    class TimedProgress(CampaignProgress):
+        def record(self, recipient, status, error=None):
+            super().record(recipient, status, error)
+            sampler.tick()
+
+    subject = f"Benchmark {service_name} {time.time()}"
+    campaign_id = f"bench-{service_name.lower()}-{time.time_ns()}"
+    synthetic_attachments(campaign_id, attachment_kb)
+    body = BENCH_HTML_BODY if html else "Benchmark body"
+    campaign = get_campaign_store().start(
+        campaign_id, "bench@example.com", service_name, subject, body, synthetic_recipients(count))
+    sampler._last = time.perf_counter()
+    progress = TimedProgress(campaign_id, campaign["total"])
+    run_function(*args, "bench@example.com", campaign_id, subject, body, progress=progress)
+    return progress
+
+def bench_gmail(count, sampler, faults, attachment_kb=0, html=False):
+    import gmail
+    from googleapiclient.discovery import build
+    server = serve_in_background(FakeGmailServer(faults))
+    try:
+        service = build(
+            "gmail", "v1", developerKey="benchmark", static_discovery=True,
+            client_options={"api_endpoint": f"http://127.0.0.1:{server.server_address[1]}/"}
+        )
+        return run_campaign(gmail.run_gmail_campaign, "Gmail", count, sampler, service, attachment_kb=attachment_kb,
+                            html=html)
+    finally:
+        server.shutdown()
+
+def bench_smtp(count, sampler, faults, attachment_kb=0, html=False):
+    import outlook
+    server = serve_in_background(SMTPSink(faults))
+    try:
+        os.environ["OUTLOOK_SMTP_SERVER"] = "127.0.0.1"
+        os.environ["OUTLOOK_SMTP_PORT"] = str(server.server_address[1])
+        os.environ["OUTLOOK_SMTP_STARTTLS"] = "false"
+        os.environ.setdefault("OUTLOOK_USER", "bench@example.com")
+        os.environ.setdefault("OUTLOOK_PASS", "benchmark")
+        return run_campaign(outlook.run_outlook_campaign, "Outlook", count, sampler, attachment_kb=attachment_kb, html=html)
+    finally:
+        server.shutdown()
+
+def run_scenario(name, count, faults, attachment_kb=0, html=False):
+    sampler = LatencySampler()
+    started = time.perf_counter()
+    progress = None
+    if name == "mime":
+        bench_mime(count, sampler, attachment_kb, html)
+    elif name == "log":
+        bench_log(count, sampler)
+    elif name == "gmail":
+        progress = bench_gmail(count, sampler, faults, attachment_kb, html)
+    elif name == "smtp":
+        progress = bench_smtp(count, sampler, faults, attachment_kb, html)
+    elapsed = time.perf_counter() - started
+    result = {
+        "scenario": name,
+        "messages": len(sampler.samples),
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(sampler.samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(sampler.percentile(0.50) * 1000, 3),
+        "p99_ms": round(sampler.percentile(0.99) * 1000, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if progress is not None:
+        result.update(sent=progress.sent, failed=progress.failed, skipped=progress.skipped)
+    return result
+
+# Point the app modules at throwaway local state before they are imported
+def prepare_environment(workdir, storage="memory", render_workers=None):
+    os.environ["CMAIL_DATA_DIR"] = os.path.join(workdir, "cmail_data")
+    if render_workers is not None:
+        os.environ["CMAIL_RENDER_WORKERS"] = str(render_workers)
+        os.environ["CMAIL_RENDER_MIN_RECIPIENTS"] = "0"
+    if storage == "sqlite":
+        os.environ["CMAIL_STORAGE"] = "sqlite"
+        os.environ["CMAIL_STORAGE_PATH"] = os.path.join(workdir, "cmail_data", "cmail.db")
+    os.environ.setdefault("DATABASE_URL", "https://cmail-benchmark.invalid")
+    os.chdir(workdir)
+
+def install_memory_database():
+    import storage
+    import gmail
+    import outlook
+    import contacts
+    import templates
+    import dashboard
+    import segments
+    import email_logs
+    memory_db = MemoryDatabase()
+    storage.install_database(memory_db)
+    for module in (gmail, outlook, contacts, templates, dashboard, segments, email_logs):
+        module.db = memory_db
+    return memory_db
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Cmail send path against local stand-ins.")
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--recipients", type=int, default=1000, help="Synthetic campaign size (1k-1M)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Injected provider latency per message")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of messages the provider rejects")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--attachment-kb", type=int, default=0, help="Attach a synthetic file of this size to every message")
+    parser.add_argument("--render-workers", type=int, default=None,
+                        help="Render every campaign in a pool of this many worker processes")
+    parser.add_argument("--html", action="store_true", help="Send an HTML body with a stylesheet instead of plain text")
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory",
+                        help="Back log writes with the in-memory stand-in or the local SQLite engine")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    parser.add_argument("--keep-state", action="store_true", help="Keep the temporary sent-index and campaign store")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, app_dir)
+    workdir = tempfile.mkdtemp(prefix="cmail-bench-")
+    prepare_environment(workdir, args.storage, args.render_workers)
+    if args.storage == "memory":
+        install_memory_database()
+
+    faults = FaultInjector(args.latency_ms, args.error_rate, args.seed)
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    if not args.json:
+        print(f"{'scenario':<8} {'messages':>9} {'seconds':>9} {'msg/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8}")
+    for name in scenarios:
+        result = run_scenario(name, args.recipients, faults, args.attachment_kb, args.html)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['scenario']:<8} {result['messages']:>9} {result['seconds']:>9.2f} "
+                f"{result['throughput_per_s']:>9.1f} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+                f"{result['peak_rss_mb']:>8.1f}",
+                flush=True
+            )
+    if args.keep_state:
+        print(f"Benchmark state kept in {workdir}", file=sys.stderr)
+    else:
+        os.chdir(app_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
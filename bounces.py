@@ -0,0 +1,243 @@
+import os
+import re
+import base64
+import quopri
+import argparse
+import logging
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import compat32
+from campaigns import IDEMPOTENCY_HEADER, idempotency_key, get_campaign_store
+from email_logs import STATUS_CODES, STATUS_NAMES, iter_log_entries, update_log_entries
+
+# Bounce processing. A "Sent" entry only means the provider accepted the message; the
+# delivery status notifications (DSNs, RFC 3464) that come back later are read from a
+# local mbox file or Maildir export and turned into "Bounced" (or "Delivered") entries.
+#
+#     python bounces.py --user me@example.com --mailbox bounces.mbox
+#
+# Mailboxes are read in large chunks and split without building a table of contents, and
+# the delivery-status part is picked out of the raw bytes; only reports in an unusual
+# shape (e.g. folded part headers) go through the full email parser. Each
+# report is matched to a log entry by recipient, and by the idempotency key in the
+# original Message-ID when the recipient was sent to by more than one campaign.
+
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+BOUNCE_BATCH_SIZE = 500  # Entries rewritten per multi-location update
+
+# DSN action -> new log status; "delayed" reports are transient and change nothing
+DSN_ACTIONS = {"failed": "Bounced", "delivered": "Delivered", "relayed": "Delivered", "expanded": "Delivered"}
+# Statuses a report may replace: a bounce wins over everything else, a delivery only over "Sent"
+# (or "Unknown": any report shows the provider did accept the message)
+REPLACEABLE_STATUSES = {"Bounced": {"Sent", "Delivered", "Unknown"}, "Delivered": {"Sent", "Unknown"}}
+
+MBOX_SEPARATOR = re.compile(rb"\n\r?\n(?=From )")
+DELIVERY_STATUS_PATTERN = re.compile(rb"message/delivery-status", re.IGNORECASE)
+DSN_PART_PATTERN = re.compile(rb"^content-type:[ \t]*message/delivery-status", re.IGNORECASE | re.MULTILINE)
+ORIGINAL_PART_PATTERN = re.compile(rb"^content-type:[ \t]*(?:message/rfc822|text/rfc822-headers)",
+                                   re.IGNORECASE | re.MULTILINE)
+FIELD_PATTERN = re.compile(rb"^([A-Za-z][A-Za-z-]*):[ \t]*(.*(?:\n[ \t]+.*)*)", re.MULTILINE)
+MESSAGE_KEY_PATTERN = re.compile(
+    rb"^(?:" + IDEMPOTENCY_HEADER.encode("ascii") + rb":[ \t]*([0-9a-f]{32})|message-id:[ \t]*<([0-9a-f]{32})@)",
+    re.IGNORECASE | re.MULTILINE)
+
+# Function to drop the "From " envelope line an mbox puts before each message
+def _strip_envelope(message):
+    if message.startswith(b"From "):
+        newline = message.find(b"\n")
+        return message[newline + 1:] if newline >= 0 else b""
+    return message
+
+# Function to yield the raw messages of an mbox file, reading it in large chunks
+def iter_mbox(path):
+    with open(path, "rb") as mbox:
+        pending = b""
+        while True:
+            chunk = mbox.read(READ_CHUNK_SIZE)
+            data = pending + chunk
+            position = 0
+            for match in MBOX_SEPARATOR.finditer(data):
+                yield _strip_envelope(data[position:match.start() + 1])
+                position = match.end()
+            pending = data[position:]
+            if not chunk:
+                break
+    if pending.strip():
+        yield _strip_envelope(pending)
+
+# Function to yield the raw messages of a Maildir (new/ and cur/), or of a directory of .eml files
+def iter_maildir(path):
+    folders = [os.path.join(path, name) for name in ("new", "cur") if os.path.isdir(os.path.join(path, name))]
+    for folder in folders or [path]:
+        for entry in os.scandir(folder):
+            if entry.is_file() and not entry.name.startswith("."):
+                with open(entry.path, "rb") as message_file:
+                    yield message_file.read()
+
+def iter_mailbox(path):
+    return iter_maildir(path) if os.path.isdir(path) else iter_mbox(path)
+
+# Function to turn the per-recipient fields of a status report into a report dict, or None
+def _report(fields):
+    recipient = fields.get("final-recipient") or fields.get("original-recipient") or ""
+    recipient = recipient.rpartition(";")[2].strip().strip("<>").lower()
+    action = (fields.get("action") or "").strip().lower()
+    if not recipient or not action:
+        return None
+    return {
+        "recipient": recipient,
+        "action": action,
+        "status": (fields.get("status") or "").split(" ")[0].strip(),
+        "diagnostic": " ".join((fields.get("diagnostic-code") or "").rpartition(";")[2].split()),
+    }
+
+# Function to read the per-recipient reports out of the raw bytes of a delivery-status part
+def _parse_dsn_fast(raw):
+    match = DSN_PART_PATTERN.search(raw)
+    start = raw.find(b"\n\n", match.end())
+    if start < 0:
+        return None, []
+    end = raw.find(b"\n--", start)
+    end = len(raw) if end < 0 else end
+    block = raw[start:end]
+    part_headers = raw[match.end():start].lower()
+    try:
+        if b"base64" in part_headers:
+            block = base64.b64decode(block).replace(b"\r\n", b"\n")
+        elif b"quoted-printable" in part_headers:
+            block = quopri.decodestring(block).replace(b"\r\n", b"\n")
+    except ValueError:
+        return None, []
+    reports = []
+    # The first group describes the whole message; one group per recipient follows
+    for group in re.split(rb"\n[ \t]*\n", block.strip())[1:]:
+        fields = {name.decode("ascii").lower(): value.decode("utf-8", "replace")
+                  for name, value in FIELD_PATTERN.findall(group)}
+        report = _report(fields)
+        if report:
+            reports.append(report)
+
+    key = None
+    original = ORIGINAL_PART_PATTERN.search(raw, end)
+    if original is not None:
+        header_end = raw.find(b"\n\n", raw.find(b"\n\n", original.end()) + 2)
+        for key_match in MESSAGE_KEY_PATTERN.finditer(raw, original.end(), header_end if header_end > 0 else len(raw)):
+            key = (key_match.group(1) or key_match.group(2)).decode("ascii").lower()
+            if key_match.group(1):
+                break
+    return key, reports
+
+# Function to read the reports with the full email parser, for status parts in an unusual shape
+def _parse_dsn_slow(raw):
+    message = BytesParser(policy=compat32).parsebytes(raw)
+    key, reports = None, []
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == "message/delivery-status":
+            for group in part.get_payload()[1:]:
+                report = _report({name.lower(): str(value) for name, value in group.items()})
+                if report:
+                    reports.append(report)
+        elif content_type in ("message/rfc822", "text/rfc822-headers") and key is None:
+            if content_type == "message/rfc822":
+                original = part.get_payload(0)
+                headers = "".join(f"{name}: {value}\n" for name, value in original.items()).encode("utf-8", "replace")
+            else:
+                headers = part.get_payload(decode=True) or b""
+            # The idempotency header wins over the Message-ID, as in the fast path
+            key_matches = sorted(MESSAGE_KEY_PATTERN.finditer(headers.replace(b"\r\n", b"\n")),
+                                 key=lambda match: match.group(1) is None)
+            key = (key_matches[0].group(1) or key_matches[0].group(2)).decode("ascii").lower() if key_matches else None
+    return key, reports
+
+# Function to parse a delivery status notification into (original message key, [report]),
+# or None when the message is not one
+def parse_dsn(raw):
+    if DELIVERY_STATUS_PATTERN.search(raw) is None:
+        return None
+    raw = raw.replace(b"\r\n", b"\n")
+    if DSN_PART_PATTERN.search(raw) is not None:
+        key, reports = _parse_dsn_fast(raw)
+        if reports:
+            return key, reports
+    return _parse_dsn_slow(raw)
+
+# The user's raw log entries by recipient, with the campaign texts needed to recompute message keys
+class BounceIndex:
+    def __init__(self, user_email):
+        self.by_recipient = {}  # recipient -> [[campaign_id, entry_id, entry], ...]
+        for campaign_id, entry_id, entry in iter_log_entries(user_email):
+            self.by_recipient.setdefault(str(entry[0]).strip().lower(), []).append([campaign_id, entry_id, entry])
+        self._campaign_texts = {}
+
+    def _message_key(self, campaign_id, recipient):
+        if campaign_id not in self._campaign_texts:
+            campaign = get_campaign_store().get(campaign_id)
+            self._campaign_texts[campaign_id] = (campaign["subject"], campaign["message_text"]) if campaign else None
+        texts = self._campaign_texts[campaign_id]
+        return idempotency_key(campaign_id, recipient, *texts) if texts else None
+
+    # Function to find the entry of the message a report is about: the one whose key matches,
+    # else the latest entry that went out to the recipient
+    def find(self, recipient, key=None):
+        candidates = [candidate for candidate in self.by_recipient.get(recipient, ())
+                      if STATUS_NAMES.get(candidate[2][1]) in ("Sent", "Delivered", "Bounced", "Unknown")]
+        if key and len(candidates) > 1:
+            for candidate in candidates:
+                if self._message_key(candidate[0], recipient) == key:
+                    return candidate
+        return max(candidates, key=lambda candidate: candidate[2][2]) if candidates else None
+
+# Function to apply the bounces of a mailbox to the user's delivery log; returns the counts
+# of messages read, reports found and entries changed
+def process_bounces(user_email, path, batch_size=BOUNCE_BATCH_SIZE):
+    index = BounceIndex(user_email)
+    counts = Counter()
+    changes = {}  # (campaign_id, entry_id) -> entry
+
+    for raw in iter_mailbox(path):
+        counts["messages"] += 1
+        dsn = parse_dsn(raw)
+        if dsn is None:
+            counts["not_dsn"] += 1
+            continue
+        key, reports = dsn
+        for report in reports:
+            counts["reports"] += 1
+            status = DSN_ACTIONS.get(report["action"])
+            if status is None:
+                counts["delayed"] += 1
+                continue
+            candidate = index.find(report["recipient"], key)
+            if candidate is None:
+                counts["unmatched"] += 1
+                continue
+            campaign_id, entry_id, entry = candidate
+            if STATUS_NAMES.get(entry[1]) not in REPLACEABLE_STATUSES[status]:
+                counts["unchanged"] += 1
+                continue
+            detail = " ".join(part for part in (report["status"], report["diagnostic"]) if part)
+            entry = [entry[0], STATUS_CODES[status], entry[2]] + ([detail] if status == "Bounced" and detail else [])
+            candidate[2] = entry
+            changes[(campaign_id, entry_id)] = entry
+            counts[status.lower()] += 1
+            if len(changes) >= batch_size:
+                update_log_entries(user_email, [(cid, eid, value) for (cid, eid), value in changes.items()])
+                changes = {}
+    update_log_entries(user_email, [(cid, eid, value) for (cid, eid), value in changes.items()])
+
+    logging.info("Processed %d bounce message(s) for user %s: %d bounced, %d delivered, %d unmatched",
+                 counts["messages"], user_email, counts["bounced"], counts["delivered"], counts["unmatched"])
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply bounce reports from an mbox file or Maildir to the Cmail delivery log.")
+    parser.add_argument("--user", required=True, help="Email address of the account that sent the messages")
+    parser.add_argument("--mailbox", required=True, help="mbox file, Maildir, or directory of .eml files")
+    args = parser.parse_args(argv)
+    counts = process_bounces(args.user, args.mailbox)
+    print(", ".join(f"{name}: {counts[name]}" for name in
+                    ("messages", "not_dsn", "reports", "bounced", "delivered", "delayed", "unchanged", "unmatched")))
+
+if __name__ == "__main__":
+    main()
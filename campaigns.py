@@ -0,0 +1,471 @@
+import os
+import uuid
+import sqlite3
+import hashlib
+import threading
+import time
+import datetime
+import logging
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import time_stage
+
+# Load environment variables
+load_dotenv()
+
+# Directory holding local delivery state (sent-index, campaign checkpoints)
+DATA_DIR = os.getenv("CMAIL_DATA_DIR", "cmail_data")
+SENT_INDEX_PATH = os.path.join(DATA_DIR, "sent_index.db")
+
+# Custom header carrying the idempotency key on every outgoing message
+IDEMPOTENCY_HEADER = "X-Cmail-Idempotency-Key"
+
+# Function to hash the content of a message (subject and body, and the digest of its attachments if any)
+def content_hash(subject, message_text, attachments_digest=None):
+    digest = hashlib.sha256()
+    digest.update((subject or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((message_text or "").encode("utf-8"))
+    if attachments_digest:
+        digest.update(b"\0")
+        digest.update(attachments_digest.encode("ascii"))
+    return digest.hexdigest()
+
+# Function to derive a campaign ID.
+# Scheduled sends are keyed by their fire time, so jobs for the same time and content share a
+# campaign; other sends by their submission (see submission_campaign_id). Without either, the
+# day is used (delivery log entries written outside a campaign). The same text sent with other
+# attachments is other content, so it gets its own campaign and idempotency keys.
+def make_campaign_id(user_email, service, subject, message_text, send_datetime=None, attachments_digest=None,
+                     submission_id=None):
+    if send_datetime is not None:
+        when = send_datetime.strftime("%Y%m%d%H%M")
+    elif submission_id is not None:
+        when = f"submission:{submission_id}"
+    else:
+        when = datetime.datetime.now().strftime("%Y%m%d")
+    seed = f"{user_email}|{service}|{content_hash(subject, message_text, attachments_digest)}|{when}"
+    return hashlib.sha256(seed.encode("utf-8")).hexdigest()[:24]
+
+# Function to derive the idempotency key of one message of a campaign
+def idempotency_key(campaign_id, recipient, subject, message_text):
+    seed = f"{campaign_id}|{recipient.strip().lower()}|{content_hash(subject, message_text)}"
+    return hashlib.sha256(seed.encode("utf-8")).hexdigest()[:32]
+
+# Function to build a Message-ID header value from an idempotency key
+def make_message_id(key, sender=None):
+    domain = sender.split('@', 1)[1] if sender and '@' in sender else "cmail.local"
+    return f"<{key}@{domain}>"
+
+# Local index of messages that the provider has accepted ("Sent") or may have accepted before
+# the send failed in transit ("Unknown"), keyed by idempotency key. Neither is sent again.
+class SentIndex:
+    def __init__(self, path=SENT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sent ("
+                "key TEXT PRIMARY KEY, recipient TEXT, provider_id TEXT, sent_at TEXT)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sent)")}
+            if "outcome" not in columns:
+                self._conn.execute("ALTER TABLE sent ADD COLUMN outcome TEXT NOT NULL DEFAULT 'Sent'")
+            self._conn.commit()
+
+    def is_sent(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM sent WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT recipient, provider_id, sent_at, outcome FROM sent WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"recipient": row[0], "provider_id": row[1], "sent_at": row[2], "outcome": row[3]}
+
+    def mark_sent(self, key, recipient=None, provider_id=None, outcome="Sent"):
+        sent_at = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO sent (key, recipient, provider_id, sent_at, outcome) VALUES (?, ?, ?, ?, ?)",
+                (key, recipient, provider_id, sent_at, outcome)
+            )
+            self._conn.commit()
+
+_sent_index = None
+_sent_index_lock = threading.Lock()
+
+# Function to get the process-wide sent-index (opened on first use)
+def get_sent_index():
+    global _sent_index
+    with _sent_index_lock:
+        if _sent_index is None:
+            _sent_index = SentIndex()
+            logging.info(f"Opened sent-index at {SENT_INDEX_PATH}")
+    return _sent_index
+
+# Campaign checkpoints (cursor and per-recipient outcomes of bulk sends)
+CAMPAIGNS_DB_PATH = os.path.join(DATA_DIR, "campaigns.db")
+CHECKPOINT_EVERY = int(os.getenv("CMAIL_CHECKPOINT_EVERY", "50"))  # Outcomes buffered per checkpoint
+CHECKPOINT_INTERVAL = 5  # Seconds between checkpoints of a slow campaign
+
+class CampaignStore:
+    def __init__(self, path=CAMPAIGNS_DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS campaigns ("
+                "campaign_id TEXT PRIMARY KEY, user_email TEXT, service TEXT, subject TEXT, "
+                "message_text TEXT, total INTEGER, processed INTEGER, cursor INTEGER, "
+                "status TEXT, created_at TEXT, updated_at TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS campaign_recipients ("
+                "campaign_id TEXT, position INTEGER, recipient TEXT, status TEXT, error TEXT, "
+                "PRIMARY KEY (campaign_id, position), UNIQUE (campaign_id, recipient))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_campaigns_user ON campaigns (user_email, service, status)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(campaigns)")}
+            if "attachments_digest" not in columns:
+                self._conn.execute("ALTER TABLE campaigns ADD COLUMN attachments_digest TEXT")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS campaign_drips ("
+                "campaign_id TEXT PRIMARY KEY, start_at REAL, end_at REAL, max_per_hour REAL, domain_per_hour REAL)"
+            )
+            self._conn.commit()
+
+    # Register a campaign (or extend an existing one) with its recipients
+    def start(self, campaign_id, user_email, service, subject, message_text, recipients, attachments_digest=None):
+        now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO campaigns (campaign_id, user_email, service, subject, message_text, "
+                "total, processed, cursor, status, created_at, updated_at, attachments_digest) "
+                "VALUES (?, ?, ?, ?, ?, 0, 0, -1, ?, ?, ?, ?)",
+                (campaign_id, user_email, service, subject, message_text, "running", now, now, attachments_digest)
+            )
+            start = self._conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM campaign_recipients WHERE campaign_id = ?",
+                (campaign_id,)
+            ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO campaign_recipients (campaign_id, position, recipient) VALUES (?, ?, ?)",
+                ((campaign_id, position, recipient) for position, recipient in enumerate(recipients, start))
+            )
+            # A new submission of the same campaign retries its failed recipients. "Failed" means the
+            # provider rejected the message; "Unknown" (it may have been accepted) is never reset here.
+            self._conn.execute(
+                "UPDATE campaign_recipients SET status = NULL, error = NULL WHERE campaign_id = ? AND status = 'Failed'",
+                (campaign_id,)
+            )
+            self._conn.execute(
+                "UPDATE campaigns SET status = 'running', updated_at = ?, "
+                "total = (SELECT COUNT(*) FROM campaign_recipients WHERE campaign_id = ?), "
+                "processed = (SELECT COUNT(*) FROM campaign_recipients WHERE campaign_id = ? AND status IS NOT NULL) "
+                "WHERE campaign_id = ?",
+                (now, campaign_id, campaign_id, campaign_id)
+            )
+            self._conn.commit()
+        return self.get(campaign_id)
+
+    def get(self, campaign_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT campaign_id, user_email, service, subject, message_text, total, processed, "
+                "cursor, status, created_at, updated_at, attachments_digest FROM campaigns WHERE campaign_id = ?",
+                (campaign_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    # Campaigns of a user that were interrupted before every recipient was processed
+    def list_resumable(self, user_email, service):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT campaign_id, user_email, service, subject, message_text, total, processed, "
+                "cursor, status, created_at, updated_at, attachments_digest FROM campaigns "
+                "WHERE user_email = ? AND service = ? AND status = 'running' ORDER BY updated_at DESC",
+                (user_email, service)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    # Yield (position, recipient) pairs that have no recorded outcome yet, in send order
+    def pending(self, campaign_id, batch_size=1000):
+        last_position = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT position, recipient FROM campaign_recipients "
+                    "WHERE campaign_id = ? AND position > ? AND status IS NULL ORDER BY position LIMIT ?",
+                    (campaign_id, last_position, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for position, recipient in rows:
+                yield position, recipient
+            last_position = rows[-1][0]
+
+    # Record the delivery window of a drip campaign (times are epoch seconds)
+    def set_drip(self, campaign_id, start_at, end_at, max_per_hour=None, domain_per_hour=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO campaign_drips (campaign_id, start_at, end_at, max_per_hour, domain_per_hour) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (campaign_id, start_at, end_at, max_per_hour, domain_per_hour)
+            )
+            self._conn.commit()
+
+    def get_drip(self, campaign_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT start_at, end_at, max_per_hour, domain_per_hour FROM campaign_drips WHERE campaign_id = ?",
+                (campaign_id,)
+            ).fetchone()
+        return dict(zip(["start_at", "end_at", "max_per_hour", "domain_per_hour"], row)) if row else None
+
+    # Persist a batch of outcomes [(position, status, error), ...] and advance the cursor
+    def record(self, campaign_id, outcomes):
+        if not outcomes:
+            return
+        now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock, time_stage("checkpoint", "local"):
+            self._conn.executemany(
+                "UPDATE campaign_recipients SET status = ?, error = ? WHERE campaign_id = ? AND position = ?",
+                ((status, error, campaign_id, position) for position, status, error in outcomes)
+            )
+            self._conn.execute(
+                "UPDATE campaigns SET processed = processed + ?, cursor = MAX(cursor, ?), updated_at = ? "
+                "WHERE campaign_id = ?",
+                (len(outcomes), max(position for position, _, _ in outcomes), now, campaign_id)
+            )
+            self._conn.commit()
+
+    def finish(self, campaign_id):
+        now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock:
+            self._conn.execute(
+                "UPDATE campaigns SET status = 'completed', updated_at = ? WHERE campaign_id = ?",
+                (now, campaign_id)
+            )
+            self._conn.commit()
+
+    def _to_dict(self, row):
+        keys = ["campaign_id", "user_email", "service", "subject", "message_text", "total",
+                "processed", "cursor", "status", "created_at", "updated_at", "attachments_digest"]
+        return dict(zip(keys, row))
+
+# Buffers per-recipient outcomes and checkpoints them every few recipients or seconds
+class CampaignCheckpoint:
+    def __init__(self, store, campaign_id, every=CHECKPOINT_EVERY, interval=CHECKPOINT_INTERVAL):
+        self.store = store
+        self.campaign_id = campaign_id
+        self.every = every
+        self.interval = interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, position, status, error=None):
+        with self._lock:
+            self._buffer.append((position, status, error))
+            due = len(self._buffer) >= self.every or time.monotonic() - self._last_flush >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            outcomes, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        self.store.record(self.campaign_id, outcomes)
+
+    # Flush the last outcomes and close the campaign once nothing is left pending
+    def finish(self):
+        self.flush()
+        if next(self.store.pending(self.campaign_id, batch_size=1), None) is None:
+            self.store.finish(self.campaign_id)
+            logging.info(f"Campaign {self.campaign_id} completed")
+
+_campaign_store = None
+_campaign_store_lock = threading.Lock()
+
+# Function to get the process-wide campaign checkpoint store (opened on first use)
+def get_campaign_store():
+    global _campaign_store
+    with _campaign_store_lock:
+        if _campaign_store is None:
+            _campaign_store = CampaignStore()
+            logging.info(f"Opened campaign store at {CAMPAIGNS_DB_PATH}")
+    return _campaign_store
+
+# Background sending with live progress
+SEND_WORKERS = int(os.getenv("CMAIL_SEND_WORKERS", "4"))  # Campaigns that may run at the same time
+MAX_FAILURE_SAMPLES = 20  # Failed recipients kept for display
+
+_send_executor = ThreadPoolExecutor(max_workers=SEND_WORKERS, thread_name_prefix="cmail-send")
+# Drip campaigns idle through most of their delivery window, so they run apart from full-speed sends
+DRIP_WORKERS = int(os.getenv("CMAIL_DRIP_WORKERS", "16"))
+_drip_executor = ThreadPoolExecutor(max_workers=DRIP_WORKERS, thread_name_prefix="cmail-drip")
+_active_campaigns = {}
+_active_campaigns_lock = threading.Lock()
+
+# Thread-safe counters of a running campaign, polled by the UI
+class CampaignProgress:
+    def __init__(self, campaign_id, total):
+        self.campaign_id = campaign_id
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.unknown = 0  # Sends that failed in transit, after the provider may have accepted them
+        self.failures = []  # First MAX_FAILURE_SAMPLES (recipient, error) pairs
+        self.error = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def record(self, recipient, status, error=None):
+        with self._lock:
+            if status == "Sent":
+                self.sent += 1
+            elif status == "Skipped":
+                self.skipped += 1
+            elif status == "Unknown":
+                self.unknown += 1
+            else:
+                self.failed += 1
+                if len(self.failures) < MAX_FAILURE_SAMPLES:
+                    self.failures.append((recipient, error))
+
+    def finish(self, error=None):
+        with self._lock:
+            self.error = error
+            self.finished_at = time.monotonic()
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def processed(self):
+        return self.sent + self.failed + self.skipped + self.unknown
+
+    @property
+    def remaining(self):
+        return max(self.total - self.processed, 0)
+
+    # Messages processed per second since the campaign started
+    @property
+    def throughput(self):
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+# Function to run a campaign send function on the background executor.
+# If the campaign is already running, its existing progress is returned instead.
+def start_background_campaign(send_function, progress, *args, **kwargs):
+    with _active_campaigns_lock:
+        active = _active_campaigns.get(progress.campaign_id)
+        if active is not None and not active.done:
+            return active
+        _active_campaigns[progress.campaign_id] = progress
+
+    def campaign_task():
+        try:
+            send_function(*args, progress=progress, **kwargs)
+            progress.finish()
+        except Exception as e:
+            logging.error(f"Error in background campaign {progress.campaign_id}: {e}")
+            progress.finish(str(e))
+        finally:
+            with _active_campaigns_lock:
+                if _active_campaigns.get(progress.campaign_id) is progress:
+                    del _active_campaigns[progress.campaign_id]
+
+    executor = _drip_executor if get_campaign_store().get_drip(progress.campaign_id) else _send_executor
+    executor.submit(campaign_task)
+    return progress
+
+# Function to display the summarized outcome of a campaign
+def show_send_results(progress):
+    if progress.sent:
+        st.success(f"Emails sent successfully to {progress.sent} recipient(s).")
+    if progress.failed:
+        sample = ", ".join(recipient for recipient, _ in progress.failures)
+        more = f" and {progress.failed - len(progress.failures)} more" if progress.failed > len(progress.failures) else ""
+        st.error(f"Failed to send emails to {progress.failed} recipient(s): {sample}{more}")
+    if progress.unknown:
+        st.warning(f"The send to {progress.unknown} recipient(s) was interrupted after the provider may have accepted "
+                   f"it. They are marked \"Unknown\" in the delivery log and are not sent again automatically.")
+    if progress.skipped:
+        st.info(f"Skipped {progress.skipped} recipient(s) who already received this message.")
+    if progress.error:
+        st.error(f"Campaign stopped: {progress.error}")
+    if progress.remaining:
+        st.warning(f"{progress.remaining} recipient(s) were not processed. Use \"Resume Campaign\" to continue.")
+
+def render_campaign_progress(state_key):
+    progress = st.session_state.get(state_key)
+    if progress is None:
+        return
+    st.progress(
+        progress.processed / progress.total if progress.total else 1.0,
+        text=f"{progress.processed}/{progress.total} recipients processed"
+    )
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Sent", progress.sent)
+    col2.metric("Failed", progress.failed)
+    col3.metric("Remaining", progress.remaining)
+    col4.metric("Throughput", f"{progress.throughput:.1f}/s")
+    if progress.done:
+        show_send_results(progress)
+        # Rerun the whole page once so the polling fragment stops
+        if not st.session_state.get(f"{state_key}_finished"):
+            st.session_state[f"{state_key}_finished"] = True
+            st.rerun()
+
+# Function to show the live progress of the campaign stored under state_key.
+# The section reruns on its own every second while the campaign is running.
+def show_campaign_progress(state_key):
+    progress = st.session_state.get(state_key)
+    if progress is None:
+        return
+    run_every = None if progress.done else 1
+    st.fragment(run_every=run_every)(render_campaign_progress)(state_key)
+
+# Function to start a campaign in the background and track it under state_key
+def launch_campaign(state_key, send_function, campaign, *args, **kwargs):
+    progress = CampaignProgress(campaign["campaign_id"], campaign["total"] - campaign["processed"])
+    st.session_state[state_key] = start_background_campaign(send_function, progress, *args, **kwargs)
+    st.session_state[f"{state_key}_finished"] = False
+
+# Function to list a user's campaigns that stopped before finishing and are not running now
+def list_interrupted_campaigns(user_email, service):
+    with _active_campaigns_lock:
+        active_ids = set(_active_campaigns)
+    return [
+        campaign for campaign in get_campaign_store().list_resumable(user_email, service)
+        if campaign["campaign_id"] not in active_ids
+    ]
+
+# Function to pick the campaign ID of a new (not scheduled) submission; returns (campaign ID,
+# interrupted campaign being continued or None). An interrupted campaign of the user with the
+# same provider and content is continued, whatever day it started, so the recipients it already
+# reached are skipped; anything else gets an ID of its own, so a deliberate resend goes out again.
+def submission_campaign_id(user_email, service, subject, message_text, attachments_digest=None):
+    content = (subject, message_text, attachments_digest)
+    for campaign in list_interrupted_campaigns(user_email, service):
+        if (campaign["subject"], campaign["message_text"], campaign["attachments_digest"]) == content:
+            return campaign["campaign_id"], campaign
+    campaign_id = make_campaign_id(user_email, service, subject, message_text,
+                                   attachments_digest=attachments_digest, submission_id=uuid.uuid4().hex)
+    return campaign_id, None
@@ -0,0 +1,127 @@
+import os
+import argparse
+import csv
+import sys
+import time
+import logging
+from gmail import authenticate_gmail, run_gmail_campaign
+from recipients import is_valid_email
+from outlook import run_outlook_campaign
+from templates import get_templates
+from campaigns import submission_campaign_id, get_campaign_store, CampaignProgress, start_background_campaign
+from metrics import start_exporters, write_metrics_file
+from attachments import AttachmentError, attachments_digest, save_campaign_attachments
+
+SERVICES = {"gmail": "Gmail", "outlook": "Outlook"}
+
+# Function to stream valid recipient emails from a CSV (with an 'email' column) or a plain text file
+def read_recipients(path):
+    with open(path, newline='', encoding='utf-8') as recipients_file:
+        if path.lower().endswith('.csv'):
+            reader = csv.DictReader(recipients_file)
+            column = next((name for name in reader.fieldnames or [] if name.strip().lower() == 'email'), None)
+            if column is None:
+                raise ValueError("CSV must contain an 'email' column.")
+            emails = (row[column] for row in reader)
+        else:
+            emails = recipients_file
+
+        for email in emails:
+            email = (email or "").strip()
+            if email and is_valid_email(email):
+                yield email
+
+# Function to find a template of the user by name
+def find_template(user_email, template_name):
+    templates = get_templates(user_email)
+    return next((template for template in templates.values() if template['name'] == template_name), None)
+
+def print_progress(progress):
+    print(
+        f"{progress.processed}/{progress.total} processed - sent {progress.sent}, failed {progress.failed}, "
+        f"skipped {progress.skipped}, unknown {progress.unknown} - {progress.throughput:.1f} msg/s",
+        flush=True
+    )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send a Cmail campaign without the web UI.")
+    parser.add_argument("--user", required=True, help="Email of the Cmail user owning the templates and logs")
+    parser.add_argument("--template", required=True, help="Name of the template to send")
+    parser.add_argument("--recipients", required=True, help="CSV file with an 'email' column, or one email per line")
+    parser.add_argument("--provider", required=True, choices=sorted(SERVICES), help="Delivery provider")
+    parser.add_argument("--subject", help="Override the template subject")
+    parser.add_argument("--attach", action="append", default=[], metavar="PATH", help="File to attach (repeatable)")
+    parser.add_argument("--report-every", type=float, default=5.0, help="Seconds between progress reports")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    service_name = SERVICES[args.provider]
+
+    template = find_template(args.user, args.template)
+    if template is None:
+        print(f"Template not found: {args.template}", file=sys.stderr)
+        return 2
+    subject = args.subject or template.get('subject', '')
+    message_text = template['content']
+
+    # Attachments are size-checked and copied before any recipient is registered; they are
+    # part of the campaign's content, so the same text with other files is another campaign.
+    # An interrupted campaign with the same content is continued rather than sent again.
+    attachment_files = []
+    try:
+        for path in args.attach:
+            attachment_files.append((path, open(path, "rb"), os.path.getsize(path)))
+        digest = attachments_digest(attachment_files)
+        campaign_id, interrupted = submission_campaign_id(args.user, service_name, subject, message_text, digest)
+        save_campaign_attachments(campaign_id, attachment_files)
+    except (OSError, AttachmentError) as e:
+        print(f"Error reading attachments: {e}", file=sys.stderr)
+        return 2
+    finally:
+        for _, attachment_file, _ in attachment_files:
+            attachment_file.close()
+
+    # Recipients are streamed from disk straight into the campaign store
+    try:
+        campaign = get_campaign_store().start(
+            campaign_id, args.user, service_name, subject, message_text, read_recipients(args.recipients), digest)
+    except (OSError, ValueError) as e:
+        print(f"Error reading recipients: {e}", file=sys.stderr)
+        return 2
+    logging.info(f"CLI campaign {campaign_id} started for {args.user} via {service_name}")
+
+    start_exporters()
+    progress = CampaignProgress(campaign_id, campaign["total"] - campaign["processed"])
+    if args.provider == "gmail":
+        service = authenticate_gmail()
+        start_background_campaign(run_gmail_campaign, progress, service, args.user, campaign_id, subject, message_text)
+    else:
+        start_background_campaign(run_outlook_campaign, progress, args.user, campaign_id, subject, message_text)
+
+    if interrupted:
+        print(f"Continuing the interrupted campaign from {interrupted['created_at']}; "
+              f"recipients it already sent to are skipped.", flush=True)
+    print(f"Campaign {campaign_id}: {progress.total} recipient(s) to process", flush=True)
+    last_report = time.monotonic()
+    while not progress.done:
+        time.sleep(0.2)
+        if time.monotonic() - last_report >= args.report_every:
+            print_progress(progress)
+            last_report = time.monotonic()
+    print_progress(progress)
+    write_metrics_file()
+
+    for recipient, error in progress.failures:
+        print(f"Failed: {recipient} - {error}")
+    if progress.unknown:
+        print(f"{progress.unknown} recipient(s) have an unknown outcome (the send failed after the provider may "
+              f"have accepted it); they are not sent again.")
+    if progress.error:
+        print(f"Campaign stopped: {progress.error}", file=sys.stderr)
+    if progress.remaining:
+        print(f"{progress.remaining} recipient(s) not processed; rerun the same command to resume.")
+    return 1 if progress.failed or progress.unknown or progress.error or progress.remaining else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import bisect
+import threading
+from collections import defaultdict
+
+# In-memory search index over contact names and emails: a sorted prefix array for
+# type-ahead on word/email prefixes plus a trigram index for substring lookups.
+
+def _terms(contact):
+    name = (contact.get("name") or "").lower()
+    email = (contact.get("email") or "").lower()
+    terms = set(name.split())
+    if name:
+        terms.add(name)
+    if email:
+        terms.add(email)
+        terms.add(email.split("@", 1)[-1])  # Domain
+    return terms
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class ContactIndex:
+    def __init__(self, contacts=()):
+        self._contacts = {}  # contact id -> contact
+        self._prefix = []  # sorted (term, contact id) pairs
+        self._trigrams = defaultdict(set)  # trigram -> contact ids
+        self._lock = threading.Lock()
+        contacts = list(contacts)
+        with self._lock:
+            for contact in contacts:
+                self._contacts[contact["id"]] = contact
+                for gram in self._contact_trigrams(contact):
+                    self._trigrams[gram].add(contact["id"])
+            self._prefix = sorted(
+                (term, contact["id"]) for contact in contacts for term in _terms(contact))
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def _contact_trigrams(self, contact):
+        return _trigrams((contact.get("name") or "").lower()) | _trigrams((contact.get("email") or "").lower())
+
+    def add(self, contact):
+        with self._lock:
+            self._remove(contact["id"])
+            self._contacts[contact["id"]] = contact
+            for term in _terms(contact):
+                bisect.insort(self._prefix, (term, contact["id"]))
+            for gram in self._contact_trigrams(contact):
+                self._trigrams[gram].add(contact["id"])
+
+    # Function to apply changed fields of a contact; fields not given keep their values
+    def update(self, contact):
+        with self._lock:
+            contact = {**self._contacts.get(contact["id"], {}), **contact}
+        self.add(contact)
+
+    # Function to add or replace many contacts (bulk imports). The new terms are appended and
+    # the prefix array is sorted once, instead of one insertion into it per term.
+    def add_many(self, contacts):
+        contacts = list(contacts)
+        with self._lock:
+            self._remove_many([contact["id"] for contact in contacts])
+            for contact in contacts:
+                self._contacts[contact["id"]] = contact
+                for gram in self._contact_trigrams(contact):
+                    self._trigrams[gram].add(contact["id"])
+            self._prefix.extend((term, contact["id"]) for contact in contacts for term in _terms(contact))
+            self._prefix.sort()
+
+    # Function to apply changed fields of many contacts at once
+    def update_many(self, contacts):
+        with self._lock:
+            contacts = [{**self._contacts.get(contact["id"], {}), **contact} for contact in contacts]
+        self.add_many(contacts)
+
+    def remove(self, contact_id):
+        with self._lock:
+            self._remove(contact_id)
+
+    # Function to remove many contacts with a single pass over the prefix array
+    def remove_many(self, contact_ids):
+        with self._lock:
+            self._remove_many(contact_ids)
+
+    def _remove(self, contact_id):
+        contact = self._contacts.pop(contact_id, None)
+        if contact is None:
+            return
+        for term in _terms(contact):
+            position = bisect.bisect_left(self._prefix, (term, contact_id))
+            if position < len(self._prefix) and self._prefix[position] == (term, contact_id):
+                del self._prefix[position]
+        self._remove_trigrams(contact_id, contact)
+
+    def _remove_many(self, contact_ids):
+        removed = set()
+        for contact_id in contact_ids:
+            contact = self._contacts.pop(contact_id, None)
+            if contact is not None:
+                removed.add(contact_id)
+                self._remove_trigrams(contact_id, contact)
+        if removed:
+            self._prefix = [entry for entry in self._prefix if entry[1] not in removed]
+
+    def _remove_trigrams(self, contact_id, contact):
+        for gram in self._contact_trigrams(contact):
+            ids = self._trigrams.get(gram)
+            if ids is not None:
+                ids.discard(contact_id)
+                if not ids:
+                    del self._trigrams[gram]
+
+    # Contacts with a name word, full name, email or domain starting with query
+    def _prefix_ids(self, query, limit=None):
+        start = bisect.bisect_left(self._prefix, (query,))
+        ids = []
+        seen = set()
+        for position in range(start, len(self._prefix)):
+            term, contact_id = self._prefix[position]
+            if not term.startswith(query) or (limit is not None and len(ids) >= limit):
+                break
+            if contact_id not in seen:
+                seen.add(contact_id)
+                ids.append(contact_id)
+        return ids
+
+    # Contacts whose name or email contains query (needs at least three characters)
+    def _substring_ids(self, query):
+        grams = sorted((self._trigrams.get(gram, set()) for gram in _trigrams(query)), key=len)
+        if not grams:
+            return []
+        candidates = set(grams[0]).intersection(*grams[1:])
+        return [
+            contact_id for contact_id in candidates
+            if query in (self._contacts[contact_id].get("name") or "").lower()
+            or query in (self._contacts[contact_id].get("email") or "").lower()
+        ]
+
+    # Function to look contacts up by prefix or substring; prefix matches come first
+    def search(self, query, limit=50):
+        query = query.strip().lower()
+        with self._lock:
+            if not query:
+                matches = list(self._contacts)
+            else:
+                matches = self._prefix_ids(query, limit)
+                if len(query) >= 3 and (limit is None or len(matches) < limit):
+                    seen = set(matches)
+                    matches.extend(sorted(
+                        (contact_id for contact_id in self._substring_ids(query) if contact_id not in seen),
+                        key=lambda contact_id: (self._contacts[contact_id].get("email") or "")))
+            if limit is not None:
+                matches = matches[:limit]
+            return [self._contacts[contact_id] for contact_id in matches]
@@ -1,206 +1,489 @@
-import re
-import pyrebase
-import streamlit as st
-from dotenv import load_dotenv
-import os
-import pandas as pd
-import logging
-
-# Load environment variables from .env file
-load_dotenv()
-logging.basicConfig(
-    filename="cmail_app.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
-
-# Initialize Firebase configuration
-config = {
-    "apiKey": os.getenv('API_KEY'),
-    "authDomain": os.getenv('AUTH_DOMAIN'),
-    "databaseURL": os.getenv('DATABASE_URL'),
-    "projectId": os.getenv('PROJECT_ID'),
-    "storageBucket": os.getenv('STORAGE_BUCKET'),
-    "messagingSenderId": os.getenv('MESSAGING_SENDER_ID'),
-    "appId": os.getenv('APP_ID')
-}
-
-firebase = pyrebase.initialize_app(config)
-auth = firebase.auth()
-db = firebase.database()
-
-# Function to sanitize email format
-def sanitize_email(email):
-    return email.replace('@', '_at_').replace('.', '_dot_')
-
-# Contact management functions
-def is_valid_email(email):
-    # Regex pattern for validating email
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return re.match(pattern, email) is not None
-
-# Function to add a contact for the logged-in user
-def add_contact(contact_name, contact_email):
-    if not is_valid_email(contact_email):
-        st.error("Invalid email format. Please enter a valid email address.")
-        return  # Stop if email is invalid
-
-    if "user_email" in st.session_state:
-        logged_in_email = st.session_state["user_email"]
-        sanitized_email = sanitize_email(logged_in_email)
-        try:
-            # Add the contact under the logged-in user's sanitized email
-            db.child("contacts").child(sanitized_email).push({
-                "name": contact_name,
-                "email": contact_email
-            })
-            st.success(f"Contact '{contact_name}' added successfully!")
-            logging.info(f"Added contact: {contact_name} for user {logged_in_email}")
-        except Exception as e:
-            st.error(f"Error adding contact: {e}")
-            logging.error(f"Error adding contact for user {logged_in_email}: {e}")
-    else:
-        st.error("No user logged in. Please log in to add contacts.")
-        logging.warning("Attempt to add contact without logged-in user.")
-
-# Function to retrieve contacts for the logged-in user
-def get_contacts(user_email=None):
-    contacts = []
-    if user_email is None and "user_email" in st.session_state:
-        user_email = st.session_state["user_email"]
-
-    if user_email:
-        sanitized_email = sanitize_email(user_email)
-        try:
-            contacts_data = db.child("contacts").child(sanitized_email).get().val()
-            if contacts_data:
-                for key, value in contacts_data.items():
-                    contacts.append({"id": key, "name": value.get("name"), "email": value.get("email")})
-            else:
-                st.info("No contacts found.")
-                logging.info("No contacts found for user.")
-        except Exception as e:
-            st.error(f"Error retrieving contacts: {e}")
-            logging.error(f"Error retrieving contacts for user {user_email}: {e}")
-    else:
-        st.error("No user logged in. Please log in to view contacts.")
-        logging.warning("Attempt to retrieve contacts without logged-in user.")
-    return contacts
-
-# Function to update a specific contact
-def update_contact(contact_id, new_name, new_email):
-    if not is_valid_email(new_email):
-        st.error("Invalid email format. Please enter a valid email address.")
-        return  # Stop if email is invalid
-
-    if "user_email" in st.session_state:
-        logged_in_email = st.session_state["user_email"]
-        sanitized_email = sanitize_email(logged_in_email)
-        try:
-            db.child("contacts").child(sanitized_email).child(contact_id).update({
-                "name": new_name,
-                "email": new_email
-            })
-            st.success("Contact updated successfully!")
-            logging.info(f"Updated contact {contact_id} for user {logged_in_email}")
-        except Exception as e:
-            st.error(f"Error updating contact: {e}")
-            logging.error(f"Error updating contact {contact_id} for user {logged_in_email}: {e}")
-    else:
-        st.error("No user logged in. Please log in to update contacts.")
-        logging.warning("Attempt to update contact without logged-in user.")
-
-# Function to delete a specific contact
-def delete_contact(contact_id):
-    if "user_email" in st.session_state:
-        logged_in_email = st.session_state["user_email"]
-        sanitized_email = sanitize_email(logged_in_email)
-        try:
-            db.child("contacts").child(sanitized_email).child(contact_id).remove()
-            st.success("Contact deleted successfully!")
-            logging.warning(f"Deleted contact {contact_id} for user {logged_in_email}")
-        except Exception as e:
-            st.error(f"Error deleting contact: {e}")
-            logging.error(f"Error deleting contact {contact_id} for user {logged_in_email}: {e}")
-    else:
-        st.error("No user logged in. Please log in to delete contacts.")
-        logging.warning("Attempt to delete contact without logged-in user.")
-
-def delete_all_contacts():
-    if "user_email" in st.session_state:
-        logged_in_email = st.session_state["user_email"]
-        sanitized_email = sanitize_email(logged_in_email)
-        try:
-            db.child("contacts").child(sanitized_email).remove()
-            st.success("All contacts deleted successfully!")
-            logging.warning(f"Deleted all contacts for user {logged_in_email}")
-        except Exception as e:
-            st.error(f"Error deleting all contacts: {e}")
-            logging.error(f"Error deleting all contacts for user {logged_in_email}: {e}")
-    else:
-        st.error("No user logged in. Please log in to delete contacts.")
-        logging.warning("Attempt to delete all contacts without logged-in user.")
-
-# Streamlit interface for managing contacts
-def manage_contacts(display_sidebar):
-    display_sidebar()
-    st.title("Manage Contacts")
-
-    # Container for adding a new contact
-    with st.container():
-        st.subheader("Add a New Contact")
-        contact_name = st.text_input("Contact Name")
-        contact_email = st.text_input("Contact Email")
-        if st.button("Add Contact"):
-            if contact_name and contact_email:
-                add_contact(contact_name, contact_email)
-            else:
-                st.warning("Please enter both name and email to add a contact.")
-
-    # Container for uploading contacts from CSV
-    with st.container():
-        st.subheader("Add Contacts from CSV File")
-        uploaded_file = st.file_uploader("Upload a CSV file with 'Name' and 'Email' columns", type="csv")
-        if uploaded_file:
-            try:
-                csv_data = pd.read_csv(uploaded_file)
-                
-                if 'Name' in csv_data.columns and 'Email' in csv_data.columns:
-                    for index, row in csv_data.iterrows():
-                        if is_valid_email(row['Email']):
-                            add_contact(row['Name'], row['Email'])
-                        else:
-                            st.warning(f"Invalid email at row {index + 1}: {row['Email']}")
-                    
-                    st.success("All valid contacts from CSV have been added successfully!")
-                    logging.info("Contacts added from CSV for user.")
-                else:
-                    st.error("CSV must contain 'Name' and 'Email' columns.")
-                    logging.error("CSV missing required columns.")
-            except Exception as e:
-                st.error(f"Error reading CSV file: {e}")
-                logging.error(f"Error reading CSV file: {e}")
-
-    # Container for displaying existing contacts with edit and delete options
-    with st.container():
-        st.subheader("Your Contacts")
-        contacts = get_contacts()
-        if contacts:
-            for contact in contacts:
-                with st.expander(f"{contact['name']} ({contact['email']})"):
-                    new_name = st.text_input("Edit Name", value=contact["name"], key=f"edit_name_{contact['id']}")
-                    new_email = st.text_input("Edit Email", value=contact["email"], key=f"edit_email_{contact['id']}")
-
-                    if st.button("Update Contact", key=f"update_{contact['id']}"):
-                        if new_name and new_email:
-                            update_contact(contact["id"], new_name, new_email)
-                        else:
-                            st.warning("Please enter both name and email to update.")
-
-                    if st.button("Delete Contact", key=f"delete_{contact['id']}"):
-                        delete_contact(contact["id"])
-
-    st.write("---")
-    if st.button("Delete All Contacts"):
+import re
+import streamlit as st
+from dotenv import load_dotenv
+import pandas as pd
+import time
+import logging
+import threading
+from app_logging import setup_logging
+from metrics import time_firebase
+from storage import get_database
+from contact_index import ContactIndex
+from segments import (SEGMENT_FIELDS, apply_contact_changes, clear_segment_members, create_segment,
+                      delete_segment, get_segments, invalidate_segments, parse_tags)
+
+# Load environment variables from .env file
+load_dotenv()
+setup_logging()
+
+# Database reference from the configured storage engine
+db = get_database()
+
+# Function to sanitize email format
+def sanitize_email(email):
+    return email.replace('@', '_at_').replace('.', '_dot_')
+
+# Seconds the compose and contact pages reuse a user's contacts; writes made through this
+# module apply to them at once
+CONTACTS_CACHE_TTL = 300
+
+# Search indexes over each user's contacts, kept in step with writes made through this module
+_contact_indexes = {}  # user email -> (index, monotonic time it was loaded)
+_contact_indexes_lock = threading.Lock()
+
+# Function to get the user's contact search index; reloaded when it is older than CONTACTS_CACHE_TTL
+# or its size no longer matches contacts
+def get_contact_index(user_email, contacts=None):
+    with _contact_indexes_lock:
+        index, loaded_at = _contact_indexes.get(user_email, (None, 0))
+    fresh = time.monotonic() - loaded_at < CONTACTS_CACHE_TTL
+    if index is not None and (len(index) == len(contacts) if contacts is not None else fresh):
+        return index
+    if contacts is None:
+        try:
+            contacts = _fetch_contacts(user_email)
+        except Exception as e:
+            # Not kept, so the next rerun tries again
+            st.error(f"Error retrieving contacts: {e}")
+            logging.error(f"Error retrieving contacts for user {user_email}: {e}")
+            return ContactIndex()
+    index = ContactIndex(contacts)
+    with _contact_indexes_lock:
+        _contact_indexes[user_email] = (index, time.monotonic())
+    return index
+
+# Function to run a change against the user's index if one has been built; the memoized
+# contact list of the compose pages is dropped along with it
+def _update_contact_index(user_email, change):
+    with _contact_indexes_lock:
+        index, _ = _contact_indexes.get(user_email, (None, 0))
+    if index is not None:
+        change(index)
+    _cached_contact_emails.clear(user_email)
+
+@st.cache_data(ttl=CONTACTS_CACHE_TTL, show_spinner=False)
+def _cached_contact_emails(user_email):
+    with time_firebase("contacts.get"):
+        contacts_data = db.child("contacts").child(sanitize_email(user_email)).get().val() or {}
+    return [value.get("email") for value in contacts_data.values()]
+
+# Function to get the emails of the user's contacts for the compose pages, memoized per user
+def load_contact_emails(user_email):
+    if not user_email:
+        return []
+    try:
+        return _cached_contact_emails(user_email)
+    except Exception as e:
+        st.error(f"Error retrieving contacts: {e}")
+        logging.error(f"Error retrieving contacts for user {user_email}: {e}")
+        return []
+
+# Contact management functions
+def is_valid_email(email):
+    # Regex pattern for validating email
+    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
+    return re.match(pattern, email) is not None
+
+# Function to bring the user's segments in line with contact changes that are already saved.
+# A failure here does not undo the contact write, so it is reported on its own and the cached
+# segments are dropped, to be reloaded from the database on next use.
+def _refresh_segments(user_email, upserts=None, removed=()):
+    try:
+        apply_contact_changes(user_email, upserts, removed)
+    except Exception as e:
+        invalidate_segments(user_email)
+        st.warning(f"Contacts were saved, but their segments could not be updated: {e}")
+        logging.error(f"Error updating segments for user {user_email}: {e}")
+
+# Function to add a contact for the logged-in user
+def add_contact(contact_name, contact_email, tags=None):
+    if not is_valid_email(contact_email):
+        st.error("Invalid email format. Please enter a valid email address.")
+        return  # Stop if email is invalid
+
+    if "user_email" in st.session_state:
+        logged_in_email = st.session_state["user_email"]
+        sanitized_email = sanitize_email(logged_in_email)
+        contact_data = {"name": contact_name, "email": contact_email}
+        if parse_tags(tags):
+            contact_data["tags"] = parse_tags(tags)
+        try:
+            # Add the contact under the logged-in user's sanitized email
+            with time_firebase("contacts.add"):
+                result = db.child("contacts").child(sanitized_email).push(contact_data)
+            _update_contact_index(logged_in_email, lambda index: index.add({"id": result["name"], **contact_data}))
+            _refresh_segments(logged_in_email, {result["name"]: {"tags": [], "source": None, **contact_data}})
+            st.success(f"Contact '{contact_name}' added successfully!")
+            logging.info(f"Added contact: {contact_name} for user {logged_in_email}")
+        except Exception as e:
+            st.error(f"Error adding contact: {e}")
+            logging.error(f"Error adding contact for user {logged_in_email}: {e}")
+    else:
+        st.error("No user logged in. Please log in to add contacts.")
+        logging.warning("Attempt to add contact without logged-in user.")
+
+# Function to read all of a user's contacts from the database
+def _fetch_contacts(user_email):
+    with time_firebase("contacts.get"):
+        contacts_data = db.child("contacts").child(sanitize_email(user_email)).get().val() or {}
+    return [{
+        "id": key,
+        "name": value.get("name"),
+        "email": value.get("email"),
+        "tags": value.get("tags") or [],
+        "source": value.get("source"),
+    } for key, value in contacts_data.items()]
+
+# Function to retrieve contacts for the logged-in user
+def get_contacts(user_email=None):
+    contacts = []
+    if user_email is None and "user_email" in st.session_state:
+        user_email = st.session_state["user_email"]
+
+    if user_email:
+        try:
+            contacts = _fetch_contacts(user_email)
+            if not contacts:
+                st.info("No contacts found.")
+                logging.info("No contacts found for user.")
+        except Exception as e:
+            st.error(f"Error retrieving contacts: {e}")
+            logging.error(f"Error retrieving contacts for user {user_email}: {e}")
+    else:
+        st.error("No user logged in. Please log in to view contacts.")
+        logging.warning("Attempt to retrieve contacts without logged-in user.")
+    return contacts
+
+# Function to update a specific contact
+def update_contact(contact_id, new_name, new_email):
+    if not is_valid_email(new_email):
+        st.error("Invalid email format. Please enter a valid email address.")
+        return  # Stop if email is invalid
+
+    if "user_email" in st.session_state:
+        logged_in_email = st.session_state["user_email"]
+        sanitized_email = sanitize_email(logged_in_email)
+        try:
+            with time_firebase("contacts.update"):
+                db.child("contacts").child(sanitized_email).child(contact_id).update({
+                    "name": new_name,
+                    "email": new_email
+                })
+            _update_contact_index(logged_in_email, lambda index: index.update(
+                {"id": contact_id, "name": new_name, "email": new_email}))
+            _refresh_segments(logged_in_email, {contact_id: {"name": new_name, "email": new_email}})
+            st.success("Contact updated successfully!")
+            logging.info(f"Updated contact {contact_id} for user {logged_in_email}")
+        except Exception as e:
+            st.error(f"Error updating contact: {e}")
+            logging.error(f"Error updating contact {contact_id} for user {logged_in_email}: {e}")
+    else:
+        st.error("No user logged in. Please log in to update contacts.")
+        logging.warning("Attempt to update contact without logged-in user.")
+
+# Function to delete a specific contact
+def delete_contact(contact_id):
+    if "user_email" in st.session_state:
+        logged_in_email = st.session_state["user_email"]
+        sanitized_email = sanitize_email(logged_in_email)
+        try:
+            with time_firebase("contacts.delete"):
+                db.child("contacts").child(sanitized_email).child(contact_id).remove()
+            _update_contact_index(logged_in_email, lambda index: index.remove(contact_id))
+            _refresh_segments(logged_in_email, removed=[contact_id])
+            st.success("Contact deleted successfully!")
+            logging.warning(f"Deleted contact {contact_id} for user {logged_in_email}")
+        except Exception as e:
+            st.error(f"Error deleting contact: {e}")
+            logging.error(f"Error deleting contact {contact_id} for user {logged_in_email}: {e}")
+    else:
+        st.error("No user logged in. Please log in to delete contacts.")
+        logging.warning("Attempt to delete contact without logged-in user.")
+
+def delete_all_contacts():
+    if "user_email" in st.session_state:
+        logged_in_email = st.session_state["user_email"]
+        sanitized_email = sanitize_email(logged_in_email)
+        try:
+            with time_firebase("contacts.delete_all"):
+                db.child("contacts").child(sanitized_email).remove()
+            with _contact_indexes_lock:
+                _contact_indexes.pop(logged_in_email, None)
+            _cached_contact_emails.clear(logged_in_email)
+            try:
+                clear_segment_members(logged_in_email)
+            except Exception as e:
+                invalidate_segments(logged_in_email)
+                st.warning(f"Contacts were deleted, but their segments could not be emptied: {e}")
+                logging.error(f"Error clearing segments for user {logged_in_email}: {e}")
+            st.success("All contacts deleted successfully!")
+            logging.warning(f"Deleted all contacts for user {logged_in_email}")
+        except Exception as e:
+            st.error(f"Error deleting all contacts: {e}")
+            logging.error(f"Error deleting all contacts for user {logged_in_email}: {e}")
+    else:
+        st.error("No user logged in. Please log in to delete contacts.")
+        logging.warning("Attempt to delete all contacts without logged-in user.")
+
+# Contacts written per multi-location update
+CONTACTS_BATCH_SIZE = 500
+CONTACTS_PAGE_SIZES = [25, 50, 100]
+
+# Function to apply a multi-location update to the user's contacts in batches
+def _batched_contacts_update(sanitized_email, updates, operation):
+    items = list(updates.items())
+    for start in range(0, len(items), CONTACTS_BATCH_SIZE):
+        with time_firebase(operation):
+            db.child("contacts").child(sanitized_email).update(dict(items[start:start + CONTACTS_BATCH_SIZE]))
+
+# Function to add many contacts [(name, email, tags), ...] with batched writes
+def add_contacts_bulk(new_contacts, source=None):
+    if "user_email" not in st.session_state:
+        st.error("No user logged in. Please log in to add contacts.")
+        return 0
+    logged_in_email = st.session_state["user_email"]
+    sanitized_email = sanitize_email(logged_in_email)
+    updates = {}
+    for name, email, tags in new_contacts:
+        contact_data = {"name": name, "email": email}
+        if tags:
+            contact_data["tags"] = parse_tags(tags)
+        if source:
+            contact_data["source"] = source
+        updates[db.generate_key()] = contact_data
+    try:
+        _batched_contacts_update(sanitized_email, updates, "contacts.add_bulk")
+        _update_contact_index(logged_in_email, lambda index: index.add_many(
+            {"id": contact_id, **fields} for contact_id, fields in updates.items()))
+        _refresh_segments(logged_in_email, {
+            contact_id: {"tags": [], "source": None, **fields} for contact_id, fields in updates.items()})
+        logging.info("Added %d contacts for user %s", len(updates), logged_in_email)
+        return len(updates)
+    except Exception as e:
+        st.error(f"Error adding contacts: {e}")
+        logging.error("Error adding contacts for user %s: %s", logged_in_email, e)
+        return 0
+
+# Function to update many contacts {contact_id: {"name": ..., "email": ...}} with batched writes
+def update_contacts_bulk(changes):
+    if "user_email" not in st.session_state:
+        st.error("No user logged in. Please log in to update contacts.")
+        return 0
+    logged_in_email = st.session_state["user_email"]
+    sanitized_email = sanitize_email(logged_in_email)
+    updates = {}
+    for contact_id, fields in changes.items():
+        for field, value in fields.items():
+            updates[f"{contact_id}/{field}"] = value
+    try:
+        _batched_contacts_update(sanitized_email, updates, "contacts.update_bulk")
+        _update_contact_index(logged_in_email, lambda index: index.update_many(
+            [{"id": contact_id, **fields} for contact_id, fields in changes.items()]))
+        _refresh_segments(logged_in_email, changes)
+        logging.info("Updated %d contacts for user %s", len(changes), logged_in_email)
+        return len(changes)
+    except Exception as e:
+        st.error(f"Error updating contacts: {e}")
+        logging.error("Error updating contacts for user %s: %s", logged_in_email, e)
+        return 0
+
+# Function to delete many contacts by ID with batched writes
+def delete_contacts_bulk(contact_ids):
+    if "user_email" not in st.session_state:
+        st.error("No user logged in. Please log in to delete contacts.")
+        return 0
+    logged_in_email = st.session_state["user_email"]
+    sanitized_email = sanitize_email(logged_in_email)
+    try:
+        _batched_contacts_update(sanitized_email, {contact_id: None for contact_id in contact_ids}, "contacts.delete_bulk")
+        _update_contact_index(logged_in_email, lambda index: index.remove_many(contact_ids))
+        _refresh_segments(logged_in_email, removed=contact_ids)
+        logging.warning("Deleted %d contacts for user %s", len(contact_ids), logged_in_email)
+        return len(contact_ids)
+    except Exception as e:
+        st.error(f"Error deleting contacts: {e}")
+        logging.error("Error deleting contacts for user %s: %s", logged_in_email, e)
+        return 0
+
+# Function to show one page of contacts as an editable table with bulk actions
+def show_contacts_page(index):
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("Search Contacts", placeholder="Name or email")
+    with col2:
+        page_size = st.selectbox("Per Page", options=CONTACTS_PAGE_SIZES)
+
+    matches = index.search(query, limit=None)
+    page_count = max((len(matches) + page_size - 1) // page_size, 1)
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, step=1)
+    page_contacts = matches[(page - 1) * page_size:page * page_size]
+    st.caption(f"{len(matches)} matching contact(s) of {len(index)}.")
+    if not page_contacts:
+        return
+
+    # A single editor widget for the current page only
+    page_df = pd.DataFrame({
+        "Select": False,
+        "Name": [contact["name"] for contact in page_contacts],
+        "Email": [contact["email"] for contact in page_contacts],
+        "Tags": [", ".join(contact.get("tags") or []) for contact in page_contacts],
+    }, index=[contact["id"] for contact in page_contacts])
+    edited_df = st.data_editor(
+        page_df,
+        hide_index=True,
+        key=f"contacts_editor_{query}_{page_size}_{page}",
+        column_config={"Select": st.column_config.CheckboxColumn("Select")},
+    )
+
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col1:
+        if st.button("Save Changes"):
+            changes = {}
+            for contact_id, row in edited_df.iterrows():
+                original = page_df.loc[contact_id]
+                if (row["Name"] == original["Name"] and row["Email"] == original["Email"]
+                        and row["Tags"] == original["Tags"]):
+                    continue
+                if not row["Name"] or not is_valid_email(row["Email"] or ""):
+                    st.warning(f"Skipped invalid row: {row['Name']} ({row['Email']})")
+                    continue
+                changes[contact_id] = {"name": row["Name"], "email": row["Email"], "tags": parse_tags(row["Tags"] or "")}
+            if changes:
+                updated = update_contacts_bulk(changes)
+                st.success(f"Updated {updated} contact(s).")
+            else:
+                st.info("No changes to save.")
+    with col2:
+        if st.button("Delete Selected"):
+            selected_ids = edited_df.index[edited_df["Select"]].tolist()
+            if selected_ids:
+                deleted = delete_contacts_bulk(selected_ids)
+                st.success(f"Deleted {deleted} contact(s).")
+            else:
+                st.info("No contacts selected.")
+    with col3:
+        if query:
+            # Every match goes at once, so the delete has to be confirmed first; the confirmation
+            # is keyed by the search and its count, so it does not carry over to other matches
+            confirmed = st.checkbox(f"Yes, delete all {len(matches)} contacts matching \"{query}\"",
+                                    key=f"confirm_delete_matching_{query}_{len(matches)}")
+            if st.button(f"Delete All {len(matches)} Matching", disabled=not confirmed) and confirmed:
+                deleted = delete_contacts_bulk([contact["id"] for contact in matches])
+                st.success(f"Deleted {deleted} contact(s).")
+
+# Function to list, create and delete the user's contact segments
+def show_segments(user_email, contacts):
+    segments = get_segments(user_email)
+    if segments:
+        st.dataframe(pd.DataFrame({
+            "Segment": [segment.name for segment in segments],
+            "Rule": [segment.describe() for segment in segments],
+            "Members": [len(segment) for segment in segments],
+        }), hide_index=True)
+    else:
+        st.info("No segments yet.")
+
+    with st.expander("Create Segment"):
+        segment_name = st.text_input("Segment Name")
+        field = st.selectbox("Rule", options=list(SEGMENT_FIELDS), format_func=SEGMENT_FIELDS.get)
+        if field == "source":
+            sources = sorted({contact["source"] for contact in contacts if contact.get("source")})
+            value = st.selectbox("File", options=sources)
+        elif field == "tag":
+            tags = sorted({tag for contact in contacts for tag in contact.get("tags") or []})
+            value = st.selectbox("Tag", options=tags)
+        else:
+            value = st.text_input("Domain", placeholder="example.com").strip().lstrip("@")
+        if st.button("Create Segment"):
+            if segment_name and value:
+                try:
+                    segment = create_segment(user_email, segment_name, field, value, contacts)
+                    st.success(f"Segment '{segment_name}' created with {len(segment)} members.")
+                except Exception as e:
+                    st.error(f"Error creating segment: {e}")
+                    logging.error(f"Error creating segment for user {user_email}: {e}")
+            else:
+                st.warning("Please enter a segment name and a rule value.")
+
+    if segments:
+        to_delete = st.selectbox("Segment to Delete", options=segments, format_func=lambda segment: segment.name)
+        if st.button("Delete Segment"):
+            try:
+                delete_segment(user_email, to_delete.id)
+                st.success(f"Segment '{to_delete.name}' deleted.")
+            except Exception as e:
+                st.error(f"Error deleting segment: {e}")
+                logging.error(f"Error deleting segment for user {user_email}: {e}")
+
+# Streamlit interface for managing contacts
+def manage_contacts(display_sidebar):
+    display_sidebar()
+    st.title("Manage Contacts")
+
+    # Container for adding a new contact
+    with st.container():
+        st.subheader("Add a New Contact")
+        contact_name = st.text_input("Contact Name")
+        contact_email = st.text_input("Contact Email")
+        contact_tags = st.text_input("Tags", placeholder="Comma-separated, e.g. customers, newsletter")
+        if st.button("Add Contact"):
+            if contact_name and contact_email:
+                add_contact(contact_name, contact_email, contact_tags)
+            else:
+                st.warning("Please enter both name and email to add a contact.")
+
+    # Container for uploading contacts from CSV
+    with st.container():
+        st.subheader("Add Contacts from CSV File")
+        uploaded_file = st.file_uploader("Upload a CSV file with 'Name' and 'Email' columns (and optional 'Tags')", type="csv")
+        if uploaded_file and st.button("Import Contacts"):
+            try:
+                csv_data = pd.read_csv(uploaded_file)
+                
+                if 'Name' in csv_data.columns and 'Email' in csv_data.columns:
+                    new_contacts = []
+                    invalid_rows = []
+                    tag_column = csv_data['Tags'] if 'Tags' in csv_data.columns else [""] * len(csv_data)
+                    for index, name, email, tags in zip(csv_data.index, csv_data['Name'], csv_data['Email'], tag_column):
+                        if isinstance(email, str) and is_valid_email(email):
+                            new_contacts.append(("" if pd.isna(name) else str(name), email,
+                                                 parse_tags(tags if isinstance(tags, str) else "")))
+                        else:
+                            invalid_rows.append(str(index + 1))
+
+                    if invalid_rows:
+                        st.warning(f"Skipped {len(invalid_rows)} row(s) with invalid emails: rows {', '.join(invalid_rows[:20])}"
+                                   + (" ..." if len(invalid_rows) > 20 else ""))
+                    added = add_contacts_bulk(new_contacts, source=uploaded_file.name)
+                    st.success(f"{added} valid contacts from CSV have been added successfully!")
+                    logging.info("Contacts added from CSV for user.")
+                else:
+                    st.error("CSV must contain 'Name' and 'Email' columns.")
+                    logging.error("CSV missing required columns.")
+            except Exception as e:
+                st.error(f"Error reading CSV file: {e}")
+                logging.error(f"Error reading CSV file: {e}")
+
+    # Container for displaying existing contacts, one page at a time, with edit and delete options.
+    # The page is served from the user's contact index, which the edits above keep up to date,
+    # so reruns do not reload the address book.
+    user_email = st.session_state.get("user_email")
+    with st.container():
+        st.subheader("Your Contacts")
+        if not user_email:
+            st.error("No user logged in. Please log in to view contacts.")
+            return
+        index = get_contact_index(user_email)
+        if len(index):
+            show_contacts_page(index)
+        else:
+            st.info("No contacts found.")
+
+    # Container for named segments over the contacts
+    with st.container():
+        st.subheader("Segments")
+        show_segments(user_email, index.search("", limit=None))
+
+    st.write("---")
+    if st.button("Delete All Contacts"):
         delete_all_contacts()
\ No newline at end of file
@@ -1,156 +1,280 @@
-import streamlit as st
-import pandas as pd
-from dotenv import load_dotenv
-import os
-import pyrebase
-load_dotenv()
-
-# Initialize Firebase configuration
-config = {
-    "apiKey": os.getenv('API_KEY'),
-    "authDomain": os.getenv('AUTH_DOMAIN'),
-    "databaseURL": os.getenv('DATABASE_URL'),
-    "projectId": os.getenv('PROJECT_ID'),
-    "storageBucket": os.getenv('STORAGE_BUCKET'),
-    "messagingSenderId": os.getenv('MESSAGING_SENDER_ID'),
-    "appId": os.getenv('APP_ID')
-}
-
-firebase = pyrebase.initialize_app(config)
-auth = firebase.auth()
-db = firebase.database()
-
-# Function to sanitize email format
-def sanitize_email(email):
-    return email.replace('@', '_at_').replace('.', '_dot_')
-
-# Save email delivery log to Firebase
-def save_email_log_to_firebase(user_email, log_entry):
-    sanitized_email = sanitize_email(user_email)
-    try:
-        db.child("email_delivery_logs").child(sanitized_email).push(log_entry)
-    except Exception as e:
-        st.error(f"Error saving log to Firebase: {e}")
-
-# Retrieve email delivery logs from Firebase
-def get_email_logs(user_email):
-    sanitized_user_email = sanitize_email(user_email)  # Sanitize the email
-    
-    # Fetch logs for the sanitized user email
-    logs = db.child("email_logs").child(sanitized_user_email).get()
-    
-    if logs.each():
-        return [
-            {
-                "recipient": log.val()["recipient"],
-                "status": log.val()["status"],
-                "Timestamp": log.val()["Timestamp"],
-                "service": log.val()["service"],
-                "error": log.val().get("error")
-            }
-            for log in logs.each()
-        ]
-    else:
-        return []  # Return empty list if no logs are found
-
-# Enhanced Dashboard Page Function
-def dashboard_page(display_sidebar):
-    # Display the sidebar
-    display_sidebar()
-
-    st.header("Email Delivery Dashboard")
-
-    # Get user email from session
-    user_email = st.session_state.get("user_email")
-
-    if user_email is None:
-        st.error("User email not found. Please log in.")
-        return  # Exit if user email is not found
-
-    # Retrieve email delivery logs from Firebase
-    email_delivery_log = get_email_logs(user_email)
-
-    # Check if there are any logs to display
-    if email_delivery_log:
-        delivery_log_df = pd.DataFrame(email_delivery_log)
-
-        if not delivery_log_df.empty:
-            # Convert 'Timestamp' column to datetime if it exists
-            if 'Timestamp' in delivery_log_df.columns:
-                try:
-                    delivery_log_df['Timestamp'] = pd.to_datetime(delivery_log_df['Timestamp'])
-                    delivery_log_df['Date'] = delivery_log_df['Timestamp'].dt.date
-                    delivery_log_df['Hour'] = delivery_log_df['Timestamp'].dt.hour
-                except Exception as e:
-                    st.warning(f"Error parsing timestamps: {e}")
-
-            # Date range filter
-            st.subheader("Filter by Date Range")
-            min_date = delivery_log_df['Date'].min()
-            max_date = delivery_log_df['Date'].max()
-            start_date, end_date = st.date_input(
-                "Select Date Range",
-                [min_date, max_date],
-                min_value=min_date,
-                max_value=max_date
-            )
-
-            # Apply date range filter
-            filtered_log_df = delivery_log_df[
-                (delivery_log_df['Date'] >= start_date) & (delivery_log_df['Date'] <= end_date)
-            ]
-
-            # Status filter
-            unique_statuses = filtered_log_df['status'].unique().tolist()
-            selected_statuses = st.multiselect("Select Status to Filter", options=unique_statuses, default=unique_statuses)
-            filtered_log_df = filtered_log_df[filtered_log_df['status'].isin(selected_statuses)]
-
-            # Reset filter button
-            if st.button("Reset Filters"):
-                filtered_log_df = delivery_log_df
-
-            # Display metrics in columns for better layout
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Total Emails Sent", len(filtered_log_df))
-            with col2:
-                success_count = len(filtered_log_df[filtered_log_df['status'] == 'Sent'])
-                st.metric("Total Successful Deliveries", success_count, delta=success_count / len(filtered_log_df) * 100 if len(filtered_log_df) > 0 else 0)
-            with col3:
-                failed_count = len(filtered_log_df[filtered_log_df['status'] == 'Failed'])
-                st.metric("Total Failed Deliveries", failed_count, delta=-failed_count / len(filtered_log_df) * 100 if len(filtered_log_df) > 0 else 0)
-
-             # Display the filtered log in an interactive table with styling
-            st.dataframe(
-                filtered_log_df.style.set_properties(**{'text-align': 'center'}).map(
-                    lambda x: 'background-color: #f99;' if x == 'Failed' else 'background-color: #9f9;', subset=['status']
-                )
-            )
-
-            # Display bar chart for statuses
-            status_counts = filtered_log_df['status'].value_counts()
-            st.subheader("Email Delivery Status Overview")
-            st.bar_chart(status_counts)
-
-            # Display Service-wise Email Distribution
-            st.subheader("Service-wise Email Distribution")
-            service_counts = filtered_log_df['service'].value_counts()
-            st.bar_chart(service_counts)
-
-            # Display Hourly Email Trendsr
-            if 'Hour' in filtered_log_df.columns:
-                st.subheader("Hourly Email Trends")
-                hourly_counts = filtered_log_df.groupby('Hour')['status'].value_counts().unstack().fillna(0)
-                st.line_chart(hourly_counts)
-
-            # Display Daily Trends if timestamp data is available
-            if 'Date' in filtered_log_df.columns:
-                st.subheader("Daily Email Trends")
-                daily_counts = filtered_log_df.groupby('Date')['status'].value_counts().unstack().fillna(0)
-                st.line_chart(daily_counts)
-
-        else:
-            st.info("No emails have been sent yet. Start sending emails to view delivery data here.")
-    else:
-        st.info("No emails have been sent yet. Start sending emails to view delivery data here.")
-
+import streamlit as st
+import pandas as pd
+from dotenv import load_dotenv
+import os
+import datetime
+from collections import Counter
+from metrics import time_firebase
+from storage import get_database
+from email_logs import (LOG_RETENTION_DAYS, LOG_ARCHIVE_DIR, STATUS_CODES, SERVICE_CODES, load_email_logs, load_email_log_summary,
+                        maybe_compact_email_logs, query_log_archive, log_feed, feed_records_frame)
+from log_export import EXPORT_FORMATS, export_email_logs_to_file
+load_dotenv()
+
+LIVE_REFRESH_SECONDS = 1
+LIVE_RECENT_ROWS = 20  # Latest entries listed in live mode
+LIVE_WINDOW_MINUTES = 60  # Span of the per-minute chart in live mode
+
+# Database reference from the configured storage engine
+db = get_database()
+
+# Function to sanitize email format
+def sanitize_email(email):
+    return email.replace('@', '_at_').replace('.', '_dot_')
+
+# Save email delivery log to Firebase
+def save_email_log_to_firebase(user_email, log_entry):
+    sanitized_email = sanitize_email(user_email)
+    try:
+        with time_firebase("email_delivery_logs.push"):
+            db.child("email_delivery_logs").child(sanitized_email).push(log_entry)
+    except Exception as e:
+        st.error(f"Error saving log to Firebase: {e}")
+
+# Retrieve email delivery logs from Firebase as a DataFrame
+def get_email_logs(user_email):
+    return load_email_logs(user_email)
+
+# Delivery log of a dashboard session: loaded once, then kept current from the change feed,
+# with the live counts updated from the new entries only
+class LiveDeliveryLog:
+    def __init__(self, user_email):
+        self.user_email = user_email
+        self.load()
+
+    def load(self):
+        sequence = log_feed.sequence()
+        frame, loaded_keys = load_email_logs(self.user_email, with_keys=True)
+        self._frames = [frame]
+        self.status_counts = Counter(frame["status"].dropna())
+        self.service_counts = Counter(frame["service"].dropna())
+        window_start = pd.Timestamp(datetime.datetime.now()) - pd.Timedelta(minutes=LIVE_WINDOW_MINUTES)
+        timestamps = pd.to_datetime(frame["Timestamp"], errors="coerce")
+        self.minute_counts = Counter(timestamps[timestamps >= window_start].dt.floor("min"))
+        self.recent = frame.tail(LIVE_RECENT_ROWS)
+
+        # Entries logged while the log was loading may already be in it; the feed carries each entry's key
+        records, self.sequence, _ = log_feed.since(self.user_email, sequence)
+        records = [record for record in records if record[5] not in loaded_keys]
+        if records:
+            self._apply(feed_records_frame(records))
+
+    # Function to pick up the entries logged since the last look; reloads if the feed has moved past them
+    def refresh(self):
+        records, sequence, complete = log_feed.since(self.user_email, self.sequence)
+        if not complete:
+            self.load()
+            return
+        self.sequence = sequence
+        if records:
+            self._apply(feed_records_frame(records))
+
+    def _apply(self, new_frame):
+        if new_frame.empty:
+            return
+        self._frames.append(new_frame)
+        self.status_counts.update(new_frame["status"])
+        self.service_counts.update(new_frame["service"])
+        self.minute_counts.update(new_frame["Timestamp"].dt.floor("min"))
+        self.recent = pd.concat([self.recent, new_frame], ignore_index=True).tail(LIVE_RECENT_ROWS)
+
+    # The whole log; new entries are concatenated once, when the full page needs them
+    @property
+    def frame(self):
+        if len(self._frames) > 1:
+            self._frames = [pd.concat(self._frames, ignore_index=True)]
+        return self._frames[0]
+
+# Function to get the session's live log for the user, loading it on first use
+def get_live_delivery_log(user_email):
+    live_log = st.session_state.get("live_delivery_log")
+    if live_log is None or live_log.user_email != user_email:
+        live_log = st.session_state["live_delivery_log"] = LiveDeliveryLog(user_email)
+    return live_log
+
+# Function to show the live counts and latest entries; reruns on its own every LIVE_REFRESH_SECONDS
+def show_live_delivery(live_log):
+    live_log.refresh()
+    st.subheader("Live Delivery")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Total Logged", sum(live_log.status_counts.values()))
+    col2.metric("Sent", live_log.status_counts.get("Sent", 0))
+    col3.metric("Failed", live_log.status_counts.get("Failed", 0))
+
+    window_start = pd.Timestamp(datetime.datetime.now()).floor("min") - pd.Timedelta(minutes=LIVE_WINDOW_MINUTES)
+    for minute in [minute for minute in live_log.minute_counts if minute < window_start]:
+        del live_log.minute_counts[minute]
+    if live_log.minute_counts:
+        st.caption(f"Entries per minute, last {LIVE_WINDOW_MINUTES} minutes")
+        st.bar_chart(pd.Series(live_log.minute_counts, name="entries").sort_index())
+    st.caption("Latest entries")
+    st.dataframe(live_log.recent.iloc[::-1], hide_index=True)
+
+# Enhanced Dashboard Page Function
+def dashboard_page(display_sidebar):
+    # Display the sidebar
+    display_sidebar()
+
+    st.header("Email Delivery Dashboard")
+
+    # Get user email from session
+    user_email = st.session_state.get("user_email")
+
+    if user_email is None:
+        st.error("User email not found. Please log in.")
+        return  # Exit if user email is not found
+
+    # Roll entries past the retention window into daily summaries in the background (only
+    # when CMAIL_LOG_AUTO_COMPACT is enabled; otherwise log_compact.py does it on demand)
+    maybe_compact_email_logs(user_email)
+
+    # Live mode loads the log once and follows new entries through the change feed
+    live = st.toggle("Live updates", help="Follow new delivery log entries while campaigns send, without reloading the log.")
+    if live:
+        live_log = get_live_delivery_log(user_email)
+        st.fragment(run_every=LIVE_REFRESH_SECONDS)(show_live_delivery)(live_log)
+        email_delivery_log = live_log.frame
+    else:
+        st.session_state.pop("live_delivery_log", None)
+        # Retrieve email delivery logs from Firebase
+        email_delivery_log = get_email_logs(user_email)
+
+    # Check if there are any logs to display
+    if len(email_delivery_log):
+        delivery_log_df = email_delivery_log
+
+        if not delivery_log_df.empty:
+            # Convert 'Timestamp' column to datetime if it exists; the display columns go on a new
+            # frame, since in live mode the log is the session's LiveDeliveryLog frame
+            if 'Timestamp' in delivery_log_df.columns:
+                try:
+                    timestamps = pd.to_datetime(delivery_log_df['Timestamp'])
+                    delivery_log_df = delivery_log_df.assign(Timestamp=timestamps, Date=timestamps.dt.date, Hour=timestamps.dt.hour)
+                except Exception as e:
+                    st.warning(f"Error parsing timestamps: {e}")
+
+            # Date range filter
+            st.subheader("Filter by Date Range")
+            min_date = delivery_log_df['Date'].min()
+            max_date = delivery_log_df['Date'].max()
+            start_date, end_date = st.date_input(
+                "Select Date Range",
+                [min_date, max_date],
+                min_value=min_date,
+                max_value=max_date
+            )
+
+            # Apply date range filter
+            filtered_log_df = delivery_log_df[
+                (delivery_log_df['Date'] >= start_date) & (delivery_log_df['Date'] <= end_date)
+            ]
+
+            # Status filter
+            unique_statuses = filtered_log_df['status'].unique().tolist()
+            selected_statuses = st.multiselect("Select Status to Filter", options=unique_statuses, default=unique_statuses)
+            filtered_log_df = filtered_log_df[filtered_log_df['status'].isin(selected_statuses)]
+
+            # Reset filter button
+            if st.button("Reset Filters"):
+                filtered_log_df = delivery_log_df
+
+            # Display metrics in columns for better layout
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Total Emails Sent", len(filtered_log_df))
+            with col2:
+                success_count = len(filtered_log_df[filtered_log_df['status'].isin(['Sent', 'Delivered'])])
+                st.metric("Total Successful Deliveries", success_count, delta=success_count / len(filtered_log_df) * 100 if len(filtered_log_df) > 0 else 0)
+            with col3:
+                failed_count = len(filtered_log_df[filtered_log_df['status'].isin(['Failed', 'Bounced'])])
+                st.metric("Total Failed Deliveries", failed_count, delta=-failed_count / len(filtered_log_df) * 100 if len(filtered_log_df) > 0 else 0)
+
+             # Display the filtered log in an interactive table with styling
+            st.dataframe(
+                filtered_log_df.style.set_properties(**{'text-align': 'center'}).map(
+                    lambda x: 'background-color: #f99;' if x in ('Failed', 'Bounced')
+                    else 'background-color: #ff9;' if x == 'Unknown' else 'background-color: #9f9;', subset=['status']
+                )
+            )
+
+            # Display bar chart for statuses
+            status_counts = filtered_log_df['status'].value_counts()
+            st.subheader("Email Delivery Status Overview")
+            st.bar_chart(status_counts)
+
+            # Display Service-wise Email Distribution
+            st.subheader("Service-wise Email Distribution")
+            service_counts = filtered_log_df['service'].value_counts()
+            st.bar_chart(service_counts)
+
+            # Display Hourly Email Trendsr
+            if 'Hour' in filtered_log_df.columns:
+                st.subheader("Hourly Email Trends")
+                hourly_counts = filtered_log_df.groupby('Hour')['status'].value_counts().unstack().fillna(0)
+                st.line_chart(hourly_counts)
+
+            # Display Daily Trends if timestamp data is available
+            if 'Date' in filtered_log_df.columns:
+                st.subheader("Daily Email Trends")
+                daily_counts = filtered_log_df.groupby('Date')['status'].value_counts().unstack().fillna(0)
+                st.line_chart(daily_counts)
+
+        else:
+            st.info("No emails have been sent yet. Start sending emails to view delivery data here.")
+    else:
+        st.info("No emails have been sent yet. Start sending emails to view delivery data here.")
+
+    show_archived_history(user_email)
+    show_log_export(user_email)
+
+# Function to show the daily counts of compacted logs and load their archived detail on demand
+def show_archived_history(user_email):
+    summary_df = load_email_log_summary(user_email)
+    if summary_df.empty:
+        return
+
+    st.subheader("Archived History")
+    st.caption(f"Entries older than {LOG_RETENTION_DAYS} days are kept as daily totals; their detail is archived on this server under {LOG_ARCHIVE_DIR}.")
+    daily_totals = summary_df.pivot_table(index="Date", columns="status", values="count", aggfunc="sum").fillna(0)
+    st.line_chart(daily_totals)
+
+    with st.expander("Archived Detail"):
+        min_date = summary_df["Date"].min()
+        max_date = summary_df["Date"].max()
+        archive_range = st.date_input(
+            "Archived Date Range",
+            [max_date, max_date],
+            min_value=min_date,
+            max_value=max_date
+        )
+        if len(archive_range) == 2 and st.button("Load Archived Entries"):
+            archived_df = query_log_archive(user_email, archive_range[0], archive_range[1])
+            if archived_df.empty:
+                st.info("No archived entries found for this range on this server.")
+            else:
+                st.dataframe(archived_df)
+
+# Function to export the delivery log, archived days included, to a CSV or Parquet file
+def show_log_export(user_email):
+    with st.expander("Export Delivery Log"):
+        today = datetime.date.today()
+        export_range = st.date_input("Export Date Range", [today - datetime.timedelta(days=30), today], key="export_range")
+        export_statuses = st.multiselect("Statuses (none = all)", options=list(STATUS_CODES), key="export_statuses")
+        export_services = st.multiselect("Services (none = all)", options=list(SERVICE_CODES), key="export_services")
+        export_format = st.radio("Format", options=list(EXPORT_FORMATS), format_func=str.upper, horizontal=True,
+                                 key="export_format")
+        if len(export_range) == 2 and st.button("Export"):
+            try:
+                with st.spinner("Exporting delivery log..."):
+                    path, count = export_email_logs_to_file(user_email, export_range[0], export_range[1], export_format,
+                                                            export_statuses, export_services)
+            except ImportError:
+                st.error("Parquet export needs the pyarrow package.")
+                return
+            except Exception as e:
+                st.error(f"Error exporting delivery log: {e}")
+                return
+            st.success(f"Exported {count} entries to {path}")
+            with open(path, "rb") as export_file:
+                st.download_button("Download Export", export_file, file_name=os.path.basename(path),
+                                   mime=EXPORT_FORMATS[export_format])
@@ -0,0 +1,466 @@
+import datetime
+import time
+import logging
+import threading
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import streamlit as st
+from app_logging import recipient_log
+from contacts import load_contact_emails, get_contact_index
+from segments import get_segments
+from templates import load_templates
+from recipients import select_contacts, show_recipient_preview, collect_recipients
+from metrics import time_stage
+from email_logs import SessionDeliveryLog, save_email_log, save_email_logs
+from html_templates import compile_message
+from rendering import render_payloads, use_render_pool
+from drip import drip_toggle, drip_form_inputs, make_drip_schedule, save_drip_schedule, load_drip_schedule
+from attachments import (AttachmentError, check_attachment_sizes, format_size, attachments_digest,
+                         load_campaign_attachments, save_campaign_attachments)
+from campaigns import (content_hash, make_campaign_id, idempotency_key, get_sent_index, get_campaign_store,
+                       CampaignCheckpoint, CampaignProgress, launch_campaign, start_background_campaign,
+                       show_campaign_progress, list_interrupted_campaigns, submission_campaign_id)
+
+# Delivery pipeline shared by every provider. A campaign goes through the same stages
+# whichever provider sends it:
+#   ingest - recipients from the compose form, a CSV upload or the address book (recipients.py)
+#   dedupe - the campaign's pending recipients, minus those whose message the sent-index has
+#   render - payloads built by the provider, in the render pool for large campaigns
+#   send   - batches of the provider's batch size, one session per batch, on up to its
+#            max_sessions sessions at a time; drip campaigns are paced before rendering and
+#            sent over one session that follows the pacing
+#   log    - delivery log, session log, progress and checkpoint of every outcome
+# Providers plug in with a DeliveryAdapter, so batching, pooling and pacing apply to all of them.
+
+SCHEDULE_POLL_SECONDS = 10
+
+# What a provider declares to the pipeline. Subclasses set the class attributes and implement
+# session() and send(); render_chunk(recipients, campaign_id, subject, message_text, attachments)
+# must be a module-level function (wrapped in staticmethod) so the render pool can run it.
+class DeliveryAdapter:
+    name = None  # Service name in campaigns and logs
+    batch_size = 1  # Messages sent over one session
+    max_sessions = 1  # Sessions that may send at the same time
+    render_chunk = None
+    account = None  # Sending account; scheduled sends are coalesced per account
+    connection_errors = ()  # Exceptions of send() meaning the session dropped; it is reopened once per batch
+
+    # Function to open a connection for one batch; a context manager yielding the session
+    def session(self):
+        return contextlib.nullcontext()
+
+    # Function to send one rendered payload over a session. Returns (True, provider message ID)
+    # or (False, error) for a rejected message; an exception fails just this message.
+    def send(self, session, recipient, payload, key):
+        raise NotImplementedError
+
+    # Function to classify an exception raised by send(): "Failed" when the provider did not take
+    # the message, so a new submission may retry it, or "Unknown" when it may have (a transport
+    # error such as a timeout or a dropped connection), so it is never sent again automatically
+    def failure_status(self, session, error):
+        return "Unknown" if isinstance(error, OSError) else "Failed"
+
+# Function to send the pending recipients of a campaign through a provider, checkpointing every
+# outcome. Safe to run off the script thread: it reports through progress and delivery_log only.
+def run_campaign(adapter, user_email, campaign_id, subject, message_text, progress=None, delivery_log=None):
+    service = adapter.name
+    store = get_campaign_store()
+    checkpoint = CampaignCheckpoint(store, campaign_id)
+    sent_index = get_sent_index()
+    attachments = load_campaign_attachments(campaign_id)  # Encoded once for the whole campaign
+    if progress is None:
+        campaign = store.get(campaign_id)
+        progress = CampaignProgress(campaign_id, campaign["total"] - campaign["processed"])
+
+    def record(position, recipient, status, error=None):
+        if status == "Skipped":
+            recipient_log.info("Skipping %s send to %s - already sent", service, recipient,
+                               extra={"campaign_id": campaign_id})
+        else:
+            # A failed log write must not lose the outcome: progress and checkpoint are still recorded
+            try:
+                save_email_log(user_email, recipient, status, service, datetime.datetime.now(), subject, error,
+                               campaign_id=campaign_id)
+            except Exception as e:
+                logging.error("Error logging %s outcome %s for %s in campaign %s - Error: %s",
+                              service, status, recipient, campaign_id, e)
+            if delivery_log is not None:
+                outcome = {"Email": recipient, "Status": status, "Service": service, "Campaign": campaign_id}
+                if error:
+                    outcome["Error"] = error
+                delivery_log.append(outcome)
+            if status == "Sent":
+                recipient_log.info("Email by %s sent successfully to: %s", service, recipient,
+                                   extra={"campaign_id": campaign_id})
+            else:
+                recipient_log.error("Failed to send email by %s to %s - Error: %s", service, recipient, error,
+                                    extra={"campaign_id": campaign_id})
+        progress.record(recipient, status, error)
+        checkpoint.record(position, status, error)
+
+    # Dedupe: messages the provider has already accepted are never rendered or sent again
+    def unsent(items):
+        for position, recipient in items:
+            with time_stage("sent_index", service):
+                already_sent = sent_index.is_sent(idempotency_key(campaign_id, recipient, subject, message_text))
+            if already_sent:
+                record(position, recipient, "Skipped")
+            else:
+                yield position, recipient
+
+    # Function to record the outcome of one send. Only errors of the send itself fail a message:
+    # one the provider accepted stays "Sent" even if the sent-index write fails. "Unknown" sends
+    # go to the sent index as well, so no later run sends them again.
+    def record_send(position, recipient, key, status, detail):
+        try:
+            if status in ("Sent", "Unknown"):
+                try:
+                    with time_stage("sent_index", service):
+                        sent_index.mark_sent(key, recipient, detail if status == "Sent" else None, status)
+                except Exception as e:
+                    logging.error("Error adding %s to the sent index of campaign %s - Error: %s",
+                                  recipient, campaign_id, e)
+            record(position, recipient, status, None if status == "Sent" else detail)
+        except Exception as e:
+            logging.error("Error recording %s outcome for %s in campaign %s - Error: %s",
+                          service, recipient, campaign_id, e)
+
+    # Function to send items over one session, reopening it when it drops. A batch reconnects
+    # once and then fails its remaining items. A paced (drip) stream keeps its session across the
+    # gaps between sends: it may reconnect again once a message has gone out, and when no session
+    # can be opened only the item in hand fails, the next one trying a fresh session.
+    def send_batch(batch, paced=False):
+        items = iter(batch)
+        retry = []  # The item in hand when the session dropped, sent again on the new one
+        reconnects = 1
+        fetching = False  # Errors of the pacing or rendering behind items are not session failures
+        while True:
+            try:
+                with adapter.session() as session:
+                    while True:
+                        if retry:
+                            item, retry = retry[0], []
+                        else:
+                            fetching = True
+                            item = next(items, None)
+                            fetching = False
+                            if item is None:
+                                break
+                        (position, recipient), payload = item
+                        key = idempotency_key(campaign_id, recipient, subject, message_text)
+                        try:
+                            with time_stage("provider", service):
+                                success, detail = adapter.send(session, recipient, payload, key)
+                            status = "Sent" if success else "Failed"
+                        except Exception as e:
+                            status, detail = adapter.failure_status(session, e), str(e)
+                            if isinstance(e, adapter.connection_errors):
+                                # A message the provider did not take goes again on the new session;
+                                # one it may have taken is recorded as "Unknown" and not resent
+                                if status == "Unknown":
+                                    record_send(position, recipient, key, status, detail)
+                                else:
+                                    retry = [item]
+                                raise
+                        record_send(position, recipient, key, status, detail)
+                        if paced and status == "Sent":
+                            reconnects = 1
+            except adapter.connection_errors as e:
+                if fetching:
+                    raise
+                if reconnects:
+                    reconnects -= 1
+                    logging.warning("%s connection lost, reconnecting - Error: %s", service, e)
+                    continue
+                error = e
+            except Exception as e:
+                if fetching:
+                    raise
+                error = e
+            else:
+                return
+            # The session could not be opened (or broke again)
+            logging.critical("%s connection failure - Error: %s", service, error)
+            if not paced:
+                failed = itertools.chain(retry, items)
+            else:
+                failed = retry or list(itertools.islice(items, 1))
+                if not failed:
+                    return
+            for (position, recipient), _ in failed:
+                record(position, recipient, "Failed", str(error))
+            if not paced:
+                return
+            # The next item is waited for before a fresh session is tried for it
+            retry, reconnects = list(itertools.islice(items, 1)), 1
+            if not retry:
+                return
+
+    # Drip campaigns release recipients at their planned times, each sent as soon as it is due
+    # over a single session kept open for the whole drip
+    drip = load_drip_schedule(campaign_id)
+    pending = unsent(store.pending(campaign_id))
+    if drip is not None:
+        pending = drip.pace(pending, progress.remaining)
+
+    # Messages are rendered ahead of the batches; large campaigns without attachments render in
+    # worker processes (attachment payloads are cheap to build here but costly to ship back)
+    rendered = render_payloads(
+        adapter.render_chunk, pending, (campaign_id, subject, message_text, attachments), service,
+        parallel=drip is None and attachments is None and use_render_pool(progress.remaining))
+    try:
+        if drip is not None:
+            send_batch(rendered, paced=True)
+        else:
+            send_batches(rendered, adapter.batch_size, adapter.max_sessions, send_batch, service)
+    finally:
+        rendered.close()
+        checkpoint.finish()
+
+    return progress
+
+# Function to group rendered items into batches and hand them to send_batch, on up to
+# sessions threads with no more batches in flight than threads
+def send_batches(rendered, batch_size, sessions, send_batch, service):
+    def batches():
+        batch = []
+        for item in rendered:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    if sessions <= 1:
+        for batch in batches():
+            send_batch(batch)
+        return
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix=f"cmail-{service.lower()}") as pool:
+        in_flight = set()
+        for batch in batches():
+            if len(in_flight) >= sessions:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+            in_flight.add(pool.submit(send_batch, batch))
+        for future in in_flight:
+            future.result()
+
+# Scheduled sends. Jobs for the same provider, account, fire time and content are coalesced
+# into one pending batch with a single timer thread; when it fires, the batch is registered
+# as a campaign and goes through run_campaign like an immediate send, so it is batched over
+# the provider's sessions, checkpointed and resumable.
+class ScheduledBatches:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # (service, account, send_time, content hash, campaign_id) -> batch dict
+
+    # Function to add recipients to the batch due at send_time, starting its timer if it is new;
+    # returns the number of recipients now in the batch
+    def add(self, adapter, send_time, user_email, campaign_id, subject, message_text, recipients, delivery_log=None):
+        key = (adapter.name, adapter.account, send_time, content_hash(subject, message_text), campaign_id)
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = {"adapter": adapter, "user_email": user_email, "subject": subject,
+                         "message_text": message_text, "delivery_log": delivery_log, "recipients": {}}
+                self._pending[key] = batch
+                threading.Thread(target=self._run, args=(key,), name="cmail-schedule", daemon=True).start()
+            for recipient in recipients:
+                batch["recipients"].setdefault(recipient, None)  # Keeps the order and drops duplicates
+            return len(batch["recipients"])
+
+    def _run(self, key):
+        service, _, send_time, _, campaign_id = key
+        try:
+            while True:
+                remaining = (send_time - datetime.datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, SCHEDULE_POLL_SECONDS))
+            # Jobs added from now on start a batch of their own
+            with self._lock:
+                batch = self._pending.pop(key)
+            campaign = get_campaign_store().start(campaign_id, batch["user_email"], service, batch["subject"],
+                                                  batch["message_text"], batch["recipients"])
+            recipient_log.info("Scheduled %s batch of %d recipient(s) started at %s", service,
+                               len(batch["recipients"]), datetime.datetime.now(), extra={"campaign_id": campaign_id})
+            progress = CampaignProgress(campaign_id, campaign["total"] - campaign["processed"])
+            start_background_campaign(run_campaign, progress, batch["adapter"], batch["user_email"], campaign_id,
+                                      batch["subject"], batch["message_text"], delivery_log=batch["delivery_log"])
+        except Exception as e:
+            logging.error(f"Error in scheduled email task: {e}")
+
+scheduled_batches = ScheduledBatches()
+
+# Compose page shared by the providers. make_adapter is called when a campaign starts, so a
+# provider that has to authenticate only does so when something is sent.
+def compose_page(display_sidebar, service, make_adapter):
+    display_sidebar()
+
+    st.header(f"Compose Mail using {service}")
+
+    # Recent outcomes of this session's campaigns (bounded; the full record is the delivery log in storage)
+    if not isinstance(st.session_state.get('email_delivery_log'), SessionDeliveryLog):
+        st.session_state.email_delivery_log = SessionDeliveryLog()
+
+    user_email = st.session_state.get("user_email")
+    progress_key = f"{service.lower()}_campaign_progress"
+
+    # Offer to resume campaigns that were interrupted before finishing
+    resumable = list_interrupted_campaigns(user_email, service)
+    if resumable:
+        with st.expander(f"Interrupted campaigns ({len(resumable)})"):
+            campaign_labels = {
+                f"{campaign['subject']} - {campaign['processed']}/{campaign['total']} processed (last update {campaign['updated_at']})": campaign
+                for campaign in resumable
+            }
+            selected_label = st.selectbox("Select a campaign to resume", options=list(campaign_labels))
+            if st.button("Resume Campaign"):
+                campaign = campaign_labels[selected_label]
+                logging.info(f"Resuming {service} campaign {campaign['campaign_id']} at cursor {campaign['cursor']}")
+                launch_campaign(
+                    progress_key, run_campaign, campaign,
+                    make_adapter(), user_email, campaign['campaign_id'], campaign['subject'], campaign['message_text'],
+                    delivery_log=st.session_state.email_delivery_log
+                )
+
+    # Contacts come from a per-user cache, so reruns of this page do not refetch them
+    contact_emails = load_contact_emails(user_email)
+
+    # Multiselect for contacts (or a server-side selection for large address books)
+    selected_contacts, recipient_prefill = select_contacts(
+        contact_emails, get_contact_index(user_email), get_segments(user_email))
+
+    # Template, message and recipients rerun on their own when one of their widgets changes,
+    # without the sidebar, the resume list or the contact selection above
+    st.fragment(compose_section)(service, make_adapter, user_email, selected_contacts, recipient_prefill)
+
+# Function to get the campaign ID of a submission sent now, telling the user when it continues an
+# interrupted campaign with the same message instead of starting a new one
+def submission_campaign(user_email, service, subject, message_text, digest):
+    campaign_id, interrupted = submission_campaign_id(user_email, service, subject, message_text, digest)
+    if interrupted:
+        st.info(f"Continuing the interrupted campaign \"{subject}\" from {interrupted['created_at']}: "
+                f"recipients it already sent to are skipped.")
+    return campaign_id
+
+# Function to show the template choice, the message form and the recipient preview, and to
+# start the campaign and follow its progress
+def compose_section(service, make_adapter, user_email, selected_contacts, recipient_prefill):
+    progress_key = f"{service.lower()}_campaign_progress"
+
+    # Load templates for the current user
+    templates = load_templates(user_email)
+    template_names = [template['name'] for template in templates.values()]
+    selected_template = st.selectbox("Select a Template", options=[""] + template_names)
+
+    message_text = ""
+    subject = ""
+
+    if selected_template:
+        selected_template_id, selected_template_data = next(
+            ((template_id, template) for template_id, template in templates.items()
+             if template['name'] == selected_template), (None, None))
+
+        if selected_template_data:
+            message_text = selected_template_data['content']
+            subject = selected_template_data.get('subject', '')
+            # Compiled now so every message of the campaign reuses it
+            if compile_message(message_text, selected_template_id):
+                st.caption("HTML template: sent with styles inlined and a plain-text alternative.")
+
+    drip_check = drip_toggle()
+
+    # Form to collect email data
+    with st.form(key=f'{service.lower()}_form'):
+        subject = st.text_input('Subject', value=subject)
+        message_text = st.text_area('Message', value=message_text)
+        recipient_email = st.text_input(
+            'Recipient Email (For Multiple Recipients Enter Mail-id separated by comma)',
+            value=recipient_prefill
+        )
+        uploaded_file = st.file_uploader("Import CSV of Recipient Emails (CSV must contain an 'email' column)", type=['csv'])
+        attachment_files = st.file_uploader("Attachments", accept_multiple_files=True)
+        schedule_email_check = st.checkbox("Schedule Email")
+        send_datetime = None
+        if schedule_email_check:
+            send_date = st.date_input("Send Date")
+            send_time = st.time_input("Send Time")
+            send_datetime = datetime.datetime.combine(send_date, send_time)
+        drip_check, drip_end, max_per_hour, domain_per_hour = drip_form_inputs(drip_check)
+        submit_button = st.form_submit_button("Send Email")
+
+    recipient_list = collect_recipients(user_email, recipient_email, uploaded_file, selected_contacts)
+
+    show_recipient_preview(recipient_list)
+
+    attachments_ok = True
+    if attachment_files:
+        try:
+            total = check_attachment_sizes(attachment.size for attachment in attachment_files)
+            st.caption(f"{len(attachment_files)} attachment(s), {format_size(total)}.")
+        except AttachmentError as e:
+            st.error(str(e))
+            attachments_ok = False
+
+    if submit_button and attachments_ok:
+        if subject and message_text and recipient_list:
+            delivery_log = st.session_state.email_delivery_log
+            files = [(f.name, f, f.size) for f in attachment_files or []]
+            digest = attachments_digest(files)  # Other attachments make another campaign
+            if drip_check:
+                # Paced over the delivery window, starting now or at the scheduled time
+                start = send_datetime if schedule_email_check and send_datetime else datetime.datetime.now()
+                drip, drip_error = make_drip_schedule(max(start, datetime.datetime.now()), drip_end, max_per_hour,
+                                                      domain_per_hour)
+                if drip_error:
+                    st.warning(drip_error)
+                else:
+                    adapter = make_adapter()
+                    if schedule_email_check and send_datetime:
+                        campaign_id = make_campaign_id(user_email, service, subject, message_text, start, digest)
+                    else:
+                        campaign_id = submission_campaign(user_email, service, subject, message_text, digest)
+                    save_campaign_attachments(campaign_id, files)
+                    campaign = get_campaign_store().start(campaign_id, user_email, service, subject, message_text,
+                                                          recipient_list, digest)
+                    save_drip_schedule(campaign_id, drip)
+                    launch_campaign(
+                        progress_key, run_campaign, campaign,
+                        adapter, user_email, campaign_id, subject, message_text, delivery_log=delivery_log
+                    )
+                    st.success(f"Drip campaign to {len(recipient_list)} recipient(s) scheduled for {drip.describe()}.")
+            elif schedule_email_check and send_datetime:
+                # Check if the selected time is in the future
+                if send_datetime < datetime.datetime.now():
+                    st.warning("The selected time is in the past. Please choose a time in the future.")
+                else:
+                    adapter = make_adapter()
+                    campaign_id = make_campaign_id(user_email, service, subject, message_text, send_datetime, digest)
+                    save_campaign_attachments(campaign_id, files)
+                    scheduled_batches.add(adapter, send_datetime, user_email, campaign_id, subject, message_text,
+                                          recipient_list, delivery_log=delivery_log)
+                    st.success(f"Emails scheduled successfully for {send_datetime.strftime('%H:%M')}.")
+                    save_email_logs(user_email, recipient_list, "Scheduled", service, send_datetime, subject,
+                                    campaign_id=campaign_id)
+                    logging.info("Scheduled %s campaign %s for %s to %d recipient(s)", service, campaign_id, send_datetime,
+                                 len(recipient_list))
+            else:
+                # Immediate email sending, checkpointed so it can be resumed
+                adapter = make_adapter()
+                campaign_id = submission_campaign(user_email, service, subject, message_text, digest)
+                save_campaign_attachments(campaign_id, files)
+                campaign = get_campaign_store().start(campaign_id, user_email, service, subject, message_text,
+                                                      recipient_list, digest)
+                launch_campaign(
+                    progress_key, run_campaign, campaign,
+                    adapter, user_email, campaign_id, subject, message_text, delivery_log=delivery_log
+                )
+        else:
+            st.error("Subject, message, and at least one valid recipient email are required.")
+
+    # Live progress of the campaign running in the background
+    show_campaign_progress(progress_key)
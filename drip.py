@@ -0,0 +1,121 @@
+import time
+import datetime
+import logging
+import streamlit as st
+from campaigns import get_campaign_store
+
+# Drip campaigns spread their recipients over a delivery window instead of sending them
+# all at once. The pace is recomputed before every send from the time left and the
+# recipients left, so a campaign that fell behind (slow provider, restart) catches up
+# within its limits, and one that runs past the end of its window continues at the
+# maximum rate rather than dropping recipients.
+
+DOMAIN_LOOKAHEAD = 1000  # Pending recipients considered when a domain has used up its rate
+MAX_SLEEP_SECONDS = 60  # Longest single sleep, so long waits follow changes of the wall clock
+
+class DripSchedule:
+    def __init__(self, start_at, end_at, max_per_hour=None, domain_per_hour=None):
+        self.start_at = start_at  # Epoch seconds
+        self.end_at = end_at
+        self.max_per_hour = max_per_hour or None
+        self.domain_per_hour = domain_per_hour or None
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record["start_at"], record["end_at"], record.get("max_per_hour"), record.get("domain_per_hour"))
+
+    def describe(self):
+        start = datetime.datetime.fromtimestamp(self.start_at).strftime("%Y-%m-%d %H:%M")
+        end = datetime.datetime.fromtimestamp(self.end_at).strftime("%Y-%m-%d %H:%M")
+        limits = []
+        if self.max_per_hour:
+            limits.append(f"at most {self.max_per_hour:g}/hour")
+        if self.domain_per_hour:
+            limits.append(f"{self.domain_per_hour:g}/hour per domain")
+        return f"{start} to {end}" + (f" ({', '.join(limits)})" if limits else "")
+
+    # Seconds to wait between two sends, given what is left of the window
+    def interval(self, now, remaining):
+        floor = 3600 / self.max_per_hour if self.max_per_hour else 0.0
+        if remaining <= 0 or now >= self.end_at:
+            return floor
+        return max((self.end_at - now) / remaining, floor)
+
+    # Function to yield the (position, recipient) items at their planned send times.
+    # remaining is the number of items the campaign still has to send.
+    def pace(self, items, remaining, clock=time.time, sleep=time.sleep):
+        items = iter(items)
+        buffered = []
+        domain_ready = {}  # domain -> earliest time its next recipient may go out
+        domain_gap = 3600 / self.domain_per_hour if self.domain_per_hour else 0.0
+        next_send = max(self.start_at, clock())
+        logging.info("Drip campaign pacing %d recipient(s) over %s", remaining, self.describe())
+
+        while True:
+            lookahead = DOMAIN_LOOKAHEAD if domain_gap else 1
+            if len(buffered) < lookahead:
+                buffered.extend(item for _, item in zip(range(lookahead - len(buffered)), items))
+            if not buffered:
+                return
+
+            # First recipient (in send order) whose domain is free at the planned time
+            chosen = 0
+            if domain_gap:
+                ready_times = [domain_ready.get(self._domain(recipient), 0.0) for _, recipient in buffered]
+                candidates = [index for index, ready in enumerate(ready_times) if ready <= next_send]
+                if candidates:
+                    chosen = candidates[0]
+                else:
+                    chosen = min(range(len(buffered)), key=ready_times.__getitem__)
+                    next_send = ready_times[chosen]
+
+            while True:
+                wait = next_send - clock()
+                if wait <= 0:
+                    break
+                sleep(min(wait, MAX_SLEEP_SECONDS))
+
+            item = buffered.pop(chosen)
+            sent_at = clock()
+            if domain_gap:
+                domain_ready[self._domain(item[1])] = sent_at + domain_gap
+            yield item
+            remaining = max(remaining - 1, 0)
+            # Re-plan from the actual time, so delays shrink the following gaps
+            next_send = max(sent_at, clock()) + self.interval(clock(), remaining)
+
+    def _domain(self, recipient):
+        return recipient.rsplit("@", 1)[-1].lower()
+
+# Function to save the drip schedule of a campaign so resumes keep its pacing
+def save_drip_schedule(campaign_id, schedule):
+    get_campaign_store().set_drip(campaign_id, schedule.start_at, schedule.end_at, schedule.max_per_hour,
+                                  schedule.domain_per_hour)
+
+# Function to load the drip schedule of a campaign, or None for a campaign sent at full speed
+def load_drip_schedule(campaign_id):
+    record = get_campaign_store().get_drip(campaign_id)
+    return DripSchedule.from_record(record) if record else None
+
+# Function to show the drip toggle. It goes outside the compose form: a checkbox inside a form
+# only takes effect on submit, so the window inputs would not show until after a first send.
+def drip_toggle():
+    return st.checkbox("Drip over a delivery window")
+
+# Function to add the drip inputs to a compose form; returns (enabled, end, max/hour, per-domain/hour)
+def drip_form_inputs(drip_check):
+    drip_end = None
+    max_per_hour = domain_per_hour = 0
+    if drip_check:
+        end_date = st.date_input("Window End Date", value=datetime.date.today() + datetime.timedelta(days=1))
+        end_time = st.time_input("Window End Time", value=datetime.time(9, 0))
+        drip_end = datetime.datetime.combine(end_date, end_time)
+        max_per_hour = st.number_input("Max Emails per Hour (0 = no limit)", min_value=0, value=0, step=50)
+        domain_per_hour = st.number_input("Max Emails per Hour to One Domain (0 = no limit)", min_value=0, value=0, step=10)
+    return drip_check, drip_end, max_per_hour, domain_per_hour
+
+# Function to build a drip schedule from the form values, or return an error message
+def make_drip_schedule(start, end, max_per_hour=0, domain_per_hour=0):
+    if end is None or end <= start:
+        return None, "The delivery window must end after it starts."
+    return DripSchedule(start.timestamp(), end.timestamp(), max_per_hour, domain_per_hour), None
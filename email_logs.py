@@ -0,0 +1,517 @@
+from dotenv import load_dotenv
+import os
+import glob
+import gzip
+import json
+import time
+import datetime
+import heapq
+import threading
+import logging
+from collections import deque
+import pandas as pd
+from metrics import time_stage, time_firebase, count_message
+from storage import get_database, push_key_prefix
+from campaigns import DATA_DIR, make_campaign_id
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Database reference from the configured storage engine
+db = get_database()
+
+# Delivery log, stored per campaign: the subject, service and start time once under
+# email_log_campaigns/<user>/<campaign id> = {"s": subject, "v": service code, "t": epoch seconds}
+# and one compact entry per recipient outcome under
+# email_log_entries/<user>/<campaign id>/<push id> = [recipient, status code, epoch seconds(, error)].
+# Logs written before this layout stay under email_logs/<user> and are still read.
+#
+# Entries older than the retention window can be compacted: their detail goes to gzip JSON-lines
+# files under LOG_ARCHIVE_DIR/<user>/<YYYY-MM-DD>.jsonl.gz and their counts to
+# email_log_daily/<user>/<YYYY-MM-DD>/<service code>_<status code>, so hot reads stay bounded.
+# Compaction deletes the entries from the database, so it only runs when asked for: through
+# log_compact.py, or from the dashboard when CMAIL_LOG_AUTO_COMPACT=true.
+
+STATUS_CODES = {"Sent": 1, "Failed": 2, "Scheduled": 3, "Skipped": 4, "Bounced": 5, "Delivered": 6, "Unknown": 7}
+SERVICE_CODES = {"Gmail": 1, "Outlook": 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+SERVICE_NAMES = {code: name for name, code in SERVICE_CODES.items()}
+LOG_COLUMNS = ["recipient", "status", "Timestamp", "service", "error"]
+
+LOG_RETENTION_DAYS = int(os.getenv("CMAIL_LOG_RETENTION_DAYS", "30"))  # Raw entries kept in Firebase
+LOG_ARCHIVE_DIR = os.getenv("CMAIL_LOG_ARCHIVE_DIR", os.path.join(DATA_DIR, "log_archive"))
+LOG_AUTO_COMPACT = os.getenv("CMAIL_LOG_AUTO_COMPACT", "false").lower() == "true"  # Compact from the dashboard
+COMPACTION_INTERVAL = 6 * 3600  # Seconds between automatic compactions per user
+COMPACTION_BATCH_SIZE = 500  # Entries removed per multi-location update
+LOG_WRITE_BATCH_SIZE = 500  # Entries written per multi-location update when logging many recipients
+LOG_FEED_SIZE = 20000  # Recent outcomes per user kept in the change feed for live dashboards
+SESSION_LOG_SIZE = 200  # Recent outcomes a browser session keeps in memory
+SESSION_LOG_CAMPAIGNS = 50  # Campaigns a browser session keeps references to
+EXPORT_PAGE_SIZE = 1000  # Entries read per key-ordered query during an export
+EXPORT_MIN_CAMPAIGN_PAGE_SIZE = 50  # Smallest page read per campaign when many campaigns are merged
+EXPORT_COLUMNS = ["Timestamp", "recipient", "status", "service", "subject", "error", "campaign_id"]
+
+# Campaign headers already written by this process
+_written_campaigns = set()
+_written_campaigns_lock = threading.Lock()
+
+# In-process change feed of logged outcomes. Every entry saved by this process is published
+# with an increasing sequence number, so a live view can pick up what is new since its last
+# look without reading the log back from the database.
+class LogFeed:
+    def __init__(self, size=LOG_FEED_SIZE):
+        self._size = size
+        self._entries = {}  # user email -> deque of (sequence, (recipient, status, epoch, service, error, entry key))
+        self._dropped = {}  # user email -> last sequence pushed out of the deque
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def publish(self, user_email, record):
+        with self._lock:
+            self._sequence += 1
+            entries = self._entries.setdefault(user_email, deque())
+            entries.append((self._sequence, record))
+            if len(entries) > self._size:
+                self._dropped[user_email] = entries.popleft()[0]
+
+    def sequence(self):
+        with self._lock:
+            return self._sequence
+
+    # Function to get the user's records published after sequence, as (records, new sequence, complete);
+    # complete is False when some of them were already dropped and the log has to be reloaded
+    def since(self, user_email, sequence):
+        with self._lock:
+            entries = self._entries.get(user_email, ())
+            complete = self._dropped.get(user_email, 0) <= sequence
+            # Sequences increase along the deque, so the new records are at its end
+            new = []
+            for entry_sequence, record in reversed(entries):
+                if entry_sequence <= sequence:
+                    break
+                new.append(record)
+            new.reverse()
+            return new, self._sequence, complete
+
+log_feed = LogFeed()
+
+# Outcomes of the campaigns started from one browser session, as a ring buffer of the latest
+# ones. Every outcome is also saved to the user's log in storage by save_email_log, so the
+# full record stays there: the session keeps only the ids of its campaigns to find it.
+class SessionDeliveryLog:
+    def __init__(self, size=SESSION_LOG_SIZE):
+        self.recent = deque(maxlen=size)  # {"Email", "Status", "Service", "Campaign"[, "Error"]}
+        self.campaign_ids = deque(maxlen=SESSION_LOG_CAMPAIGNS)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def append(self, outcome):
+        with self._lock:
+            self.recent.append(outcome)
+            self.total += 1
+            campaign_id = outcome.get("Campaign")
+            if campaign_id and (not self.campaign_ids or self.campaign_ids[-1] != campaign_id):
+                if campaign_id in self.campaign_ids:
+                    self.campaign_ids.remove(campaign_id)
+                self.campaign_ids.append(campaign_id)
+
+    def __len__(self):
+        return self.total
+
+# Function to sanitize email format
+def sanitize_email(email):
+    return email.replace('@', '_at_').replace('.', '_dot_')
+
+# Function to record one recipient outcome. Campaigns call this from background
+# threads, so it uses a fresh database reference instead of the shared `db` path state.
+def save_email_log(user_email, recipient, status, service, timestamp, subject=None, error=None, campaign_id=None):
+    sanitized_user_email = sanitize_email(user_email)
+    if campaign_id is None:
+        campaign_id = make_campaign_id(user_email, service, subject or "", "")
+    epoch = int(timestamp.timestamp())
+
+    entry = [recipient, STATUS_CODES.get(status, 0), epoch]
+    if error:
+        entry.append(str(error))
+
+    with time_stage("log", service):
+        database = get_database()
+        _write_campaign_header(database, user_email, campaign_id, subject, service, epoch)
+        pushed = database.child("email_log_entries").child(sanitized_user_email).child(campaign_id).push(entry)
+    # The entry key ("<campaign id>/<push id>") tells a live view whether it already loaded this entry
+    log_feed.publish(user_email, (recipient, status, epoch, service, str(error) if error else None,
+                                  f"{campaign_id}/{pushed['name']}"))
+    count_message(service, status)
+
+# Function to record the same outcome for many recipients of a campaign (e.g. "Scheduled"),
+# one entry each, written in multi-location updates of LOG_WRITE_BATCH_SIZE entries
+def save_email_logs(user_email, recipients, status, service, timestamp, subject=None, campaign_id=None):
+    sanitized_user_email = sanitize_email(user_email)
+    if campaign_id is None:
+        campaign_id = make_campaign_id(user_email, service, subject or "", "")
+    epoch = int(timestamp.timestamp())
+    status_code = STATUS_CODES.get(status, 0)
+
+    database = get_database()
+    _write_campaign_header(database, user_email, campaign_id, subject, service, epoch)
+    records = []
+    updates = {}
+
+    def flush():
+        with time_stage("log", service):
+            get_database().update(updates)
+        for record in records:
+            log_feed.publish(user_email, record)
+        count_message(service, status, len(records))
+        records.clear()
+        updates.clear()
+
+    for recipient in recipients:
+        key = database.generate_key()
+        updates[f"email_log_entries/{sanitized_user_email}/{campaign_id}/{key}"] = [recipient, status_code, epoch]
+        records.append((recipient, status, epoch, service, None, f"{campaign_id}/{key}"))
+        if len(updates) >= LOG_WRITE_BATCH_SIZE:
+            flush()
+    if updates:
+        flush()
+
+# Function to write the campaign's log header the first time this process logs for it
+def _write_campaign_header(database, user_email, campaign_id, subject, service, epoch):
+    with _written_campaigns_lock:
+        if (user_email, campaign_id) in _written_campaigns:
+            return
+    database.child("email_log_campaigns").child(sanitize_email(user_email)).child(campaign_id).update({
+        "s": subject if subject else "No Subject",
+        "v": SERVICE_CODES.get(service, service),
+        "t": epoch,
+    })
+    with _written_campaigns_lock:
+        _written_campaigns.add((user_email, campaign_id))
+
+# Function to convert epoch seconds to naive local times, matching how older logs were stamped
+def _local_times(epochs):
+    local_zone = datetime.datetime.now().astimezone().tzinfo
+    return pd.to_datetime(epochs, unit="s", utc=True).tz_convert(local_zone).tz_localize(None)
+
+# Function to turn change feed records into a DataFrame with LOG_COLUMNS
+def feed_records_frame(records):
+    recipients, statuses, epochs, services, errors, _ = zip(*records) if records else ((),) * 6
+    return pd.DataFrame({
+        "recipient": list(recipients),
+        "status": list(statuses),
+        "Timestamp": _local_times(list(epochs)),
+        "service": list(services),
+        "error": list(errors),
+    }, columns=LOG_COLUMNS)
+
+# Function to load the user's delivery log as a DataFrame with LOG_COLUMNS; with with_keys, returns
+# (DataFrame, set of the "<campaign id>/<push id>" keys of its entries)
+def load_email_logs(user_email, with_keys=False):
+    sanitized_user_email = sanitize_email(user_email)
+    with time_firebase("email_logs.get_campaigns"):
+        campaigns = db.child("email_log_campaigns").child(sanitized_user_email).get().val() or {}
+    with time_firebase("email_logs.get_entries"):
+        entries = db.child("email_log_entries").child(sanitized_user_email).get().val() or {}
+
+    recipients, statuses, epochs, services, errors = [], [], [], [], []
+    keys = set()
+    for campaign_id, campaign_entries in entries.items():
+        header = campaigns.get(campaign_id) or {}
+        service = SERVICE_NAMES.get(header.get("v"), header.get("v"))
+        for entry_key, entry in (campaign_entries or {}).items():
+            keys.add(f"{campaign_id}/{entry_key}")
+            recipients.append(entry[0])
+            statuses.append(STATUS_NAMES.get(entry[1], "Unknown"))
+            epochs.append(entry[2])
+            services.append(service)
+            errors.append(entry[3] if len(entry) > 3 else None)
+    frame = pd.DataFrame({
+        "recipient": recipients,
+        "status": statuses,
+        "Timestamp": _local_times(epochs),
+        "service": services,
+        "error": errors,
+    }, columns=LOG_COLUMNS)
+
+    # Logs written in the previous one-object-per-outcome layout
+    with time_firebase("email_logs.get"):
+        legacy = db.child("email_logs").child(sanitized_user_email).get().val() or {}
+    if legacy:
+        legacy_frame = pd.DataFrame(list(legacy.values())).reindex(columns=LOG_COLUMNS)
+        legacy_frame["Timestamp"] = pd.to_datetime(
+            legacy_frame["Timestamp"].str.rstrip("Z"), format="%Y-%m-%dT%H:%M:%S", errors="coerce")
+        frame = pd.concat([legacy_frame, frame], ignore_index=True) if len(frame) else legacy_frame
+    return (frame, keys) if with_keys else frame
+
+# Function to yield (path, epoch, record) for every raw entry of the user, old layout included
+def _raw_entries(database, sanitized_user_email):
+    campaigns = database.child("email_log_campaigns").child(sanitized_user_email).get().val() or {}
+    entries = database.child("email_log_entries").child(sanitized_user_email).get().val() or {}
+    for campaign_id, campaign_entries in entries.items():
+        header = campaigns.get(campaign_id) or {}
+        for entry_id, entry in (campaign_entries or {}).items():
+            yield f"email_log_entries/{sanitized_user_email}/{campaign_id}/{entry_id}", entry[2], {
+                "id": entry_id,
+                "campaign_id": campaign_id,
+                "subject": header.get("s"),
+                "service": SERVICE_NAMES.get(header.get("v"), header.get("v")),
+                "recipient": entry[0],
+                "status": STATUS_NAMES.get(entry[1], "Unknown"),
+                "error": entry[3] if len(entry) > 3 else None,
+            }
+
+    legacy = database.child("email_logs").child(sanitized_user_email).get().val() or {}
+    for entry_id, entry in legacy.items():
+        try:
+            stamped = datetime.datetime.strptime(entry.get("Timestamp", ""), "%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            continue
+        yield f"email_logs/{sanitized_user_email}/{entry_id}", int(stamped.timestamp()), {
+            "id": entry_id,
+            "campaign_id": None,
+            "subject": entry.get("subject"),
+            "service": entry.get("service"),
+            "recipient": entry.get("recipient"),
+            "status": entry.get("status"),
+            "error": entry.get("error"),
+        }
+
+# Function to append records to the user's gzip archive of one day, synced before returning
+def _archive_day(sanitized_user_email, day, records):
+    archive_dir = os.path.join(LOG_ARCHIVE_DIR, sanitized_user_email)
+    os.makedirs(archive_dir, exist_ok=True)
+    with open(os.path.join(archive_dir, f"{day}.jsonl.gz"), "ab") as archive_file:
+        # Each call appends one gzip member; readers see the members as one stream
+        with gzip.GzipFile(fileobj=archive_file, mode="wb") as archive:
+            for record in records:
+                archive.write((json.dumps(record) + "\n").encode("utf-8"))
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+
+# Function to roll entries older than the retention window into daily summaries and the
+# local archive. Returns the number of entries compacted.
+def compact_email_logs(user_email, retention_days=LOG_RETENTION_DAYS, now=None):
+    sanitized_user_email = sanitize_email(user_email)
+    database = get_database()
+    cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=retention_days)
+    cutoff_epoch = int(cutoff.timestamp())
+
+    with time_firebase("email_logs.compact_read"):
+        entries = list(_raw_entries(database, sanitized_user_email))
+    old_entries = [(path, epoch, record) for path, epoch, record in entries if epoch < cutoff_epoch]
+    if not old_entries:
+        return 0
+
+    # Detail first goes to the archive, so nothing is deleted before it is on disk
+    by_day = {}
+    for path, epoch, record in old_entries:
+        stamped = datetime.datetime.fromtimestamp(epoch)
+        record["Timestamp"] = stamped.strftime("%Y-%m-%dT%H:%M:%S")
+        by_day.setdefault(stamped.strftime("%Y-%m-%d"), []).append((path, record))
+    for day, day_entries in by_day.items():
+        _archive_day(sanitized_user_email, day, [record for _, record in day_entries])
+
+    # Counts are added to the stored daily totals in the same atomic update that deletes the entries
+    with time_firebase("email_logs.compact_read"):
+        summaries = database.child("email_log_daily").child(sanitized_user_email).get().val() or {}
+    updates = {}
+    for day, day_entries in sorted(by_day.items()):
+        counts = dict(summaries.get(day) or {})
+        for path, record in day_entries:
+            key = f"{SERVICE_CODES.get(record['service'], 0)}_{STATUS_CODES.get(record['status'], 0)}"
+            counts[key] = counts.get(key, 0) + 1
+            updates[path] = None
+            updates[f"email_log_daily/{sanitized_user_email}/{day}/{key}"] = counts[key]
+            if len(updates) >= COMPACTION_BATCH_SIZE:
+                with time_firebase("email_logs.compact_write"):
+                    get_database().update(updates)
+                updates = {}
+
+    # Campaign headers whose entries are all compacted
+    remaining = {record["campaign_id"] for _, epoch, record in entries if epoch >= cutoff_epoch}
+    emptied = {record["campaign_id"] for _, _, record in old_entries if record["campaign_id"]} - remaining
+    for campaign_id in emptied:
+        updates[f"email_log_campaigns/{sanitized_user_email}/{campaign_id}"] = None
+    if updates:
+        with time_firebase("email_logs.compact_write"):
+            get_database().update(updates)
+    with _written_campaigns_lock:
+        _written_campaigns.difference_update((user_email, campaign_id) for campaign_id in emptied)
+
+    logging.info("Compacted %d email log entries older than %s for user %s", len(old_entries), cutoff.date(), user_email)
+    return len(old_entries)
+
+_last_compaction = {}  # user email -> monotonic time of the last automatic compaction
+_compaction_lock = threading.Lock()
+
+# Function to start a background compaction for the user when automatic compaction is
+# enabled and none ran recently
+def maybe_compact_email_logs(user_email):
+    if not LOG_AUTO_COMPACT:
+        return
+    with _compaction_lock:
+        last = _last_compaction.get(user_email)
+        if last is not None and time.monotonic() - last < COMPACTION_INTERVAL:
+            return
+        _last_compaction[user_email] = time.monotonic()
+
+    def compact():
+        try:
+            compact_email_logs(user_email)
+        except Exception as e:
+            logging.error(f"Error compacting email logs for user {user_email}: {e}")
+
+    threading.Thread(target=compact, daemon=True, name="cmail-log-compaction").start()
+
+# Function to load the daily counts of compacted entries as a DataFrame (Date, service, status, count)
+def load_email_log_summary(user_email):
+    with time_firebase("email_logs.get_daily"):
+        summaries = db.child("email_log_daily").child(sanitize_email(user_email)).get().val() or {}
+    rows = []
+    for day, counts in summaries.items():
+        for key, count in counts.items():
+            service_code, status_code = (int(code) for code in key.split("_"))
+            rows.append({
+                "Date": datetime.date.fromisoformat(day),
+                "service": SERVICE_NAMES.get(service_code, "Unknown"),
+                "status": STATUS_NAMES.get(status_code, "Unknown"),
+                "count": count,
+            })
+    return pd.DataFrame(rows, columns=["Date", "service", "status", "count"])
+
+# Function to read archived entries between two dates (inclusive) as a DataFrame with LOG_COLUMNS
+def query_log_archive(user_email, start_date, end_date):
+    archive_dir = os.path.join(LOG_ARCHIVE_DIR, sanitize_email(user_email))
+    records = []
+    for path in sorted(glob.glob(os.path.join(archive_dir, "*.jsonl.gz"))):
+        day = datetime.date.fromisoformat(os.path.basename(path)[:-len(".jsonl.gz")])
+        if start_date <= day <= end_date:
+            with gzip.open(path, "rt", encoding="utf-8") as archive:
+                records.extend(json.loads(line) for line in archive)
+    if not records:
+        return pd.DataFrame(columns=LOG_COLUMNS + ["subject"])
+    # A compaction interrupted after archiving can leave the same entry in the archive twice
+    frame = pd.DataFrame(records).drop_duplicates(subset="id")
+    frame["Timestamp"] = pd.to_datetime(frame["Timestamp"])
+    return frame[LOG_COLUMNS + ["subject"]].reset_index(drop=True)
+
+# Function to page through the children of a node in key order, up to end_key (inclusive).
+# make_ref builds the node's reference afresh, as pyrebase references reset after every get().
+def _key_pages(make_ref, page_size, end_key=None):
+    start = None
+    while True:
+        query = make_ref().order_by_key()
+        if start is not None:
+            query = query.start_at(start)
+        if end_key is not None:
+            query = query.end_at(end_key)
+        with time_firebase("email_logs.export_page"):
+            page = query.limit_to_first(page_size + (start is not None)).get().val() or {}
+        items = [(key, value) for key, value in page.items() if key != start]
+        if items:
+            yield items
+        if len(items) < page_size:
+            return
+        start = items[-1][0]
+
+# Function to yield (campaign_id, entry_id, entry) for every raw entry of the user, reading one page at a time
+def iter_log_entries(user_email, page_size=EXPORT_PAGE_SIZE):
+    sanitized_user_email = sanitize_email(user_email)
+    database = get_database()
+    with time_firebase("email_logs.get_campaigns"):
+        campaigns = database.child("email_log_campaigns").child(sanitized_user_email).get().val() or {}
+    for campaign_id in sorted(campaigns):
+        make_ref = lambda: database.child("email_log_entries").child(sanitized_user_email).child(campaign_id)
+        for entries in _key_pages(make_ref, page_size):
+            for entry_id, entry in entries:
+                yield campaign_id, entry_id, entry
+
+# Function to overwrite raw entries [(campaign_id, entry_id, entry)] in one multi-location update
+def update_log_entries(user_email, changes):
+    sanitized_user_email = sanitize_email(user_email)
+    updates = {f"email_log_entries/{sanitized_user_email}/{campaign_id}/{entry_id}": entry
+               for campaign_id, entry_id, entry in changes}
+    if updates:
+        with time_firebase("email_logs.update_entries"):
+            get_database().update(updates)
+
+# Function to yield the user's log entries between two dates (inclusive) as pages of rows in
+# EXPORT_COLUMNS order, optionally only some statuses and services. Archived days, each campaign's
+# entries and entries of the old layout are each read in time order and merged by timestamp,
+# so the rows come out in timestamp order. Archived entries are sorted one day at a time, and
+# each campaign holds at most one page of entries while they are merged.
+def iter_log_pages(user_email, start_date, end_date, statuses=None, services=None, page_size=EXPORT_PAGE_SIZE):
+    sanitized_user_email = sanitize_email(user_email)
+    database = get_database()
+    start_epoch = int(datetime.datetime.combine(start_date, datetime.time()).timestamp())
+    end_epoch = int(datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time()).timestamp())
+    statuses = set(statuses) if statuses else None
+    services = set(services) if services else None
+
+    def wanted(status, service):
+        return (statuses is None or status in statuses) and (services is None or service in services)
+
+    # Compacted days, streamed from the local archive; a day's file holds one run per
+    # compaction, so each day is sorted before it is merged
+    def archived_rows():
+        for path in sorted(glob.glob(os.path.join(LOG_ARCHIVE_DIR, sanitized_user_email, "*.jsonl.gz"))):
+            day = datetime.date.fromisoformat(os.path.basename(path)[:-len(".jsonl.gz")])
+            if not start_date <= day <= end_date:
+                continue
+            seen = set()  # A compaction interrupted after archiving can leave the same entry in the archive twice
+            rows = []
+            with gzip.open(path, "rt", encoding="utf-8") as archive:
+                for line in archive:
+                    record = json.loads(line)
+                    if record["id"] in seen or not wanted(record["status"], record["service"]):
+                        continue
+                    seen.add(record["id"])
+                    rows.append((datetime.datetime.fromisoformat(record["Timestamp"]), record["recipient"], record["status"],
+                                 record["service"], record.get("subject"), record.get("error"), record.get("campaign_id")))
+            rows.sort(key=lambda row: row[0])
+            yield from rows
+
+    # Raw entries of one campaign; push keys start with their creation time, so key order is
+    # time order and keys created after the range are never read
+    end_key = push_key_prefix(end_epoch * 1000)
+
+    def campaign_rows(campaign_id, header, campaign_page_size):
+        service = SERVICE_NAMES.get(header.get("v"), header.get("v"))
+        make_ref = lambda: database.child("email_log_entries").child(sanitized_user_email).child(campaign_id)
+        for entries in _key_pages(make_ref, campaign_page_size, end_key):
+            for _, entry in entries:
+                status = STATUS_NAMES.get(entry[1], "Unknown")
+                if start_epoch <= entry[2] < end_epoch and wanted(status, service):
+                    yield (datetime.datetime.fromtimestamp(entry[2]), entry[0], status, service, header.get("s"),
+                           entry[3] if len(entry) > 3 else None, campaign_id)
+
+    # Entries of the old layout, also in key order
+    def legacy_rows():
+        make_ref = lambda: database.child("email_logs").child(sanitized_user_email)
+        for entries in _key_pages(make_ref, page_size, end_key):
+            for _, entry in entries:
+                try:
+                    stamped = datetime.datetime.strptime(entry.get("Timestamp", ""), "%Y-%m-%dT%H:%M:%SZ")
+                except ValueError:
+                    continue
+                if start_epoch <= stamped.timestamp() < end_epoch and wanted(entry.get("status"), entry.get("service")):
+                    yield (stamped, entry.get("recipient"), entry.get("status"), entry.get("service"),
+                           entry.get("subject"), entry.get("error"), None)
+
+    with time_firebase("email_logs.get_campaigns"):
+        campaigns = database.child("email_log_campaigns").child(sanitized_user_email).get().val() or {}
+    campaigns = {campaign_id: header for campaign_id, header in campaigns.items()
+                 if services is None or SERVICE_NAMES.get(header.get("v"), header.get("v")) in services}
+    # Campaigns are read side by side, so their pages shrink as their number grows
+    campaign_page_size = max(EXPORT_MIN_CAMPAIGN_PAGE_SIZE, page_size // max(len(campaigns), 1))
+    sources = [archived_rows(), legacy_rows()]
+    sources.extend(campaign_rows(campaign_id, header, campaign_page_size) for campaign_id, header in sorted(campaigns.items()))
+
+    page = []
+    for row in heapq.merge(*sources, key=lambda row: row[0]):
+        page.append(row)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
@@ -0,0 +1,283 @@
+import re
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from html import escape
+from html.parser import HTMLParser
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# HTML message bodies are compiled once: <style> rules are inlined into style attributes
+# (mail clients drop or ignore <style> blocks), a plain-text alternative is generated, and
+# both are encoded into MIME parts that every recipient's message shares. Compiled bodies
+# are cached by their content, so a campaign, its resumes and later campaigns with the same
+# template reuse them; editing a template compiles the new content afresh.
+
+MAX_COMPILED_TEMPLATES = 32
+
+HTML_PATTERN = re.compile(
+    r"<(!doctype\s+html|html|head|body|p|div|span|br|hr|table|tr|td|h[1-6]|a|img|ul|ol|li|strong|em|b|i|center|font)[\s/>]",
+    re.IGNORECASE)
+STYLE_BLOCK_PATTERN = re.compile(r"<style\b[^>]*>(.*?)</style\s*>", re.IGNORECASE | re.DOTALL)
+CSS_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+SIMPLE_SELECTOR_PATTERN = re.compile(r"^(\*|[a-zA-Z][\w-]*)?((?:[.#][\w-]+)*)$")
+
+BLOCK_TAGS = {"p", "div", "table", "tr", "ul", "ol", "blockquote", "section", "article", "header", "footer",
+              "h1", "h2", "h3", "h4", "h5", "h6", "pre", "hr", "center"}
+PARAGRAPH_TAGS = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "table", "ul", "ol"}
+HIDDEN_TAGS = {"head", "style", "script", "title"}
+
+# Function to tell an HTML body from plain text
+def is_html(content):
+    return bool(content) and HTML_PATTERN.search(content) is not None
+
+# Function to parse a declaration block "a: b; c: d" into [(property, value)]
+def parse_declarations(text):
+    declarations = []
+    for item in text.split(";"):
+        name, separator, value = item.partition(":")
+        if separator and name.strip() and value.strip():
+            declarations.append((name.strip().lower(), value.strip()))
+    return declarations
+
+# Function to split a stylesheet into rules that can be inlined, as
+# (specificity, order, (tag, ids, classes), declarations), and CSS that has to stay in a
+# <style> block (@media queries, pseudo-classes, combinators)
+def parse_stylesheet(css):
+    css = CSS_COMMENT_PATTERN.sub("", css)
+    rules, kept = [], []
+    position = 0
+    while True:
+        brace = css.find("{", position)
+        if brace < 0:
+            break
+        prelude = css[position:brace].strip()
+        if prelude.startswith("@"):
+            depth, end = 1, brace + 1
+            while end < len(css) and depth:
+                depth += {"{": 1, "}": -1}.get(css[end], 0)
+                end += 1
+            kept.append(css[position:end].strip())
+            position = end
+            continue
+        end = css.find("}", brace)
+        if end < 0:
+            end = len(css)
+        declarations = parse_declarations(css[brace + 1:end])
+        for selector in prelude.split(","):
+            selector = selector.strip()
+            match = SIMPLE_SELECTOR_PATTERN.match(selector)
+            if not selector or not declarations:
+                continue
+            if match is None:
+                kept.append(f"{selector} {{{css[brace + 1:end].strip()}}}")
+                continue
+            tag = match.group(1) if match.group(1) not in (None, "*") else None
+            parts = re.findall(r"[.#][\w-]+", match.group(2))
+            ids = {part[1:] for part in parts if part[0] == "#"}
+            classes = {part[1:] for part in parts if part[0] == "."}
+            specificity = (len(ids), len(classes), 1 if tag else 0)
+            rules.append((specificity, len(rules), (tag and tag.lower(), ids, classes), declarations))
+        position = end + 1
+    rules.sort(key=lambda rule: (rule[0], rule[1]))
+    return rules, kept
+
+# Rewrites the document with matching rules merged into each element's style attribute;
+# everything else is copied through as written
+class _StyleInliner(HTMLParser):
+    def __init__(self, rules, kept):
+        super().__init__(convert_charrefs=False)
+        self.rules = rules
+        self.kept = kept
+        self.out = []
+        self._in_style = False
+
+    def _start(self, tag, attrs, closed):
+        if tag == "style":
+            if self.kept:
+                # The rules that cannot be inlined stay in one block where the first stylesheet was
+                self.out.append("<style type=\"text/css\">\n" + "\n".join(self.kept) + "\n</style>")
+                self.kept = None
+            self._in_style = not closed
+            return
+        values = dict(attrs)
+        ids = set((values.get("id") or "").split())
+        classes = set((values.get("class") or "").split())
+        styles = OrderedDict()
+        for _, _, (rule_tag, rule_ids, rule_classes), declarations in self.rules:
+            if (rule_tag is None or rule_tag == tag) and rule_ids <= ids and rule_classes <= classes:
+                for name, value in declarations:
+                    styles.pop(name, None)
+                    styles[name] = value
+        if not styles:
+            self.out.append(self.get_starttag_text())
+            return
+        # Inline styles already on the element win over the stylesheet
+        for name, value in parse_declarations(values.get("style") or ""):
+            styles.pop(name, None)
+            styles[name] = value
+        attrs = [(name, value) for name, value in attrs if name != "style"]
+        attrs.append(("style", "; ".join(f"{name}: {value}" for name, value in styles.items())))
+        text = "".join(f" {name}" if value is None else f" {name}=\"{escape(value)}\"" for name, value in attrs)
+        self.out.append(f"<{tag}{text}{' /' if closed else ''}>")
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        if tag == "style":
+            self._in_style = False
+            return
+        self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if not self._in_style:
+            self.out.append(data)
+
+    def handle_entityref(self, name):
+        self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        self.out.append(f"&#{name};")
+
+    def handle_comment(self, data):
+        self.out.append(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.out.append(f"<!{decl}>")
+
+    def handle_pi(self, data):
+        self.out.append(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        self.out.append(f"<![{data}]>")
+
+# Function to move the rules of the document's <style> blocks into style attributes
+def inline_css(html):
+    css = "\n".join(STYLE_BLOCK_PATTERN.findall(html))
+    if not css.strip():
+        return html
+    rules, kept = parse_stylesheet(css)
+    inliner = _StyleInliner(rules, kept)
+    inliner.feed(html)
+    inliner.close()
+    return "".join(inliner.out)
+
+# Collects the readable text of a document, with line breaks where blocks end
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self._hidden = 0
+        self._links = []  # (href, position in out) of the open <a> elements
+
+    def _break(self, lines):
+        self.out.append("\n" * lines)
+
+    def handle_starttag(self, tag, attrs):
+        values = dict(attrs)
+        if tag in HIDDEN_TAGS:
+            self._hidden += 1
+        elif tag == "br":
+            self.out.append("\n")
+        elif tag == "li":
+            self.out.append("\n- ")
+        elif tag in ("td", "th"):
+            self.out.append(" ")
+        elif tag == "img" and values.get("alt"):
+            self.out.append(values["alt"])
+        elif tag == "a":
+            self._links.append((values.get("href") or "", len(self.out)))
+        if tag in PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in BLOCK_TAGS:
+            self._break(1)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in HIDDEN_TAGS or tag == "a":
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in HIDDEN_TAGS:
+            self._hidden = max(self._hidden - 1, 0)
+        elif tag == "a" and self._links:
+            href, start = self._links.pop()
+            label = "".join(self.out[start:]).strip()
+            if href and not href.startswith(("#", "mailto:", "javascript:")) and href != label:
+                self.out.append(f" ({href})")
+        if tag in PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in BLOCK_TAGS:
+            self._break(1)
+
+    def handle_data(self, data):
+        if not self._hidden:
+            self.out.append(re.sub(r"\s+", " ", data))
+
+# Function to derive the plain-text alternative of an HTML body
+def html_to_text(html):
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = [line.strip() for line in "".join(extractor.out).split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() + "\n"
+
+# An HTML body compiled into shared text/plain and text/html parts
+class CompiledTemplate:
+    def __init__(self, content):
+        self.html = inline_css(content)
+        self.text = html_to_text(content)
+        self.boundary = f"===============cmailalt{uuid.uuid4().hex}=="
+        self._text_part = MIMEText(self.text, "plain", "utf-8")
+        self._html_part = MIMEText(self.html, "html", "utf-8")
+        self._body_part = self.message(())
+
+    # Function to build a multipart/alternative message with one recipient's headers
+    def message(self, headers):
+        message = MIMEMultipart("alternative", boundary=self.boundary)
+        for name, value in headers:
+            message[name] = value
+        message.attach(self._text_part)
+        message.attach(self._html_part)
+        return message
+
+    # The shared multipart/alternative part, for nesting in a message with attachments
+    def body_part(self):
+        return self._body_part
+
+_compiled = OrderedDict()  # content -> CompiledTemplate, or None for plain text
+_template_contents = {}  # template id -> content last compiled for it
+_compiled_lock = threading.Lock()
+
+# Function to get the compiled form of a message body, or None when it is plain text
+def compile_message(content, template_id=None):
+    with _compiled_lock:
+        found = content in _compiled
+        if found:
+            _compiled.move_to_end(content)
+            compiled = _compiled[content]
+        if template_id is not None:
+            _template_contents[template_id] = content
+    if found:
+        return compiled
+
+    compiled = CompiledTemplate(content) if is_html(content) else None
+    if compiled is not None:
+        logging.info("Compiled HTML template (%d characters, %d inlined)", len(content), len(compiled.html))
+    with _compiled_lock:
+        compiled = _compiled.setdefault(content, compiled)
+        while len(_compiled) > MAX_COMPILED_TEMPLATES:
+            _compiled.popitem(last=False)
+    return compiled
+
+# Function to drop the compiled form of a template after it was edited or deleted
+def invalidate_template(template_id):
+    with _compiled_lock:
+        content = _template_contents.pop(template_id, None)
+        if content is not None:
+            _compiled.pop(content, None)
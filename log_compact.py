@@ -0,0 +1,26 @@
+import sys
+import argparse
+from email_logs import LOG_ARCHIVE_DIR, LOG_RETENTION_DAYS, compact_email_logs
+
+# Compaction of the delivery log. Entries older than the retention window are removed from the
+# database; their detail is archived under LOG_ARCHIVE_DIR/<user>/<YYYY-MM-DD>.jsonl.gz and
+# their counts are kept as daily totals.
+#
+#     python log_compact.py --user me@example.com --retention-days 30
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compact old Cmail delivery log entries into daily totals and a local archive.")
+    parser.add_argument("--user", required=True, help="Email address of the account whose log is compacted")
+    parser.add_argument("--retention-days", type=int, default=LOG_RETENTION_DAYS,
+                        help=f"Keep entries of the last N days in the database (default {LOG_RETENTION_DAYS})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.retention_days < 1:
+        sys.exit("--retention-days must be at least 1")
+    count = compact_email_logs(args.user, args.retention_days)
+    print(f"Compacted {count} entries; detail archived under {LOG_ARCHIVE_DIR}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import io
+import csv
+import sys
+import argparse
+import datetime
+import logging
+from email_logs import EXPORT_COLUMNS, iter_log_pages
+from campaigns import DATA_DIR
+
+# Export of the delivery log. Entries are read a page at a time in timestamp order and written
+# out as they arrive, so an export of millions of entries holds at most one archived day and
+# one page per campaign, and never builds a DataFrame of the whole log.
+#
+#     python log_export.py --user me@example.com --from 2024-01-01 --to 2024-01-31 \
+#         --status Failed --format parquet --output failures.parquet
+
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+PARQUET_ROW_GROUP_ROWS = 50000  # Rows buffered per Parquet row group
+
+# Function to write pages of rows as CSV to a binary file object; returns the number of rows
+def write_csv(pages, output):
+    text = io.TextIOWrapper(output, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for page in pages:
+        writer.writerows(page)
+        count += len(page)
+    text.flush()
+    text.detach()
+    return count
+
+# Function to write pages of rows as Parquet to a binary file object; returns the number of rows
+def write_parquet(pages, output):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("Timestamp", pa.timestamp("s"))] + [(name, pa.string()) for name in EXPORT_COLUMNS[1:]])
+    count = 0
+    buffered = []
+
+    def flush(writer):
+        columns = list(zip(*buffered))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+        buffered.clear()
+
+    with pq.ParquetWriter(output, schema) as writer:
+        for page in pages:
+            buffered.extend(page)
+            count += len(page)
+            if len(buffered) >= PARQUET_ROW_GROUP_ROWS:
+                flush(writer)
+        if buffered:
+            flush(writer)
+    return count
+
+# Function to export the user's log entries between two dates (inclusive) to a binary file object
+def export_email_logs(user_email, start_date, end_date, output, file_format="csv", statuses=None, services=None):
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {file_format}")
+    pages = iter_log_pages(user_email, start_date, end_date, statuses, services)
+    write = write_parquet if file_format == "parquet" else write_csv
+    count = write(pages, output)
+    logging.info("Exported %d email log entries from %s to %s for user %s as %s",
+                 count, start_date, end_date, user_email, file_format)
+    return count
+
+# Function to export into a new file under EXPORT_DIR; returns (path, number of rows)
+def export_email_logs_to_file(user_email, start_date, end_date, file_format="csv", statuses=None, services=None):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(EXPORT_DIR, f"email_log_{start_date}_{end_date}_{stamp}.{file_format}")
+    with open(path, "wb") as output:
+        count = export_email_logs(user_email, start_date, end_date, output, file_format, statuses, services)
+    return path, count
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Export the Cmail delivery log to CSV or Parquet.")
+    parser.add_argument("--user", required=True, help="Email address of the account whose log is exported")
+    parser.add_argument("--from", dest="start", type=datetime.date.fromisoformat, required=True, help="First day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=datetime.date.fromisoformat, required=True, help="Last day (YYYY-MM-DD)")
+    parser.add_argument("--status", action="append", help="Only entries with this status (repeatable)")
+    parser.add_argument("--service", action="append", help="Only entries sent with this service (repeatable)")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", default="-", help="File to write, or - for standard output")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output == "-":
+        count = export_email_logs(args.user, args.start, args.end, sys.stdout.buffer, args.format, args.status, args.service)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, "wb") as output:
+            count = export_email_logs(args.user, args.start, args.end, output, args.format, args.status, args.service)
+    print(f"Exported {count} entries", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import base64
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from dotenv import load_dotenv
+from metrics import time_stage
+from html_templates import compile_message
+from campaigns import IDEMPOTENCY_HEADER, idempotency_key, make_message_id
+
+# Load environment variables
+load_dotenv()
+
+# Message builders of the providers. The render pool's worker processes import this module
+# to render large campaigns, so it must not set up logging, open the database or start
+# anything when imported; gmail.py and outlook.py do that for the app process.
+
+# Function to create the email message
+def create_message(sender, to, subject, message_text, idempotency_key=None, attachments=None):
+    headers = [('to', to), ('from', sender), ('subject', subject)]
+    if idempotency_key:
+        headers += [('Message-ID', make_message_id(idempotency_key, sender)), (IDEMPOTENCY_HEADER, idempotency_key)]
+    # HTML bodies are compiled once (cached by content) into shared text and HTML parts
+    html_body = compile_message(message_text)
+    if attachments is not None:
+        # Only the headers and body are built and encoded per recipient; the attachments are shared
+        with time_stage("encode", "Gmail"):
+            body_part = html_body.body_part() if html_body else MIMEText(message_text)
+            raw = attachments.urlsafe_b64(body_part, headers)
+        return {'raw': raw}
+    with time_stage("mime", "Gmail"):
+        if html_body:
+            message = html_body.message(headers)
+        else:
+            message = MIMEText(message_text)
+            for name, value in headers:
+                message[name] = value
+        message_bytes = message.as_bytes()
+    with time_stage("encode", "Gmail"):
+        raw = base64.urlsafe_b64encode(message_bytes).decode()
+    return {'raw': raw}
+
+# Function to render a chunk of recipients into Gmail API payloads (runs in the render pool for large campaigns)
+def render_gmail_chunk(recipients, campaign_id, subject, message_text, attachments=None):
+    return [
+        create_message('me', recipient, subject, message_text,
+                       idempotency_key=idempotency_key(campaign_id, recipient, subject, message_text),
+                       attachments=attachments)
+        for recipient in recipients
+    ]
+
+# Function to build the message text of one Outlook email
+def build_outlook_message(sender_email, recipient_email, subject, message_text, key=None, attachments=None):
+    headers = [('From', sender_email), ('To', recipient_email), ('Subject', subject)]
+    if key:
+        headers += [('Message-ID', make_message_id(key, sender_email)), (IDEMPOTENCY_HEADER, key)]
+    html_body = compile_message(message_text)  # Shared text and HTML parts for an HTML body, else None
+    if attachments is not None:
+        # The encoded attachment parts are shared by every message of the campaign
+        body_part = html_body.body_part() if html_body else MIMEText(message_text, 'plain')
+        return attachments.message_bytes(body_part, headers)
+    if html_body:
+        return html_body.message(headers).as_string()
+    msg = MIMEMultipart()
+    for name, value in headers:
+        msg[name] = value
+    msg.attach(MIMEText(message_text, 'plain'))
+    return msg.as_string()
+
+# Function to render a chunk of campaign recipients into message texts (runs in the render pool for large campaigns)
+def render_outlook_chunk(recipients, campaign_id, subject, message_text, attachments=None):
+    sender_email = os.getenv("OUTLOOK_USER")
+    messages = []
+    for recipient in recipients:
+        with time_stage("mime", "Outlook"):
+            messages.append(build_outlook_message(sender_email, recipient, subject, message_text,
+                                                  idempotency_key(campaign_id, recipient, subject, message_text),
+                                                  attachments))
+    return messages
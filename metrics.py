@@ -0,0 +1,278 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import streamlit as st
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# In-process timing and counter metrics for the send pipeline and Firebase calls,
+# exposed in Prometheus text format (file and optional HTTP endpoint) and on the
+# operator metrics page.
+
+DATA_DIR = os.getenv("CMAIL_DATA_DIR", "cmail_data")
+METRICS_FILE = os.getenv("CMAIL_METRICS_FILE", os.path.join(DATA_DIR, "cmail_metrics.prom"))
+METRICS_FILE_INTERVAL = 15  # Seconds between metrics file rewrites
+METRICS_PORT = os.getenv("CMAIL_METRICS_PORT")  # Serve /metrics on this port when set
+METRICS_HOST = os.getenv("CMAIL_METRICS_HOST", "127.0.0.1")  # Interface of the /metrics endpoint
+# Metrics cover every user's sends, so the page is shown only to these accounts
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("CMAIL_ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_text(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_label_text(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    # Estimate a quantile from the bucket counts (upper bound of the matching bucket)
+    def quantile(self, series, fraction):
+        count = sum(series[:-1])
+        if not count:
+            return 0.0
+        target = fraction * count
+        running = 0
+        for index, bound in enumerate(self.buckets):
+            running += series[index]
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.snapshot().items()):
+            running = 0
+            for index, bound in enumerate(self.buckets):
+                running += series[index]
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, key, ('le', bound))} {running}")
+            running += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_label_text(self.label_names, key, ('le', '+Inf'))} {running}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, key)} {running}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "cmail_send_stage_seconds", "Time spent in each stage of the send pipeline.", ("stage", "service"))
+FIREBASE_SECONDS = Histogram(
+    "cmail_firebase_seconds", "Time spent in Firebase calls.", ("operation",))
+MESSAGES_TOTAL = Counter(
+    "cmail_messages_total", "Messages processed by outcome.", ("service", "status"))
+ERRORS_TOTAL = Counter(
+    "cmail_errors_total", "Errors raised inside timed sections.", ("section",))
+
+REGISTRY = [STAGE_SECONDS, FIREBASE_SECONDS, MESSAGES_TOTAL, ERRORS_TOTAL]
+
+# Context manager timing one stage of the send pipeline
+@contextmanager
+def time_stage(stage, service):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS_TOTAL.inc(section=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, service=service)
+
+# Context manager timing one Firebase call
+@contextmanager
+def time_firebase(operation):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS_TOTAL.inc(section=operation)
+        raise
+    finally:
+        FIREBASE_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+def count_message(service, status, amount=1):
+    MESSAGES_TOTAL.inc(amount, service=service, status=status)
+
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Function to atomically rewrite the Prometheus text file
+def write_metrics_file(path=METRICS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as metrics_file:
+        metrics_file.write(render_prometheus())
+    os.replace(temp_path, path)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+# Function to start the metrics file writer (and HTTP endpoint if configured) once per process
+def start_exporters():
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    def file_writer():
+        while True:
+            time.sleep(METRICS_FILE_INTERVAL)
+            try:
+                write_metrics_file()
+            except OSError as e:
+                logging.error(f"Error writing metrics file {METRICS_FILE}: {e}")
+
+    threading.Thread(target=file_writer, daemon=True, name="cmail-metrics-file").start()
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, int(METRICS_PORT)), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True, name="cmail-metrics-http").start()
+            logging.info(f"Serving Prometheus metrics on {METRICS_HOST}:{METRICS_PORT}")
+        except OSError as e:
+            logging.error(f"Could not start metrics endpoint on port {METRICS_PORT}: {e}")
+
+# Function to summarize a histogram as rows for the metrics page
+def histogram_rows(histogram):
+    rows = []
+    for key, series in histogram.snapshot().items():
+        count = sum(series[:-1])
+        row = dict(zip(histogram.label_names, key))
+        row.update({
+            "count": count,
+            "total (s)": round(series[-1], 3),
+            "mean (ms)": round(series[-1] / count * 1000, 3) if count else 0.0,
+            "p50 (ms)": histogram.quantile(series, 0.50) * 1000,
+            "p99 (ms)": histogram.quantile(series, 0.99) * 1000,
+        })
+        rows.append(row)
+    return rows
+
+def histogram_buckets(histogram, key):
+    series = histogram.snapshot().get(key)
+    if series is None:
+        return pd.Series(dtype=int)
+    labels = [f"<= {bound * 1000:g} ms" for bound in histogram.buckets] + ["> max"]
+    return pd.Series(series[:-1], index=labels)
+
+# Function to tell whether an account may see the metrics page
+def is_metrics_admin(user_email):
+    return bool(user_email) and user_email.strip().lower() in ADMIN_EMAILS
+
+# Streamlit interface for the operator metrics page
+def metrics_page(display_sidebar):
+    display_sidebar()
+    st.header("Send Pipeline Metrics")
+    if not is_metrics_admin(st.session_state.get("user_email")):
+        st.error("The metrics page is only available to administrators (CMAIL_ADMIN_EMAILS).")
+        return
+    st.caption(f"Metrics since process start. Prometheus text is written to {METRICS_FILE}"
+               + (f" and served on port {METRICS_PORT} at /metrics." if METRICS_PORT else "."))
+
+    st.subheader("Messages")
+    message_counts = [dict(service=key[0], status=key[1], count=value) for key, value in MESSAGES_TOTAL.snapshot().items()]
+    if message_counts:
+        st.dataframe(pd.DataFrame(message_counts))
+    else:
+        st.info("No messages processed yet.")
+
+    st.subheader("Send Stages")
+    stage_rows = histogram_rows(STAGE_SECONDS)
+    if stage_rows:
+        stage_df = pd.DataFrame(stage_rows).sort_values("total (s)", ascending=False)
+        st.dataframe(stage_df)
+        st.bar_chart(stage_df.set_index(stage_df["service"] + " / " + stage_df["stage"])["total (s)"])
+        selected = st.selectbox("Latency histogram", options=[f"{row['service']} / {row['stage']}" for row in stage_rows])
+        if selected:
+            service, stage = selected.split(" / ", 1)
+            st.bar_chart(histogram_buckets(STAGE_SECONDS, (stage, service)))
+    else:
+        st.info("No send stages timed yet.")
+
+    st.subheader("Firebase Calls")
+    firebase_rows = histogram_rows(FIREBASE_SECONDS)
+    if firebase_rows:
+        st.dataframe(pd.DataFrame(firebase_rows).sort_values("total (s)", ascending=False))
+    else:
+        st.info("No Firebase calls timed yet.")
+
+    errors = [dict(section=key[0], count=value) for key, value in ERRORS_TOTAL.snapshot().items()]
+    if errors:
+        st.subheader("Errors")
+        st.dataframe(pd.DataFrame(errors))
+
+    with st.expander("Prometheus text"):
+        st.code(render_prometheus(), language="text")
@@ -0,0 +1,191 @@
+import os
+import re
+import uuid
+import hashlib
+import logging
+import itertools
+import pandas as pd
+import streamlit as st
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Address books above this size switch the compose pages to large-list mode
+LARGE_LIST_THRESHOLD = int(os.getenv("CMAIL_LARGE_LIST_THRESHOLD", "1000"))
+PREVIEW_SIZE = 20  # Recipients shown in the preview of a large list
+SEARCH_RESULTS = 50  # Contacts offered per type-ahead search
+CSV_CACHE_ENTRIES = 16  # Parsed recipient CSVs kept for reruns of the compose pages
+
+# Recipients held server-side; pages render only its size and a short preview
+class RecipientSet:
+    def __init__(self, emails=(), source=""):
+        self.handle = uuid.uuid4().hex
+        self.source = source
+        self._emails = dict.fromkeys(emails)  # Insertion-ordered set
+
+    def update(self, emails):
+        self._emails.update(dict.fromkeys(emails))
+
+    def sample(self, size=PREVIEW_SIZE):
+        return list(itertools.islice(self._emails, size))
+
+    def __len__(self):
+        return len(self._emails)
+
+    def __iter__(self):
+        return iter(self._emails)
+
+    def __contains__(self, email):
+        return email in self._emails
+
+# Function to validate email format
+def is_valid_email(email):
+    pattern = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
+    valid = re.match(pattern, email) is not None
+    if not valid:
+        logging.warning(f"Invalid email format: {email}")
+    return valid
+
+# Function to process CSV emails
+def process_csv_emails(uploaded_file):
+    recipient_emails = set()  # Use a set to avoid duplicates
+    invalid_emails = []
+    try:
+        df = pd.read_csv(uploaded_file)
+        if 'email' not in df.columns:
+            logging.error("CSV missing 'email' column")
+            return None, "CSV must contain an 'email' column."
+
+        for email in df['email'].dropna().unique():  # Remove NaNs, get unique emails
+            email = email.strip()
+            if is_valid_email(email):
+                recipient_emails.add(email)
+            else:
+                invalid_emails.append(email)
+
+        if invalid_emails:
+            sample = ", ".join(invalid_emails[:PREVIEW_SIZE])
+            more = f" and {len(invalid_emails) - PREVIEW_SIZE} more" if len(invalid_emails) > PREVIEW_SIZE else ""
+            st.warning(f"{len(invalid_emails)} invalid email(s) in CSV: {sample}{more}")
+
+        logging.info(f"Processed CSV - valid emails found: {len(recipient_emails)}")
+        return list(recipient_emails), None  # Return emails list and no error
+    except Exception as e:
+        logging.error(f"Error reading CSV: {e}")
+        return None, f"Error reading CSV: {e}"  # Return error for display
+
+# Function to parse an uploaded recipient CSV once per user and file content; reruns reuse the result
+@st.cache_data(max_entries=CSV_CACHE_ENTRIES, show_spinner=False)
+def load_csv_emails(user_email, csv_hash, _uploaded_file):
+    return process_csv_emails(_uploaded_file)
+
+# Function to get the content hash of an uploaded file, so a file still attached on a rerun is parsed only once
+def uploaded_file_hash(uploaded_file):
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+# Function to pick recipients from the address book.
+# Returns the selected emails and the value to prefill the recipient text input with.
+def select_contacts(contact_emails, contact_index=None, segments=()):
+    segment = None
+    if segments:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            chosen = st.selectbox("Segment", options=segments,
+                                  format_func=lambda segment: f"{segment.name} ({len(segment)} members)")
+        with col2:
+            if st.button("Send to Segment"):
+                segment = chosen
+
+    if len(contact_emails) <= LARGE_LIST_THRESHOLD:
+        selected_contacts = st.multiselect("Select Contacts", options=contact_emails)
+
+        if segment is not None:
+            selected_contacts = segment.emails()
+            st.session_state.selected_contacts = selected_contacts
+            st.success(f"Segment '{segment.name}': {len(selected_contacts)} contacts selected.")
+            logging.info("Segment %s with %d contacts selected for email", segment.name, len(selected_contacts))
+
+        if st.button("Send to All Contacts"):
+            selected_contacts = contact_emails
+            st.session_state.selected_contacts = selected_contacts
+            st.success(f"All {len(selected_contacts)} contacts selected.")
+            logging.info("All %d contacts selected for email", len(selected_contacts))
+
+        return selected_contacts, ", ".join(st.session_state.get("selected_contacts", selected_contacts))
+
+    # Large-list mode: no per-contact widgets, the selection stays server-side
+    st.caption(f"Large address book ({len(contact_emails)} contacts): recipients are kept on the server "
+               "and only a preview is shown.")
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if st.button("Send to All Contacts"):
+            st.session_state.selected_recipient_set = RecipientSet(contact_emails, source="All contacts")
+            logging.info("All %d contacts selected for email", len(contact_emails))
+    with col2:
+        if st.button("Clear Selection"):
+            st.session_state.pop("selected_recipient_set", None)
+
+    # Type-ahead lookup over the contact index instead of one option per contact
+    if contact_index is not None:
+        query = st.text_input("Find Contacts", placeholder="Start typing a name or email")
+        if query:
+            matches = contact_index.search(query, limit=SEARCH_RESULTS)
+            picked = st.multiselect(
+                f"Matching Contacts ({len(matches)} shown)",
+                options=[contact["email"] for contact in matches],
+            )
+            if picked and st.button("Add Selected"):
+                recipient_set = st.session_state.get("selected_recipient_set")
+                if recipient_set is None:
+                    recipient_set = st.session_state.selected_recipient_set = RecipientSet(source="Selected contacts")
+                recipient_set.update(picked)
+                logging.info("Added %d searched contacts to the recipient set", len(picked))
+
+    if segment is not None:
+        st.session_state.selected_recipient_set = RecipientSet(segment.emails(), source=f"Segment '{segment.name}'")
+        logging.info("Segment %s with %d contacts selected for email", segment.name, len(segment))
+
+    recipient_set = st.session_state.get("selected_recipient_set")
+    if recipient_set is not None:
+        st.success(f"{recipient_set.source}: {len(recipient_set)} contacts selected.")
+        return recipient_set, ""
+    return [], ""
+
+# Function to preview the recipients; large lists show only their size and a sample
+def show_recipient_preview(recipient_list):
+    if not recipient_list:
+        return
+    if len(recipient_list) <= LARGE_LIST_THRESHOLD:
+        st.write("Recipient Emails:")
+        st.dataframe(pd.DataFrame(list(recipient_list), columns=["Email"]))
+        return
+    st.write(f"Recipient Emails: {len(recipient_list)}")
+    sample = list(itertools.islice(recipient_list, PREVIEW_SIZE))
+    st.dataframe(pd.DataFrame(sample, columns=["Email"]))
+    st.caption(f"Showing the first {len(sample)} of {len(recipient_list)} recipients.")
+
+# Function to gather the recipients of the compose form: the typed addresses, the uploaded
+# CSV and the contact selection, without duplicates
+def collect_recipients(user_email, recipient_email, uploaded_file, selected_contacts):
+    recipient_list = set()
+
+    if recipient_email:
+        for email in recipient_email.split(','):
+            email = email.strip()
+            if is_valid_email(email):
+                recipient_list.add(email)
+            else:
+                st.error(f"Invalid email format: {email}")
+
+    if uploaded_file is not None:
+        csv_emails, csv_error = load_csv_emails(user_email, uploaded_file_hash(uploaded_file), uploaded_file)
+        if csv_error:
+            st.error(csv_error)
+        else:
+            recipient_list.update(csv_emails)
+
+    if isinstance(selected_contacts, RecipientSet):
+        recipient_list.update(selected_contacts)
+
+    return recipient_list
@@ -0,0 +1,129 @@
+import os
+import queue
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from metrics import time_stage
+
+# Load environment variables
+load_dotenv()
+
+# Render stage of the send pipeline. Large campaigns have their recipients turned into
+# ready-to-send payloads by a pool of worker processes, one chunk per task, while the
+# sending stage works through the chunks that are already rendered. A bounded queue
+# between the two stages keeps only a few chunks in flight, so memory stays flat and a
+# slow provider throttles rendering instead of letting payloads pile up.
+
+RENDER_WORKERS = int(os.getenv("CMAIL_RENDER_WORKERS", "0")) or os.cpu_count() or 1
+RENDER_CHUNK_SIZE = int(os.getenv("CMAIL_RENDER_CHUNK_SIZE", "500"))  # Recipients per render task
+RENDER_QUEUE_CHUNKS = RENDER_WORKERS * 2  # Chunks rendered or rendering ahead of the sending stage
+RENDER_MIN_RECIPIENTS = int(os.getenv("CMAIL_RENDER_MIN_RECIPIENTS", "5000"))  # Smaller campaigns render inline
+QUEUE_POLL_SECONDS = 0.5
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_DONE = object()
+
+# Function to decide whether a campaign is large enough to be worth the worker processes
+def use_render_pool(recipient_count):
+    return RENDER_WORKERS > 1 and recipient_count >= RENDER_MIN_RECIPIENTS
+
+# Function to get the process-wide render pool (started on first use and shared by campaigns).
+# Workers come from a fork server rather than forking the threaded app process.
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=context)
+            logging.info(f"Started render pool with {RENDER_WORKERS} worker processes")
+        return _render_pool
+
+# Function to drop a pool whose workers died, so the next campaign starts a fresh one
+def _discard_render_pool(pool):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Function to render (position, recipient) items in the pool, yielding ((position, recipient), payload)
+# in the original order. render_chunk(recipients, *args) must be a module-level function returning one
+# payload per recipient.
+def render_in_pool(render_chunk, items, args, service):
+    pool = get_render_pool()
+    rendered = queue.Queue(maxsize=RENDER_QUEUE_CHUNKS)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                rendered.put(entry, timeout=QUEUE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Submits chunks as long as the queue has room; blocks (bounding the work in flight) when it is full
+    def produce():
+        try:
+            for chunk in _chunks(items, RENDER_CHUNK_SIZE):
+                future = pool.submit(render_chunk, [recipient for _, recipient in chunk], *args)
+                if not put((chunk, future)):
+                    future.cancel()
+                    return
+        except Exception as e:
+            put((None, e))
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name="cmail-render", daemon=True)
+    producer.start()
+    try:
+        while True:
+            entry = rendered.get()
+            if entry is _DONE:
+                return
+            chunk, future = entry
+            if chunk is None:
+                raise future
+            # Time the sending stage spends waiting on rendering; near zero when the pool keeps up
+            with time_stage("render", service):
+                payloads = future.result()
+            yield from zip(chunk, payloads)
+    except BrokenProcessPool:
+        logging.error("Render pool workers exited unexpectedly; discarding the pool")
+        _discard_render_pool(pool)
+        raise
+    finally:
+        stop.set()
+        producer.join()
+        while True:
+            try:
+                entry = rendered.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _DONE and entry[0] is not None:
+                entry[1].cancel()
+
+# Function to pair every (position, recipient) item with its rendered payload, in worker
+# processes when parallel is set and one at a time in this thread otherwise
+def render_payloads(render_chunk, items, args, service, parallel=False):
+    if parallel:
+        yield from render_in_pool(render_chunk, items, args, service)
+        return
+    for item in items:
+        yield item, render_chunk([item[1]], *args)[0]
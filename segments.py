@@ -0,0 +1,185 @@
+from dotenv import load_dotenv
+import time
+import threading
+import logging
+from app_logging import setup_logging
+from metrics import time_firebase
+from storage import get_database
+
+# Load environment variables from .env file
+load_dotenv()
+setup_logging()
+
+# Database reference from the configured storage engine
+db = get_database()
+
+# Named contact segments. Definitions live under segments/<user>/<segment id> and the
+# materialized membership under segment_members/<user>/<segment id>/<contact id> = email,
+# kept in step with contact writes so a send to a segment is a single lookup.
+
+SEGMENT_FIELDS = {
+    "domain": "Email domain",
+    "tag": "Tag",
+    "source": "Imported from file",
+}
+MEMBERS_BATCH_SIZE = 500  # Membership paths written per multi-location update
+SEGMENTS_CACHE_TTL = 300  # Seconds before cached segments are reloaded (picks up other processes' changes)
+
+# Helper function to sanitize email
+def sanitize_email(email):
+    return email.replace('@', '_at_').replace('.', '_dot_')
+
+# Function to normalize a comma-separated tag string (or list) into a list of tags
+def parse_tags(tags):
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return sorted({tag.strip().lower() for tag in tags or () if tag and tag.strip()})
+
+class Segment:
+    def __init__(self, segment_id, name, field, value, members=None):
+        self.id = segment_id
+        self.name = name
+        self.field = field
+        self.value = value
+        self.members = dict(members or {})  # contact id -> email
+
+    # Whether the contact belongs to the segment; None when the contact lacks the rule's field
+    def matches(self, contact):
+        if self.field == "domain":
+            if "email" not in contact:
+                return None
+            return (contact["email"] or "").lower().rsplit("@", 1)[-1] == self.value.lower()
+        if self.field == "tag":
+            if "tags" not in contact:
+                return None
+            return self.value.lower() in parse_tags(contact["tags"])
+        if self.field == "source":
+            if "source" not in contact:
+                return None
+            return contact["source"] == self.value
+        return False
+
+    def emails(self):
+        return list(self.members.values())
+
+    def describe(self):
+        return f"{SEGMENT_FIELDS.get(self.field, self.field)}: {self.value}"
+
+    def __len__(self):
+        return len(self.members)
+
+_segments = {}  # user email -> ({segment id: Segment}, monotonic time they were loaded)
+_segments_lock = threading.Lock()
+
+# Function to load the user's segments and their members, cached for SEGMENTS_CACHE_TTL seconds
+def _load_segments(user_email):
+    with _segments_lock:
+        cached = _segments.get(user_email)
+    if cached is not None and time.monotonic() - cached[1] < SEGMENTS_CACHE_TTL:
+        return cached[0]
+    sanitized_email = sanitize_email(user_email)
+    with time_firebase("segments.get"):
+        definitions = db.child("segments").child(sanitized_email).get().val() or {}
+    with time_firebase("segments.get_members"):
+        members = db.child("segment_members").child(sanitized_email).get().val() or {}
+    loaded = {
+        segment_id: Segment(segment_id, data.get("name"), data.get("field"), data.get("value"), members.get(segment_id))
+        for segment_id, data in definitions.items()
+    }
+    with _segments_lock:
+        cached = _segments.get(user_email)
+        if cached is not None and time.monotonic() - cached[1] < SEGMENTS_CACHE_TTL:
+            return cached[0]  # Loaded by another thread meanwhile
+        _segments[user_email] = (loaded, time.monotonic())
+        return loaded
+
+# Function to drop the user's cached segments, so the next use reads them from the database
+def invalidate_segments(user_email):
+    with _segments_lock:
+        _segments.pop(user_email, None)
+
+# Function to write membership changes {"<segment id>/<contact id>": email or None} in batches
+def _write_members(sanitized_email, updates):
+    items = list(updates.items())
+    for start in range(0, len(items), MEMBERS_BATCH_SIZE):
+        with time_firebase("segments.update_members"):
+            db.child("segment_members").child(sanitized_email).update(dict(items[start:start + MEMBERS_BATCH_SIZE]))
+
+# Function to list the user's segments sorted by name
+def get_segments(user_email):
+    try:
+        return sorted(_load_segments(user_email).values(), key=lambda segment: (segment.name or "").lower())
+    except Exception as e:
+        logging.error(f"Error retrieving segments for user {user_email}: {e}")
+        return []
+
+# Function to get the emails of one segment's members
+def get_segment_members(user_email, segment_id):
+    segment = _load_segments(user_email).get(segment_id)
+    return segment.emails() if segment is not None else []
+
+# Function to create a segment and materialize its membership from the current contacts
+def create_segment(user_email, name, field, value, contacts):
+    if field not in SEGMENT_FIELDS:
+        raise ValueError(f"Unknown segment rule: {field}")
+    sanitized_email = sanitize_email(user_email)
+    segment_id = db.generate_key()
+    segment = Segment(segment_id, name, field, value)
+    segment.members = {contact["id"]: contact["email"] for contact in contacts if segment.matches(contact)}
+
+    try:
+        with time_firebase("segments.create"):
+            db.child("segments").child(sanitized_email).child(segment_id).set({"name": name, "field": field, "value": value})
+        _write_members(sanitized_email, {f"{segment_id}/{contact_id}": email for contact_id, email in segment.members.items()})
+    finally:
+        invalidate_segments(user_email)
+    logging.info("Created segment %s with %d members for user %s", name, len(segment), user_email)
+    return segment
+
+# Function to delete a segment and its membership list
+def delete_segment(user_email, segment_id):
+    sanitized_email = sanitize_email(user_email)
+    try:
+        with time_firebase("segments.delete"):
+            db.child("segment_members").child(sanitized_email).child(segment_id).remove()
+            db.child("segments").child(sanitized_email).child(segment_id).remove()
+    finally:
+        invalidate_segments(user_email)
+    logging.warning("Deleted segment %s for user %s", segment_id, user_email)
+
+# Function to bring every segment's membership in line with changed contacts.
+# upserts maps contact id -> contact fields (a partial dict leaves rules on missing fields alone);
+# removed lists deleted contact ids.
+def apply_contact_changes(user_email, upserts=None, removed=()):
+    segments = _load_segments(user_email)
+    if not segments:
+        return
+    updates = {}
+    with _segments_lock:
+        for segment in segments.values():
+            for contact_id, contact in (upserts or {}).items():
+                matched = segment.matches(contact)
+                if matched is None:
+                    if contact_id in segment.members and "email" in contact:
+                        segment.members[contact_id] = contact["email"]
+                        updates[f"{segment.id}/{contact_id}"] = contact["email"]
+                elif matched:
+                    segment.members[contact_id] = contact["email"]
+                    updates[f"{segment.id}/{contact_id}"] = contact["email"]
+                elif contact_id in segment.members:
+                    del segment.members[contact_id]
+                    updates[f"{segment.id}/{contact_id}"] = None
+            for contact_id in removed:
+                if segment.members.pop(contact_id, None) is not None:
+                    updates[f"{segment.id}/{contact_id}"] = None
+    if updates:
+        _write_members(sanitize_email(user_email), updates)
+
+# Function to empty every segment after all of the user's contacts were deleted
+def clear_segment_members(user_email):
+    segments = _load_segments(user_email)
+    with time_firebase("segments.clear_members"):
+        db.child("segment_members").child(sanitize_email(user_email)).remove()
+    with _segments_lock:
+        for segment in segments.values():
+            segment.members.clear()
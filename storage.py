@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import string
+import threading
+import logging
+import pyrebase
+from dotenv import load_dotenv
+from app_logging import setup_logging
+
+# Load environment variables from .env file
+load_dotenv()
+setup_logging()
+
+# Storage backend for contacts, templates, users and logs. Modules talk to a database
+# reference with the pyrebase path API (child/get/push/set/update/remove/generate_key);
+# CMAIL_STORAGE picks the engine behind it:
+#   firebase - the Firebase Realtime Database (default)
+#   sqlite   - a local SQLite file in WAL mode, for self-hosted deployments and offline runs
+
+STORAGE_ENGINE = os.getenv("CMAIL_STORAGE", "firebase").lower()
+DATA_DIR = os.getenv("CMAIL_DATA_DIR", "cmail_data")
+STORAGE_PATH = os.getenv("CMAIL_STORAGE_PATH", os.path.join(DATA_DIR, "cmail.db"))
+
+# Firebase Configuration
+config = {
+    "apiKey": os.getenv('API_KEY'),
+    "authDomain": os.getenv('AUTH_DOMAIN'),
+    "databaseURL": os.getenv('DATABASE_URL'),
+    "projectId": os.getenv('PROJECT_ID'),
+    "storageBucket": os.getenv('STORAGE_BUCKET'),
+    "messagingSenderId": os.getenv('MESSAGING_SENDER_ID'),
+    "appId": os.getenv('APP_ID')
+}
+
+PUSH_CHARS = "-" + string.digits + string.ascii_uppercase + "_" + string.ascii_lowercase
+
+# Function to get the 8-character time prefix of push keys generated at a time in epoch milliseconds.
+# Push keys sort by it, so it turns a time bound into a bound for key-ordered queries.
+def push_key_prefix(milliseconds):
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[milliseconds % 64])
+        milliseconds //= 64
+    return "".join(reversed(time_chars))
+
+# Result of a get(), shaped like pyrebase's response
+class StorageResponse:
+    def __init__(self, key, value):
+        self._key = key
+        self._value = value
+
+    def key(self):
+        return self._key
+
+    def val(self):
+        return self._value
+
+    def each(self):
+        if not isinstance(self._value, dict):
+            return []
+        return [StorageResponse(key, value) for key, value in self._value.items()]
+
+# Local engine: the tree is kept as one row per leaf value keyed by its slash-separated path,
+# so a subtree is a range scan of the primary key and every write is one transaction.
+class SQLiteEngine:
+    def __init__(self, path=STORAGE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._last_push_time = 0
+        self._last_rand_chars = []
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.commit()
+
+    # Rows of the subtree at path: the node itself and everything below it
+    def _subtree(self, path):
+        if not path:
+            return self._conn.execute("SELECT path, value FROM nodes ORDER BY path")
+        # "0" sorts right after "/", so this range is exactly the descendants of path
+        return self._conn.execute(
+            "SELECT path, value FROM nodes WHERE path = ? OR (path > ? AND path < ?) ORDER BY path",
+            (path, path + "/", path + "0")
+        )
+
+    def _delete(self, path):
+        if not path:
+            self._conn.execute("DELETE FROM nodes")
+            return
+        self._conn.execute("DELETE FROM nodes WHERE path = ? OR (path > ? AND path < ?)", (path, path + "/", path + "0"))
+        # A leaf stored at an ancestor would shadow the new children
+        parts = path.split("/")
+        self._conn.executemany("DELETE FROM nodes WHERE path = ?",
+                               (("/".join(parts[:end]),) for end in range(1, len(parts))))
+
+    def _insert(self, path, value):
+        rows = []
+        def flatten(prefix, node):
+            if isinstance(node, dict):
+                for key, child in node.items():
+                    if child is not None:
+                        flatten(f"{prefix}/{key}" if prefix else str(key), child)
+            else:
+                rows.append((prefix, json.dumps(node)))
+        flatten(path, value)
+        self._conn.executemany("INSERT OR REPLACE INTO nodes (path, value) VALUES (?, ?)", rows)
+
+    def get(self, path):
+        with self._lock:
+            rows = self._subtree(path).fetchall()
+        if not rows:
+            return None
+        depth = len(path.split("/")) if path else 0
+        tree = {}
+        for row_path, value in rows:
+            if row_path == path:
+                return json.loads(value)
+            parts = row_path.split("/")[depth:]
+            node = tree
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = json.loads(value)
+        return tree
+
+    # Function to get the children of path in key order, from start to end (both inclusive), at most limit of them
+    def get_children(self, path, start=None, end=None, limit=None):
+        depth = len(path.split("/"))
+        children = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, value FROM nodes WHERE path >= ? AND path < ? ORDER BY path",
+                (f"{path}/{start}" if start is not None else f"{path}/", path + "0")
+            )
+            for row_path, value in rows:
+                parts = row_path.split("/")[depth:]
+                key = parts[0]
+                if end is not None and key > end:
+                    break
+                if key not in children:
+                    if limit is not None and len(children) >= limit:
+                        break
+                    children[key] = {}
+                if len(parts) == 1:
+                    children[key] = json.loads(value)
+                    continue
+                node = children[key]
+                for part in parts[1:-1]:
+                    node = node.setdefault(part, {})
+                node[parts[-1]] = json.loads(value)
+        return children
+
+    # Function to apply {path: value} writes in one transaction; None removes the path
+    def write(self, changes):
+        with self._lock:
+            with self._conn:
+                for path, value in changes.items():
+                    self._delete(path)
+                    if value is not None and value != {}:
+                        self._insert(path, value)
+
+    # Time-ordered push keys in the same format as Firebase push IDs
+    def generate_key(self):
+        with self._lock:
+            now = int(time.time() * 1000)
+            duplicate_time = now == self._last_push_time
+            self._last_push_time = now
+            if not duplicate_time:
+                self._last_rand_chars = [random.randrange(64) for _ in range(12)]
+            else:
+                for index in range(11, -1, -1):
+                    if self._last_rand_chars[index] != 63:
+                        self._last_rand_chars[index] += 1
+                        break
+                    self._last_rand_chars[index] = 0
+            return push_key_prefix(now) + "".join(PUSH_CHARS[char] for char in self._last_rand_chars)
+
+# Database reference over the SQLite engine with the pyrebase path API
+class SQLiteDatabase:
+    def __init__(self, engine, path=(), query=None):
+        self._engine = engine
+        self._path = path
+        self._query = query  # {"start": key, "end": key, "limit": count} once order_by_key() was called
+
+    def child(self, *args):
+        parts = tuple(part for arg in args for part in str(arg).split("/") if part)
+        return SQLiteDatabase(self._engine, self._path + parts)
+
+    # Key-ordered queries, as in pyrebase: order_by_key() with start_at/end_at/limit_to_first
+    def _with_query(self, **changes):
+        return SQLiteDatabase(self._engine, self._path, dict(self._query or {}, **changes))
+
+    def order_by_key(self):
+        return self._with_query()
+
+    def start_at(self, key):
+        return self._with_query(start=str(key))
+
+    def end_at(self, key):
+        return self._with_query(end=str(key))
+
+    def limit_to_first(self, count):
+        return self._with_query(limit=count)
+
+    def _path_text(self, *extra):
+        return "/".join(self._path + extra)
+
+    def generate_key(self):
+        return self._engine.generate_key()
+
+    def get(self):
+        key = self._path[-1] if self._path else None
+        if self._query is not None:
+            return StorageResponse(key, self._engine.get_children(self._path_text(), **self._query))
+        return StorageResponse(key, self._engine.get(self._path_text()))
+
+    def push(self, data):
+        key = self.generate_key()
+        self._engine.write({self._path_text(key): data})
+        return {"name": key}
+
+    def set(self, data):
+        self._engine.write({self._path_text(): data})
+        return data
+
+    # Multi-location update: keys may address nested children as "a/b"
+    def update(self, data):
+        self._engine.write({self._path_text(*str(key).split("/")): value for key, value in data.items()})
+        return data
+
+    def remove(self):
+        self._engine.write({self._path_text(): None})
+
+_firebase = None
+_sqlite_engine = None
+_installed_database = None
+_storage_lock = threading.Lock()
+
+# Function to get the Firebase app, initialized on first use
+def get_firebase():
+    global _firebase
+    with _storage_lock:
+        if _firebase is None:
+            _firebase = pyrebase.initialize_app(config)
+        return _firebase
+
+# Function to replace the configured engine, e.g. with an in-memory stand-in
+def install_database(database):
+    global _installed_database
+    _installed_database = database
+
+# Function to get a database reference from the configured engine. Firebase references
+# carry path state, so threads that write in the background call this for a fresh one.
+def get_database():
+    global _sqlite_engine
+    if _installed_database is not None:
+        return _installed_database
+    if STORAGE_ENGINE == "sqlite":
+        with _storage_lock:
+            if _sqlite_engine is None:
+                _sqlite_engine = SQLiteEngine()
+                logging.info(f"Opened SQLite storage at {STORAGE_PATH}")
+        return SQLiteDatabase(_sqlite_engine)
+    if STORAGE_ENGINE != "firebase":
+        raise ValueError(f"Unknown storage engine: {STORAGE_ENGINE}")
+    return get_firebase().database()